@@ -1,7 +1,9 @@
 import logging
+from functools import partial
 
 import uvicorn
-from main_rest_api.utils import get_app, get_pipelines
+from main_rest_api.utils import get_app, get_pipelines, load_pipelines_in_background
+from main_rest_api.config import LOAD_PIPELINES_IN_BACKGROUND, WARM_UP_PIPELINES, ANALYSIS_QUESTIONS
 
 
 logging.basicConfig(format="%(asctime)s %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p")
@@ -11,7 +13,13 @@ logging.getLogger("haystack").setLevel(logging.INFO)
 
 
 app = get_app()
-pipelines = get_pipelines()  # Unused here, called to init the pipelines early
+if not LOAD_PIPELINES_IN_BACKGROUND:
+    # Loaded right away, like in the gunicorn master to share them with the workers
+    get_pipelines()
+# Each worker loads the pipelines that are not loaded yet and warms them up once started, so it can answer
+# the readiness probes in the meantime
+warm_up_query = ANALYSIS_QUESTIONS[0] if WARM_UP_PIPELINES and ANALYSIS_QUESTIONS else ""
+app.add_event_handler("startup", partial(load_pipelines_in_background, warm_up_query=warm_up_query))
 
 
 logger.info("Open http://127.0.0.1:8000/docs to see Swagger API Documentation.")
@@ -1,4 +1,5 @@
 import os
+import json
 from pathlib import Path
 
 
@@ -9,8 +10,55 @@ QUERY_PIPELINE_NAME = os.getenv("QUERY_PIPELINE_NAME", "query")
 INDEXING_PIPELINE_NAME = os.getenv("INDEXING_PIPELINE_NAME", "indexing")
 
 FILE_UPLOAD_PATH = os.getenv("FILE_UPLOAD_PATH", str((Path(__file__).parent / "file-upload").absolute()))
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", str(Path(FILE_UPLOAD_PATH) / "state.sqlite3"))
+
+# Inference backend of the readers: pytorch, quantized, onnx or onnx-quantized (see pipeline/reader_backend.py)
+READER_BACKEND = os.getenv("READER_BACKEND", "pytorch")
+READER_CACHE_PATH = os.getenv("READER_CACHE_PATH", str((Path(__file__).parent / "model-cache").absolute()))
+
+LOAD_PIPELINES_IN_BACKGROUND = os.getenv("LOAD_PIPELINES_IN_BACKGROUND", "true").lower() == "true"
+WARM_UP_PIPELINES = os.getenv("WARM_UP_PIPELINES", "true").lower() == "true"
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 ROOT_PATH = os.getenv("ROOT_PATH", "")
 
 CONCURRENT_REQUEST_PER_WORKER = int(os.getenv("CONCURRENT_REQUEST_PER_WORKER", "4"))
+REQUEST_QUEUE_SIZE = int(os.getenv("REQUEST_QUEUE_SIZE", "16"))
+REQUEST_QUEUE_TIMEOUT_MS = float(os.getenv("REQUEST_QUEUE_TIMEOUT_MS", "500"))
+# With an adaptive limit, CONCURRENT_REQUEST_PER_WORKER is the initial limit, adjusted between the bounds to the
+# latency of the requests. Off by default: the limit stays fixed.
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "false").lower() == "true"
+CONCURRENCY_LIMIT_MIN = int(os.getenv("CONCURRENCY_LIMIT_MIN", "1"))
+CONCURRENCY_LIMIT_MAX = int(os.getenv("CONCURRENCY_LIMIT_MAX", str(4 * CONCURRENT_REQUEST_PER_WORKER)))
+CONCURRENCY_LATENCY_TOLERANCE = float(os.getenv("CONCURRENCY_LATENCY_TOLERANCE", "2.0"))
+INFERENCE_WORKERS = int(
+    os.getenv(
+        "INFERENCE_WORKERS", str(CONCURRENCY_LIMIT_MAX if ADAPTIVE_CONCURRENCY else CONCURRENT_REQUEST_PER_WORKER)
+    )
+)
+
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "1"))
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "10"))
+ADVANCED_QUERY_WORKERS = int(os.getenv("ADVANCED_QUERY_WORKERS", "2"))
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1000"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "300"))
+# How often each worker checks whether another one invalidated the cache
+QUERY_CACHE_CHECK_INTERVAL_MS = float(os.getenv("QUERY_CACHE_CHECK_INTERVAL_MS", "100"))
+# Queries differing only in casing, accents, punctuation or whitespace share their cache entry. Set this to also
+# ignore their articles and the forms of "ser" (see `QUERY_KEY_STOPWORDS`).
+QUERY_KEY_STRIP_STOPWORDS = os.getenv("QUERY_KEY_STRIP_STOPWORDS", "false").lower() == "true"
+QUERY_COALESCING = os.getenv("QUERY_COALESCING", "true").lower() == "true"
+
+INDEXING_WORKERS = int(os.getenv("INDEXING_WORKERS", "1"))
+INDEXING_PROCESSES = int(os.getenv("INDEXING_PROCESSES", "0"))
+INDEXING_PAGES_PER_TASK = int(os.getenv("INDEXING_PAGES_PER_TASK", "50"))
+
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "1"))
+FEEDBACK_BATCH_WAIT_MS = float(os.getenv("FEEDBACK_BATCH_WAIT_MS", "1000"))
+FEEDBACK_WRITE_ATTEMPTS = int(os.getenv("FEEDBACK_WRITE_ATTEMPTS", "3"))
+
+HEALTH_SAMPLE_INTERVAL = float(os.getenv("HEALTH_SAMPLE_INTERVAL", "5"))
+
+ANALYSIS_QUESTIONS = json.loads(os.getenv("ANALYSIS_QUESTIONS", '["¿Cuál es el nombre del banco?"]'))
+ANALYSIS_TOP_K = int(os.getenv("ANALYSIS_TOP_K", "1"))
@@ -0,0 +1,189 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+from haystack import Pipeline
+
+from main_rest_api.pipeline.instrumentation import node_timings
+from main_rest_api.controller.utils import DeadlineExceeded, expired
+
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingQuery:
+    def __init__(
+        self, pipeline: Pipeline, query: str, params: Dict[str, Any], debug: bool, deadline: Optional[float] = None
+    ):
+        self.pipeline = pipeline
+        self.query = query
+        self.params = params
+        self.debug = debug
+        self.deadline = deadline
+        self.future: Future = Future()
+
+    def batch_key(self) -> Tuple[int, str, bool]:
+        """
+        Queries can only share a `Pipeline.run_batch` call if they only differ in their filters,
+        as filters are the only params the Retrievers accept per query.
+        """
+        shared_params: Dict[str, Any] = {}
+        for name, value in self.params.items():
+            if isinstance(value, dict):
+                value = {k: v for k, v in value.items() if k != "filters"}
+                if not value:
+                    continue
+            if name != "filters":
+                shared_params[name] = value
+        return id(self.pipeline), json.dumps(shared_params, sort_keys=True, default=str), self.debug
+
+
+def run_query_batch(pipeline: Pipeline, queries: List[str], params_list: List[Dict[str, Any]], debug: bool = False):
+    """
+    Runs several queries through `Pipeline.run_batch` and splits the output back into one result per query,
+    shaped like the output of `Pipeline.run`.
+
+    All the entries of `params_list` must only differ in their `filters`, which are passed on as a list
+    with one entry per query.
+    """
+    params: Dict[str, Any] = {}
+    for i, query_params in enumerate(params_list):
+        for name, value in query_params.items():
+            if name == "filters":
+                params.setdefault("filters", [None] * len(queries))[i] = value
+            elif isinstance(value, dict):
+                node_params = params.setdefault(name, {})
+                for key, node_value in value.items():
+                    if key == "filters":
+                        node_params.setdefault("filters", [None] * len(queries))[i] = node_value
+                    else:
+                        node_params[key] = node_value
+            else:
+                params[name] = value
+
+    with node_timings() as timings:
+        output = pipeline.run_batch(queries=queries, params=params, debug=debug)
+
+    results = []
+    for i, query in enumerate(queries):
+        result: Dict[str, Any] = {"query": query}
+        for key in ("answers", "documents"):
+            if output.get(key) is not None:
+                result[key] = output[key][i]
+        if debug:
+            # The nodes ran once for the whole batch, so all the queries share their timings
+            result["_debug"] = add_timing(dict(output.get("_debug") or {}), nodes=timings)
+        elif "_debug" in output:
+            result["_debug"] = output["_debug"]
+        results.append(result)
+    return results
+
+
+def add_timing(debug: Dict[str, Any], nodes: Optional[Dict[str, float]] = None, **timing: Any) -> Dict[str, Any]:
+    """
+    Adds timing information to the `_debug` output of a query, with the time spent in each node in `nodes`.
+    """
+    debug_timing = {**(debug.get("timing") or {}), **timing}
+    if nodes:
+        debug_timing["nodes"] = {name: round(elapsed, 4) for name, elapsed in nodes.items()}
+    debug["timing"] = debug_timing
+    return debug
+
+
+class QueryBatcher:
+    """
+    Collects the queries submitted by concurrent requests for up to `max_wait` seconds (or until `max_batch_size`
+    queries are waiting) and runs them together with `Pipeline.run_batch`, so that the Reader makes a single
+    forward pass for all of them. Each caller gets back a `Future` with the result of its own query.
+
+    A `max_batch_size` of 1 disables batching.
+    """
+
+    def __init__(self, max_batch_size: int, max_wait: float):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[_PendingQuery]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch_size > 1
+
+    def submit(
+        self,
+        pipeline: Pipeline,
+        query: str,
+        params: Dict[str, Any],
+        debug: bool = False,
+        deadline: Optional[float] = None,
+    ) -> Future:
+        """
+        Queues a query. Queries still waiting at their `deadline` (a `time.monotonic()` time) are not run, their
+        `Future` fails with `DeadlineExceeded`.
+        """
+        pending = _PendingQuery(pipeline=pipeline, query=query, params=params, debug=debug, deadline=deadline)
+        self._ensure_started()
+        self._queue.put(pending)
+        return pending.future
+
+    def _ensure_started(self):
+        # The dispatcher thread is started lazily, so that it's created in the process serving the requests
+        # and not in a parent process that forks the workers.
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._thread = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._dispatch, name="query-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> List[_PendingQuery]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._collect()
+            groups: Dict[Tuple[int, str, bool], List[_PendingQuery]] = {}
+            for pending in batch:
+                if expired(pending.deadline):
+                    pending.future.set_exception(DeadlineExceeded())
+                    continue
+                groups.setdefault(pending.batch_key(), []).append(pending)
+            for group in groups.values():
+                self._run(group)
+
+    def _run(self, group: List[_PendingQuery]):
+        start_time = time.time()
+        try:
+            results = run_query_batch(
+                pipeline=group[0].pipeline,
+                queries=[pending.query for pending in group],
+                params_list=[pending.params for pending in group],
+                debug=group[0].debug,
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            for pending in group:
+                pending.future.set_exception(e)
+            return
+        logger.info(f"Processed batch of {len(group)} queries in {(time.time() - start_time):.2f} seconds")
+        for pending, result in zip(group, results):
+            pending.future.set_result(result)
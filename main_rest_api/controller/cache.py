@@ -0,0 +1,199 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+from main_rest_api.controller.normalization import query_key
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCache:
+    """
+    LRU cache for query results, with a maximum number of entries and a time to live for each of them.
+
+    Every worker process keeps its own entries, so invalidations are shared through a small generation file:
+    `invalidate()` replaces it, and every worker drops its entries after noticing the change. Lookups check the file
+    at most every `check_interval` seconds; results are stored with the `generation()` read when their query
+    started, and dropped if the cache was invalidated since.
+
+    Queries are looked up by their normalized form (see `normalize_query`), with their articles stripped if
+    `strip_stopwords` is set.
+
+    A `max_size` of 0 disables the cache.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        generation_path: Optional[str] = None,
+        strip_stopwords: bool = False,
+        check_interval: float = 0.1,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.strip_stopwords = strip_stopwords
+        self.generation_path = Path(generation_path) if generation_path else None
+        self.check_interval = check_interval
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._generation: Optional[Tuple[int, int]] = None
+        # Incremented on each invalidation, seen in this worker or in another one
+        self._epoch = 0
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def key(self, query: str, pdf_name: Optional[str] = None, params: Optional[Dict[str, Any]] = None) -> str:
+        return query_key(query, pdf_name=pdf_name, params=params, strip_stopwords=self.strip_stopwords)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._check_generation()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def generation(self) -> int:
+        """
+        Returns the current generation of the cache, to pass on to `put` once the query ran.
+        """
+        with self._lock:
+            self._check_generation()
+            return self._epoch
+
+    def put(self, key: str, result: Dict[str, Any], generation: Optional[int] = None):
+        with self._lock:
+            if generation is not None:
+                # The result of a query started before an invalidation may not reflect the new documents
+                self._check_generation(force=True)
+                if generation != self._epoch:
+                    return
+            self._entries[key] = (time.monotonic() + self.ttl, dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self):
+        """
+        Drops all the cached results, in this worker and in all the others sharing the generation file.
+        Must be called every time the content of the DocumentStore changes.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+            self._epoch += 1
+            if self.generation_path:
+                # Replacing the file (instead of writing to it) gives it a new inode, which is more reliable
+                # than its modification time to detect changes
+                tmp_path = self.generation_path.with_name(f"{self.generation_path.name}.{uuid.uuid4().hex}")
+                tmp_path.write_text(uuid.uuid4().hex)
+                os.replace(tmp_path, self.generation_path)
+                self._generation = self._read_generation()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _read_generation(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.generation_path.stat()  # type: ignore
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _check_generation(self, force: bool = False):
+        if not self.generation_path:
+            return
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        generation = self._read_generation()
+        if generation != self._generation:
+            if self._entries:
+                logger.info("Query cache invalidated by another worker, dropping %s entries", len(self._entries))
+            self._entries.clear()
+            self._generation = generation
+            self._epoch += 1
+
+
+class QueryCoalescer:
+    """
+    Runs identical concurrent queries once: while a query is running, the requests with the same key wait for
+    its result instead of running it again. Works within a worker process, on its event loop.
+
+    The query keeps running when the request that started it is cancelled, as other requests can be waiting for it.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._in_flight: Dict[str, "asyncio.Future[Any]"] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.enabled:
+            return await func()
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.executed += 1
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done_task: self._done(key, done_task))
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: "asyncio.Future[Any]"):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Retrieves the exception, so it's not reported as lost when all the waiting requests were cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._in_flight),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
@@ -1,27 +1,50 @@
-from typing import List
+from typing import Any, Dict, Iterator, List, Optional
 
+import json
+import heapq
+import base64
+import hashlib
 import logging
 
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from haystack.document_stores import BaseDocumentStore
+from haystack.document_stores.filter_utils import LogicalFilterClause
+from haystack.document_stores.search_engine import SearchEngineDocumentStore
 from haystack.schema import Document
 
-from main_rest_api.utils import get_app, get_pipelines
+from main_rest_api.utils import get_app, on_pipelines_ready
+from main_rest_api.pipeline.custom_component import PdfShardedBM25Retriever
+from main_rest_api.pipeline.mmap_store import MmapDocumentStore
+from main_rest_api.controller.utils import require_ready
 from main_rest_api.config import LOG_LEVEL
-from main_rest_api.schema import FilterRequest
+from main_rest_api.schema import FilterRequest, PaginatedFilterRequest, DocumentPage
 
 
 logging.getLogger("haystack").setLevel(LOG_LEVEL)
 logger = logging.getLogger("haystack")
 
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(require_ready)])
 app: FastAPI = get_app()
-document_store: BaseDocumentStore = get_pipelines().get("document_store", None)
+document_store: Optional[BaseDocumentStore] = None
+query_cache = None
+file_registry = None
+sharded_retrievers: List[PdfShardedBM25Retriever] = []
+
+
+@on_pipelines_ready
+def _bind_pipelines(pipelines: Dict[str, Any]):
+    global document_store, query_cache, file_registry, sharded_retrievers  # pylint: disable=global-statement
+    document_store = pipelines.get("document_store", None)
+    query_cache = pipelines.get("query_cache", None)
+    file_registry = pipelines.get("file_registry", None)
+    query_pipeline = pipelines.get("query_pipeline", None)
+    sharded_retrievers = query_pipeline.get_nodes_by_class(PdfShardedBM25Retriever) if query_pipeline else []
 
 
 @router.post("/documents/get_by_filters", response_model=List[Document], response_model_exclude_none=True)
-def get_documents(filters: FilterRequest):
+def get_documents(filters: FilterRequest, stream: bool = False):
     """
     This endpoint allows you to retrieve documents contained in your document store.
     You can filter the documents to retrieve by metadata (like the document's name),
@@ -32,13 +55,98 @@ def get_documents(filters: FilterRequest):
 
     To get all documents you should provide an empty dict, like:
     `'{"filters": {}}'`
+
+    With `stream=true`, the documents are streamed as newline-delimited JSON (one document per line) while they're
+    read from the document store, without their embeddings. Use it for large results, as the memory it uses
+    doesn't depend on the number of documents.
     """
+    if stream:
+        documents = document_store.get_all_documents_generator(filters=filters.filters, return_embedding=False)
+        return StreamingResponse(_to_ndjson(documents), media_type="application/x-ndjson")
+
     docs = document_store.get_all_documents(filters=filters.filters)
     for doc in docs:
         doc.embedding = None
     return docs
 
 
+@router.post("/documents/get_by_filters/page", response_model=DocumentPage, response_model_exclude_none=True)
+def get_documents_page(request: PaginatedFilterRequest):
+    """
+    This endpoint returns the documents matching the filters one page at a time, in the order of their IDs,
+    without their embeddings. Pass the `next_cursor` of a page as `cursor` (with the same filters) to get the next
+    page; there's no `next_cursor` on the last page.
+
+    The cursor holds the ID of the last document of the page, so the documents written or deleted between two pages
+    don't shift the next ones: no document is skipped or returned twice.
+
+    Example:
+    `'{"filters": {"name": ["some"]}, "page_size": 100, "cursor": null}'`
+    """
+    filters_hash = _filters_hash(request.filters)
+    after_id = None
+    if request.cursor:
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(request.cursor.encode()))
+            after_id = str(cursor["after"])
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        if cursor.get("filters") != filters_hash:
+            raise HTTPException(status_code=400, detail="The cursor was created for other filters.")
+
+    # One more document than the page size is read to know if there's a next page
+    page = _documents_after(after_id, request.page_size + 1, filters=request.filters)
+
+    next_cursor = None
+    if len(page) > request.page_size:
+        page = page[: request.page_size]
+        next_cursor = base64.urlsafe_b64encode(
+            json.dumps({"after": page[-1].id, "filters": filters_hash}).encode()
+        ).decode()
+    return DocumentPage(documents=page, next_cursor=next_cursor)
+
+
+def _documents_after(after_id: Optional[str], limit: int, filters=None) -> List[Document]:
+    """
+    Returns the first `limit` documents matching the filters, in the order of their IDs, after `after_id`,
+    without their embeddings.
+    """
+    if isinstance(document_store, MmapDocumentStore):
+        return document_store.get_documents_after(after_id, limit, filters=filters)
+
+    if isinstance(document_store, SearchEngineDocumentStore):
+        # Elasticsearch and OpenSearch seek to the next page with search_after
+        body: Dict[str, Any] = {"size": limit, "sort": [{"_id": "asc"}], "query": {"bool": {}}}
+        if filters:
+            body["query"]["bool"]["filter"] = LogicalFilterClause.parse(filters).convert_to_elasticsearch()
+        if document_store.embedding_field:
+            body["_source"] = {"excludes": [document_store.embedding_field]}
+        if after_id is not None:
+            body["search_after"] = [after_id]
+        # pylint: disable=protected-access
+        hits = document_store._search(index=document_store.index, **body)["hits"]["hits"]
+        return [document_store._convert_es_hit_to_document(hit) for hit in hits]
+
+    # The other stores can't seek: their documents are read once, keeping the first `limit` after `after_id`
+    documents = document_store.get_all_documents_generator(filters=filters, return_embedding=False)
+    if after_id is not None:
+        documents = (document for document in documents if document.id > after_id)
+    page = heapq.nsmallest(limit, documents, key=lambda document: document.id)
+    for document in page:
+        document.embedding = None
+    return page
+
+
+def _to_ndjson(documents: Iterator[Document]) -> Iterator[str]:
+    for document in documents:
+        document.embedding = None
+        yield document.to_json() + "\n"
+
+
+def _filters_hash(filters) -> str:
+    return hashlib.sha256(json.dumps(filters or {}, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
 @router.post("/documents/delete_by_filters", response_model=bool)
 def delete_documents(filters: FilterRequest):
     """
@@ -53,4 +161,9 @@ def delete_documents(filters: FilterRequest):
     `'{"filters": {}}'`
     """
     document_store.delete_documents(filters=filters.filters)
+    # The shards are on disk, shared by the query and indexing pipelines: cleaning them once is enough
+    for retriever in sharded_retrievers[:1]:
+        retriever.delete_documents(filters=filters.filters)
+    query_cache.invalidate()
+    file_registry.clear()
     return True
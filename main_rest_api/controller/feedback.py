@@ -1,20 +1,25 @@
-from typing import Any, Dict, List, Union, Optional
+from typing import Any, Dict, Iterator, List, Tuple, Union, Optional
 
 import json
+import zlib
 import logging
 
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from haystack.schema import Label
 from haystack.document_stores import BaseDocumentStore
 from main_rest_api.schema import FilterRequest, CreateLabelSerialized
-from main_rest_api.utils import get_app, get_pipelines
+from main_rest_api.utils import get_app, on_pipelines_ready
+from main_rest_api.controller.utils import require_ready
 
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(require_ready)])
 app: FastAPI = get_app()
-document_store: BaseDocumentStore = get_pipelines().get("document_store", None)
+document_store: Optional[BaseDocumentStore] = None
+feedback_metrics = None
+label_writer = None
 
 
 @router.post("/feedback")
@@ -25,13 +30,30 @@ def post_feedback(feedback: CreateLabelSerialized):
     For example, the user can send feedback on whether the answer was correct and whether the right snippet was identified as the answer.
 
     Information submitted through this endpoint is used to train the underlying QA model.
+
+    With `FEEDBACK_BATCH_SIZE` above 1, the labels are buffered and written in batches, at most
+    `FEEDBACK_BATCH_WAIT_MS` after they're received.
     """
 
     if feedback.origin is None:
         feedback.origin = "user-feedback"
 
     label = Label(**feedback.dict())
-    document_store.write_labels([label])
+    label_writer.write([label])
+
+
+@router.post("/feedback/batch")
+def post_feedback_batch(feedbacks: List[CreateLabelSerialized]):
+    """
+    This endpoint works like `POST /feedback` for several labels at once, written to the DocumentStore
+    with a single call.
+    """
+    labels = []
+    for feedback in feedbacks:
+        if feedback.origin is None:
+            feedback.origin = "user-feedback"
+        labels.append(Label(**feedback.dict()))
+    label_writer.write(labels, flush=True)
 
 
 @router.get("/feedback", response_model=List[Label])
@@ -49,9 +71,30 @@ def delete_feedback():
     This endpoint allows the API user to delete all the feedback that has been sumbitted through the
     `POST /feedback` endpoint.
     """
-    all_labels = document_store.get_all_labels()
-    user_label_ids = [label.id for label in all_labels if label.origin == "user-feedback"]
-    document_store.delete_labels(ids=user_label_ids)
+    # Buffered labels are written first, so they're deleted too
+    label_writer.flush()
+    document_store.delete_labels(filters={"origin": ["user-feedback"]})
+    feedback_metrics.clear()
+
+
+def _record_feedback_metrics(labels: List[Label]):
+    feedback_metrics.record([label for label in labels if label.origin == "user-feedback"])
+
+
+@on_pipelines_ready
+def _bind_pipelines(pipelines: Dict[str, Any]):
+    global document_store, feedback_metrics, label_writer  # pylint: disable=global-statement
+    document_store = pipelines.get("document_store", None)
+    feedback_metrics = pipelines.get("feedback_metrics", None)
+    label_writer = pipelines.get("label_writer", None)
+    label_writer.on_write = _record_feedback_metrics
+
+
+@app.on_event("shutdown")
+def flush_feedback():
+    # Don't lose the labels waiting in the buffer
+    if label_writer:
+        label_writer.flush()
 
 
 @router.post("/eval-feedback")
@@ -60,6 +103,9 @@ def get_feedback_metrics(filters: Optional[FilterRequest] = None):
     This endpoint returns basic accuracy metrics based on user feedback, for example, the ratio of correct answers or correctly identified documents.
     You can filter the output by document or label.
 
+    Without filters, or with a filter on `document_id` or on `pdf_name` only, the metrics come from counts kept
+    up to date as feedback is written and deleted, without reading the labels.
+
     Example:
 
     `curl --location --request POST 'http://127.0.0.1:8000/eval-doc-qa-feedback' \
@@ -73,6 +119,13 @@ def get_feedback_metrics(filters: Optional[FilterRequest] = None):
     else:
         filters_content = {"origin": ["user-feedback"]}
 
+    if not feedback_metrics.initialized:
+        # Count the feedback written before the metrics were kept, once
+        feedback_metrics.rebuild(lambda: document_store.get_all_labels(filters={"origin": ["user-feedback"]}))
+    metrics = feedback_metrics.get(filters_content)
+    if metrics is not None:
+        return metrics
+
     labels = document_store.get_all_labels(filters=filters_content)
 
     res: Dict[str, Optional[Union[float, int]]]
@@ -91,12 +144,18 @@ def get_feedback_metrics(filters: Optional[FilterRequest] = None):
 
 @router.get("/export-feedback")
 def export_feedback(
-    context_size: int = 100_000, full_document_context: bool = True, only_positive_labels: bool = False
+    context_size: int = 100_000,
+    full_document_context: bool = True,
+    only_positive_labels: bool = False,
+    gzip: bool = False,
 ):
     """
     This endpoint returns JSON output in the SQuAD format for question/answer pairs that were marked as "relevant" by user feedback through the `POST /feedback` endpoint.
 
     The context_size param can be used to limit response size for large documents.
+
+    The questions about the same document (and context) are grouped under a single paragraph, and the output is
+    streamed one document at a time. With `gzip=true`, it's streamed as a gzip-compressed `feedback_squad.json.gz`.
     """
     if only_positive_labels:
         labels = document_store.get_all_labels(filters={"is_correct_answer": [True], "origin": ["user-feedback"]})
@@ -106,79 +165,84 @@ def export_feedback(
         # neither a "positive example" nor a negative "is_impossible" one)
         labels = [l for l in labels if not (l.is_correct_document is True and l.is_correct_answer is False)]
 
-    export_data = []
+    export = _squad_export(labels, context_size=context_size, full_document_context=full_document_context)
+    if gzip:
+        return StreamingResponse(
+            _gzip(export),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="feedback_squad.json.gz"'},
+        )
+    return StreamingResponse(export, media_type="application/json")
+
 
+def _squad_export(labels: List[Label], context_size: int, full_document_context: bool) -> Iterator[bytes]:
+    labels_by_document: Dict[str, List[Label]] = {}
     for label in labels:
-        answer_text = label.answer.answer if label and label.answer else ""
-
-        offset_start_in_document = 0
-        if label.answer and label.answer.offsets_in_document:
-            offset_start_in_document = label.answer.offsets_in_document[0].start
-
-        if full_document_context:
-            context = label.document.content
-            answer_start = offset_start_in_document
-        else:
-            text = label.document.content
-            # the final length of context(including the answer string) is 'context_size'.
-            # we try to add equal characters for context before and after the answer string.
-            # if either beginning or end of text is reached, we correspondingly
-            # append more context characters at the other end of answer string.
-            context_to_add = int((context_size - len(answer_text)) / 2)
-            start_pos = max(offset_start_in_document - context_to_add, 0)
-            additional_context_at_end = max(context_to_add - offset_start_in_document, 0)
-            end_pos = min(offset_start_in_document + len(answer_text) + context_to_add, len(text) - 1)
-            additional_context_at_start = max(
-                offset_start_in_document + len(answer_text) + context_to_add - len(text), 0
-            )
-            start_pos = max(0, start_pos - additional_context_at_start)
-            end_pos = min(len(text) - 1, end_pos + additional_context_at_end)
-            context = text[start_pos:end_pos]
-            answer_start = offset_start_in_document - start_pos
-
-        squad_label: Dict[str, Any]
-        if label.is_correct_answer is False and label.is_correct_document is False:  # No answer
-            squad_label = {
-                "paragraphs": [
-                    {
-                        "context": context,
-                        "id": label.document.id,
-                        "qas": [{"question": label.query, "id": label.id, "is_impossible": True, "answers": []}],
-                    }
-                ]
-            }
-        else:
-            squad_label = {
-                "paragraphs": [
-                    {
-                        "context": context,
-                        "id": label.document.id,
-                        "qas": [
-                            {
-                                "question": label.query,
-                                "id": label.id,
-                                "is_impossible": False,
-                                "answers": [{"text": answer_text, "answer_start": answer_start}],
-                            }
-                        ],
-                    }
-                ]
-            }
-
-            # quality check
-            start = squad_label["paragraphs"][0]["qas"][0]["answers"][0]["answer_start"]
-            answer = squad_label["paragraphs"][0]["qas"][0]["answers"][0]["text"]
-            context = squad_label["paragraphs"][0]["context"]
-            if not context[start : start + len(answer)] == answer:
-                logger.error(
-                    "Skipping invalid squad label as string via offsets ('%s') does not match answer string ('%s') ",
-                    context[start : start + len(answer)],
-                    answer,
-                )
-        export_data.append(squad_label)
-
-    export = {"data": export_data}
-
-    with open("feedback_squad_direct.json", "w", encoding="utf8") as f:
-        json.dump(export_data, f, ensure_ascii=False, sort_keys=True, indent=4)
-    return export
+        labels_by_document.setdefault(label.document.id, []).append(label)
+
+    yield b'{"data": ['
+    for i, (document_id, document_labels) in enumerate(labels_by_document.items()):
+        # Labels with the same context share a paragraph, so each context is written once
+        paragraphs: Dict[str, Dict[str, Any]] = {}
+        for label in document_labels:
+            context, answer_start = _squad_context(label, context_size, full_document_context)
+            paragraph = paragraphs.setdefault(context, {"context": context, "id": document_id, "qas": []})
+            paragraph["qas"].append(_squad_qa(label, context, answer_start))
+        squad_document = json.dumps({"paragraphs": list(paragraphs.values())}, ensure_ascii=False)
+        yield ((", " if i else "") + squad_document).encode("utf8")
+    yield b"]}"
+
+
+def _squad_context(label: Label, context_size: int, full_document_context: bool) -> Tuple[str, int]:
+    answer_text = label.answer.answer if label and label.answer else ""
+
+    offset_start_in_document = 0
+    if label.answer and label.answer.offsets_in_document:
+        offset_start_in_document = label.answer.offsets_in_document[0].start
+
+    if full_document_context:
+        return label.document.content, offset_start_in_document
+
+    text = label.document.content
+    # the final length of context(including the answer string) is 'context_size'.
+    # we try to add equal characters for context before and after the answer string.
+    # if either beginning or end of text is reached, we correspondingly
+    # append more context characters at the other end of answer string.
+    context_to_add = int((context_size - len(answer_text)) / 2)
+    start_pos = max(offset_start_in_document - context_to_add, 0)
+    additional_context_at_end = max(context_to_add - offset_start_in_document, 0)
+    end_pos = min(offset_start_in_document + len(answer_text) + context_to_add, len(text) - 1)
+    additional_context_at_start = max(offset_start_in_document + len(answer_text) + context_to_add - len(text), 0)
+    start_pos = max(0, start_pos - additional_context_at_start)
+    end_pos = min(len(text) - 1, end_pos + additional_context_at_end)
+    return text[start_pos:end_pos], offset_start_in_document - start_pos
+
+
+def _squad_qa(label: Label, context: str, answer_start: int) -> Dict[str, Any]:
+    if label.is_correct_answer is False and label.is_correct_document is False:  # No answer
+        return {"question": label.query, "id": label.id, "is_impossible": True, "answers": []}
+
+    answer_text = label.answer.answer if label and label.answer else ""
+    # quality check
+    if not context[answer_start : answer_start + len(answer_text)] == answer_text:
+        logger.error(
+            "Skipping invalid squad label as string via offsets ('%s') does not match answer string ('%s') ",
+            context[answer_start : answer_start + len(answer_text)],
+            answer_text,
+        )
+    return {
+        "question": label.query,
+        "id": label.id,
+        "is_impossible": False,
+        "answers": [{"text": answer_text, "answer_start": answer_start}],
+    }
+
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    # 31 = gzip header and trailer, with the largest window
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
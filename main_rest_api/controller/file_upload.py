@@ -1,27 +1,34 @@
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Tuple
 
 import logging
 import time
 import json
-import shutil
-import uuid
 from pathlib import Path
 
 from fastapi import FastAPI, APIRouter, UploadFile, File, Form, HTTPException, Depends
 from pydantic import BaseModel
 from haystack import Pipeline
-from haystack.nodes import BaseConverter, PreProcessor
-
-from main_rest_api.utils import get_app, get_pipelines
-from main_rest_api.config import FILE_UPLOAD_PATH, LOG_LEVEL
-from main_rest_api.controller.utils import as_form
-from main_rest_api.schema import QueryRequest
-
-router = APIRouter()
+from haystack.nodes import BaseConverter, BaseReader, PreProcessor
+from haystack.schema import Document
+
+from main_rest_api.utils import get_app, on_pipelines_ready
+from main_rest_api.config import FILE_UPLOAD_PATH, LOG_LEVEL, ANALYSIS_QUESTIONS, ANALYSIS_TOP_K
+from main_rest_api.controller.utils import as_form, require_ready
+from main_rest_api.uploads import save_upload, file_sha256
+from main_rest_api.schema import AnalyzePdfResponse, FileAnalysisResponse
+from main_rest_api.pipeline.analysis import answer_questions
+from main_rest_api.pipeline.custom_component import DocumentAnalyzer
+
+router = APIRouter(dependencies=[Depends(require_ready)])
 app: FastAPI = get_app()
-indexing_pipeline: Pipeline = get_pipelines().get("indexing_pipeline", None)
-query_pipeline: Pipeline = get_pipelines().get("query_pipeline", None)
-concurrency_limiter = get_pipelines().get("concurrency_limiter", None)
+indexing_pipeline: Optional[Pipeline] = None
+query_pipeline: Optional[Pipeline] = None
+concurrency_limiter = None
+query_cache = None
+indexing_jobs = None
+parallel_indexer = None
+file_registry = None
+document_store = None
 
 
 logging.getLogger("haystack").setLevel(LOG_LEVEL)
@@ -50,6 +57,25 @@ class Response(BaseModel):
     file_id: str
 
 
+class UploadResponse(BaseModel):
+    document_ids: List[str]
+
+
+class JobResponse(BaseModel):
+    job_id: str
+
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    files_total: int
+    files_converted: int
+    documents_written: int
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+
 @router.post("/file-upload")
 def upload_file(
     files: List[UploadFile] = File(...),
@@ -58,67 +84,163 @@ def upload_file(
     additional_params: Optional[str] = Form("null"),  # type: ignore
     fileconverter_params: FileConverterParams = Depends(FileConverterParams.as_form),  # type: ignore
     preprocessor_params: PreprocessorParams = Depends(PreprocessorParams.as_form),  # type: ignore
+    background: bool = False,
 ):
     """
     You can use this endpoint to upload a file for indexing
     (see https://haystack.deepset.ai/guides/rest-api#indexing-documents-in-the-haystack-rest-api-document-store).
+    It returns the ids of the documents created from the files. Files that were already indexed with the same
+    meta and params are not indexed again, the ids of their existing documents are returned instead.
+
+    With `background=true`, the files are indexed by a pool of background workers and the endpoint returns
+    a job id right away. Use `GET /jobs/{job_id}` to follow the progress of the indexing.
     """
     if not indexing_pipeline:
         raise HTTPException(status_code=501, detail="Indexing Pipeline is not configured.")
 
-    file_paths: list = []
-    file_metas: list = []
+    file_paths, file_metas, file_hashes = _save_files(files, meta)
+    params = _indexing_params(additional_params, fileconverter_params, preprocessor_params)
 
-    meta_form = json.loads(meta) or {}  # type: ignore
-    if not isinstance(meta_form, dict):
-        raise HTTPException(status_code=500, detail=f"The meta field must be a dict or None, not {type(meta_form)}")
+    if background:
+        payload = {
+            "file_paths": [str(file_path) for file_path in file_paths],
+            "file_hashes": file_hashes,
+            "meta": file_metas,
+            "params": params,
+        }
+        job_id = indexing_jobs.submit(payload, files_total=len(file_paths))
+        return JobResponse(job_id=job_id)
 
-    for file in files:
-        try:
-            file_path = Path(FILE_UPLOAD_PATH) / f"{uuid.uuid4().hex}_{file.filename}"
-            with file_path.open("wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-
-            file_paths.append(file_path)
-            meta_form["name"] = file.filename
-            file_metas.append(meta_form)
-        finally:
-            file.file.close()
-
-    params = json.loads(additional_params) or {}  # type: ignore
-
-    # Find nodes names
-    converters = indexing_pipeline.get_nodes_by_class(BaseConverter)
-    preprocessors = indexing_pipeline.get_nodes_by_class(PreProcessor)
-
-    for converter in converters:
-        params[converter.name] = fileconverter_params.dict()
-    for preprocessor in preprocessors:
-        params[preprocessor.name] = preprocessor_params.dict()
-
-    indexing_pipeline.run(file_paths=file_paths, meta=file_metas, params=params)
+    document_ids_per_file, _ = _index_files(file_paths, file_metas, params, file_hashes=file_hashes)
+    return UploadResponse(document_ids=[document_id for ids in document_ids_per_file for document_id in ids])
 
 
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+def get_job(job_id: str):
+    """
+    Get the status of an indexing job created with `POST /file-upload?background=true`, with the number of
+    files converted and documents written so far, and the error that stopped it if it failed.
+    """
+    job = indexing_jobs.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return JobStatusResponse(job_id=job["id"], **{key: job[key] for key in JobStatusResponse.__fields__ if key in job})
 
 
-@router.post("/analyze-pdf")
+@router.post("/analyze-pdf", response_model=AnalyzePdfResponse, response_model_exclude_none=True)
 def analyze_pdf(
     files: List[UploadFile] = File(...),
     # JSON serialized string
     meta: Optional[str] = Form("null"),  # type: ignore
     additional_params: Optional[str] = Form("null"),  # type: ignore
+    # JSON serialized list of strings
+    questions: Optional[str] = Form("null"),  # type: ignore
     fileconverter_params: FileConverterParams = Depends(FileConverterParams.as_form),  # type: ignore
     preprocessor_params: PreprocessorParams = Depends(PreprocessorParams.as_form),  # type: ignore
 ):
     """
-    You can use this endpoint to analyze pdfs from banks. You will receive an JSON object that indicates 
-    some parameters from the bank.
+    You can use this endpoint to analyze pdfs from banks. The files are indexed, then the analysis questions
+    (the ones configured with `ANALYSIS_QUESTIONS`, unless `questions` is given) are answered about the documents
+    of these files only, in a single batched pass of the Reader. You will receive the answers for each question.
+
+    If the indexing pipeline has a `DocumentAnalyzer` that already answered these questions about the files,
+    its stored answers are returned without running the Reader.
     """
     if not indexing_pipeline:
         raise HTTPException(status_code=501, detail="Indexing Pipeline is not configured.")
+    readers = query_pipeline.get_nodes_by_class(BaseReader) if query_pipeline else []
+    if not readers:
+        raise HTTPException(status_code=501, detail="The Query Pipeline has no Reader to analyze the files.")
+
+    analysis_questions = json.loads(questions) or ANALYSIS_QUESTIONS  # type: ignore
+    if not isinstance(analysis_questions, list) or not all(isinstance(q, str) for q in analysis_questions):
+        raise HTTPException(status_code=422, detail="The questions field must be a list of strings or None")
+
+    file_paths, file_metas, file_hashes = _save_files(files, meta)
+    params = _indexing_params(additional_params, fileconverter_params, preprocessor_params)
+
+    document_ids_per_file, documents = _index_files(file_paths, file_metas, params, file_hashes=file_hashes)
+    document_ids = [document_id for ids in document_ids_per_file for document_id in ids]
+
+    # The indexing pipeline may have answered these questions already
+    results = _precomputed_analysis(file_metas, document_ids_per_file, analysis_questions)
+    if results is not None:
+        return AnalyzePdfResponse(document_ids=document_ids, results=results)
+
+    # Files that were already indexed didn't produce new documents, their documents are fetched by id
+    new_document_ids = {document.id for document in documents}
+    missing_document_ids = [document_id for document_id in document_ids if document_id not in new_document_ids]
+    if missing_document_ids:
+        documents += document_store.get_documents_by_id(missing_document_ids)
+
+    start_time = time.time()
+    with concurrency_limiter.run():
+        results = answer_questions(readers[0], analysis_questions, documents, top_k=ANALYSIS_TOP_K)
+    logger.info(
+        f"Answered {len(analysis_questions)} questions about {len(documents)} documents "
+        f"in {(time.time() - start_time):.2f} seconds"
+    )
+
+    return AnalyzePdfResponse(document_ids=document_ids, results=results)
+
+
+@router.get("/analysis/{file_name}", response_model=FileAnalysisResponse, response_model_exclude_none=True)
+def get_file_analysis(file_name: str):
+    """
+    Get the answers to the analysis questions computed for a file when it was indexed. This needs a
+    `DocumentAnalyzer` node in the indexing pipeline.
+    """
+    analyzers = _get_analyzers()
+    if not analyzers:
+        raise HTTPException(status_code=501, detail="The Indexing Pipeline has no DocumentAnalyzer.")
+    results = analyzers[0].store.get(file_name)
+    if results is None:
+        raise HTTPException(status_code=404, detail=f"No analysis found for {file_name}.")
+    return FileAnalysisResponse(file=file_name, results=results)
 
+
+def _get_analyzers() -> List[DocumentAnalyzer]:
+    return indexing_pipeline.get_nodes_by_class(DocumentAnalyzer) if indexing_pipeline else []
+
+
+def _precomputed_analysis(
+    file_metas: List[Dict[str, Any]], document_ids_per_file: List[List[str]], questions: List[str]
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Returns the answers stored by the `DocumentAnalyzer` of the indexing pipeline for all the files,
+    or None if some file was not analyzed with these questions, on its current documents.
+    """
+    analyzers = _get_analyzers()
+    if not analyzers or analyzers[0].top_k != ANALYSIS_TOP_K:
+        return None
+    analyzer = analyzers[0]
+
+    files_results = []
+    for file_meta, file_document_ids in zip(file_metas, document_ids_per_file):
+        file = file_meta.get(analyzer.file_key)
+        # The stored answers may be about another file uploaded under the same name since
+        file_results = (
+            analyzer.store.get(str(file), questions=questions, document_ids=file_document_ids)
+            if file is not None
+            else None
+        )
+        if file_results is None:
+            return None
+        files_results.append(file_results)
+
+    # Keep the best answers to each question among all the files
+    results = []
+    for i, question in enumerate(questions):
+        answers = [answer for file_results in files_results for answer in file_results[i]["answers"]]
+        answers.sort(key=lambda answer: answer.score or 0.0, reverse=True)
+        results.append({"question": question, "answers": answers[:ANALYSIS_TOP_K]})
+    return results
+
+
+def _save_files(files: List[UploadFile], meta: Optional[str]) -> Tuple[List[Path], List[Dict[str, Any]], List[str]]:
     file_paths: list = []
     file_metas: list = []
+    file_hashes: list = []
 
     meta_form = json.loads(meta) or {}  # type: ignore
     if not isinstance(meta_form, dict):
@@ -126,16 +248,22 @@ def analyze_pdf(
 
     for file in files:
         try:
-            file_path = Path(FILE_UPLOAD_PATH) / f"{uuid.uuid4().hex}_{file.filename}"
-            with file_path.open("wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            file_path, file_hash = save_upload(file.file, filename=file.filename, directory=FILE_UPLOAD_PATH)
 
             file_paths.append(file_path)
-            meta_form["name"] = file.filename
-            file_metas.append(meta_form)
+            file_metas.append({**meta_form, "name": file.filename})
+            file_hashes.append(file_hash)
         finally:
             file.file.close()
 
+    return file_paths, file_metas, file_hashes
+
+
+def _indexing_params(
+    additional_params: Optional[str],
+    fileconverter_params: FileConverterParams,
+    preprocessor_params: PreprocessorParams,
+) -> Dict[str, Any]:
     params = json.loads(additional_params) or {}  # type: ignore
 
     # Find nodes names
@@ -147,36 +275,99 @@ def analyze_pdf(
     for preprocessor in preprocessors:
         params[preprocessor.name] = preprocessor_params.dict()
 
-    indexing_pipeline.run(file_paths=file_paths, meta=file_metas, params=params)
+    return params
 
-    # Create the preloaded queries for make to each file
-    # The queries will be various question about the file's content
 
-    listOfQueries = [
-        QueryRequest(query="¿Cuál es el nombre del banco?", filters=None, top_k_reader=1, top_k_retriever=1)
+def _index_files(
+    file_paths: List[Path],
+    file_metas: List[Dict[str, Any]],
+    params: Dict[str, Any],
+    file_hashes: Optional[List[str]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Tuple[List[List[str]], List[Document]]:
+    """
+    Runs the indexing pipeline on each file, skipping the files that were already indexed with the same meta
+    and params. Returns the ids of the documents of each file, and the documents written to the
+    DocumentStore by this call.
+    """
+    file_hashes = file_hashes or [file_sha256(file_path) for file_path in file_paths]
+    registry_keys = [
+        file_registry.key(file_hash, file_meta, params) for file_hash, file_meta in zip(file_hashes, file_metas)
     ]
+    document_ids: List[Optional[List[str]]] = [file_registry.get_document_ids(key) for key in registry_keys]
+    new_files = [i for i, ids in enumerate(document_ids) if ids is None]
+    skipped_files = len(file_paths) - len(new_files)
+    if skipped_files:
+        logger.info(f"Skipping {skipped_files} files that were already indexed")
+
+    def report_progress(files_converted: int, documents_written: int):
+        if progress:
+            progress(skipped_files + files_converted, documents_written)
+
+    report_progress(0, 0)
+    documents: List[Document] = []
+    documents_per_file: List[List[Document]] = []
+    try:
+        if parallel_indexer and parallel_indexer.enabled and new_files:
+            documents_per_file = parallel_indexer.run(
+                [file_paths[i] for i in new_files],
+                [file_metas[i] for i in new_files],
+                params,
+                progress=report_progress,
+            )
+        else:
+            for files_converted, i in enumerate(new_files, start=1):
+                result = indexing_pipeline.run(file_paths=[file_paths[i]], meta=[file_metas[i]], params=params)
+                documents_per_file.append(result.get("documents", None) or [])
+                report_progress(files_converted, sum(len(file_documents) for file_documents in documents_per_file))
+    finally:
+        if new_files:
+            query_cache.invalidate()
+
+    for i, file_documents in zip(new_files, documents_per_file):
+        documents += file_documents
+        document_ids[i] = [document.id for document in file_documents]
+        # Files that didn't produce any document are not remembered, so they can be retried
+        if file_documents:
+            file_registry.add(
+                registry_keys[i],
+                file_hashes[i],
+                file_paths[i],
+                document_ids[i],  # type: ignore
+                file_name=file_metas[i].get("name"),
+            )
+
+    return [ids or [] for ids in document_ids], documents
+
+
+def _run_indexing_job(payload: Dict[str, Any], progress: Callable[[int, int], None]):
+    file_paths = [Path(file_path) for file_path in payload["file_paths"]]
+    _index_files(
+        file_paths, payload["meta"], payload["params"], file_hashes=payload.get("file_hashes"), progress=progress
+    )
 
-    with concurrency_limiter.run():
-        result = _process_request(query_pipeline, listOfQueries[0])
-        return result
-    
-
-
-def _process_request(pipeline, request) -> Dict[str, Any]:
-    start_time = time.time()
 
-    params = request.params or {}
-    result = pipeline.run(query=request.query, params=params, debug=request.debug)
+@on_pipelines_ready
+def _bind_pipelines(pipelines: Dict[str, Any]):
+    global indexing_pipeline, query_pipeline, concurrency_limiter, query_cache  # pylint: disable=global-statement
+    global indexing_jobs, parallel_indexer, file_registry, document_store  # pylint: disable=global-statement
+    indexing_pipeline = pipelines.get("indexing_pipeline", None)
+    query_pipeline = pipelines.get("query_pipeline", None)
+    concurrency_limiter = pipelines.get("concurrency_limiter", None)
+    query_cache = pipelines.get("query_cache", None)
+    indexing_jobs = pipelines.get("indexing_jobs", None)
+    parallel_indexer = pipelines.get("parallel_indexer", None)
+    file_registry = pipelines.get("file_registry", None)
+    document_store = pipelines.get("document_store", None)
+    indexing_jobs.handler = _run_indexing_job
 
-    # Ensure answers and documents exist, even if they're empty lists
-    if not "documents" in result:
-        result["documents"] = []
-    if not "answers" in result:
-        result["answers"] = []
 
-    logger.info(
-        json.dumps({"request": request, "response": result, "time": f"{(time.time() - start_time):.2f}"}, default=str)
-    )
-    return result
+@app.on_event("startup")
+def start_indexing_jobs():
+    # Resume the jobs that were queued or interrupted before a restart, once the pipelines are loaded
+    on_pipelines_ready(_start_indexing_jobs)
 
 
+def _start_indexing_jobs(pipelines: Dict[str, Any]):
+    if pipelines.get("indexing_pipeline", None):
+        pipelines["indexing_jobs"].start()
@@ -1,19 +1,25 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 import logging
 
 import os
+import time
+import threading
 import pynvml
 import psutil
 
 from pydantic import BaseModel, Field, validator
 
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Depends
+from fastapi.responses import PlainTextResponse, JSONResponse
 
 import haystack
 
-from main_rest_api.utils import get_app
-from main_rest_api.config import LOG_LEVEL
+from main_rest_api.utils import get_app, on_pipelines_ready
+from main_rest_api.readiness import readiness
+from main_rest_api.config import LOG_LEVEL, HEALTH_SAMPLE_INTERVAL
+from main_rest_api.metrics import REGISTRY, Counter, Gauge
+from main_rest_api.controller.utils import AdaptiveRequestLimiter, require_ready
 
 logging.getLogger("haystack").setLevel(LOG_LEVEL)
 logger = logging.getLogger("haystack")
@@ -64,47 +70,255 @@ class HealthResponse(BaseModel):
     gpus: List[GPUInfo] = Field(default_factory=list, description="GPU usage details")
 
 
+class ResourceSampler:
+    """
+    Samples the CPU, memory and GPU usage of the worker every `interval` seconds in a background thread,
+    so that health probes read the last sample instead of querying the system and the GPUs.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._sampled_at = 0.0
+        self._process: Optional[psutil.Process] = None
+        self._has_gpus: Optional[bool] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Started in the process serving the requests, as threads don't survive forks
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._process = None
+                self._snapshot = None
+                self._thread = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+                self._thread.start()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the last sample, or takes one if the sampler isn't running.
+        """
+        with self._lock:
+            snapshot, sampled_at = self._snapshot, self._sampled_at
+        if snapshot is None or time.monotonic() - sampled_at > 2 * self.interval:
+            snapshot = self.sample()
+        return snapshot
+
+    def sample(self) -> Dict[str, Any]:
+        cpu_count = os.cpu_count() or 1
+        process = self._process
+        first_sample = process is None
+        if process is None:
+            process = self._process = psutil.Process()
+        # The CPU usage is measured since the previous call, the first one needs a short interval
+        cpu_usage = process.cpu_percent(interval=0.1 if first_sample else None) / cpu_count
+        snapshot = {
+            "cpu": cpu_usage,
+            "memory": process.memory_percent(),
+            "rss": process.memory_info().rss,
+            "gpus": self._sample_gpus(),
+            **self._sample_shared_memory(process),
+        }
+        with self._lock:
+            self._snapshot = snapshot
+            self._sampled_at = time.monotonic()
+        return snapshot
+
+    @staticmethod
+    def _sample_shared_memory(process: psutil.Process) -> Dict[str, Optional[int]]:
+        # The RSS counts the pages shared with the other workers (like the preloaded models) in full. The USS only
+        # counts the pages of this worker, and the PSS splits the shared ones between the processes sharing them.
+        try:
+            memory = process.memory_full_info()
+            return {"uss": getattr(memory, "uss", None), "pss": getattr(memory, "pss", None)}
+        except psutil.Error:
+            return {"uss": None, "pss": None}
+
+    def _sample_gpus(self) -> List[GPUInfo]:
+        gpus: List[GPUInfo] = []
+        if self._has_gpus is False:
+            return gpus
+
+        try:
+            if self._has_gpus is None:
+                pynvml.nvmlInit()
+            gpu_count = pynvml.nvmlDeviceGetCount()
+            for i in range(gpu_count):
+                handle = pynvml.nvmlDeviceGetHandleByIndex(i)
+                info = pynvml.nvmlDeviceGetMemoryInfo(handle)
+                gpu_mem_total = float(info.total) / 1024 / 1024
+                gpu_mem_used = None
+                for proc in pynvml.nvmlDeviceGetComputeRunningProcesses(handle):
+                    if proc.pid == os.getpid():
+                        gpu_mem_used = float(proc.usedGpuMemory) / 1024 / 1024
+                        break
+                gpu_info = GPUInfo(
+                    index=i,
+                    usage=GPUUsage(
+                        memory_total=round(gpu_mem_total),
+                        kernel_usage=pynvml.nvmlDeviceGetUtilizationRates(handle).gpu,
+                        memory_used=round(gpu_mem_used) if gpu_mem_used is not None else None,
+                    ),
+                )
+
+                gpus.append(gpu_info)
+            self._has_gpus = True
+        except pynvml.NVMLError:
+            if self._has_gpus is None:
+                logger.warning("No NVIDIA GPU found.")
+                self._has_gpus = False
+        return gpus
+
+    def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Could not sample the resource usage")
+            time.sleep(self.interval)
+
+
+resource_sampler = ResourceSampler(HEALTH_SAMPLE_INTERVAL)
+concurrency_limiter = None
+
+
+@on_pipelines_ready
+def _bind_pipelines(pipelines: Dict[str, Any]):
+    global concurrency_limiter  # pylint: disable=global-statement
+    concurrency_limiter = pipelines.get("concurrency_limiter", None)
+
+
+def _resource_metric(key: str):
+    def collect():
+        value = resource_sampler.snapshot().get(key)
+        return {(): value} if value is not None else {}
+
+    return collect
+
+
+def _gpu_metric(key: str, scale: float = 1.0):
+    def collect():
+        return {
+            (str(gpu.index),): getattr(gpu.usage, key) * scale
+            for gpu in resource_sampler.snapshot()["gpus"]
+            if getattr(gpu.usage, key) is not None
+        }
+
+    return collect
+
+
+def _limiter_metric(attribute: str):
+    return lambda: {(): getattr(concurrency_limiter, attribute)} if concurrency_limiter else {}
+
+
+REGISTRY.register(Gauge("process_cpu_usage_percent", "CPU usage of the worker", function=_resource_metric("cpu")))
+REGISTRY.register(
+    Gauge("process_memory_usage_percent", "Memory usage of the worker", function=_resource_metric("memory"))
+)
+REGISTRY.register(
+    Gauge("process_resident_memory_bytes", "Resident memory of the worker", function=_resource_metric("rss"))
+)
+REGISTRY.register(
+    Gauge("process_unique_memory_bytes", "Memory used by the worker only (USS)", function=_resource_metric("uss"))
+)
+REGISTRY.register(
+    Gauge(
+        "process_proportional_memory_bytes",
+        "Memory of the worker, with its share of the memory shared with other processes (PSS)",
+        function=_resource_metric("pss"),
+    )
+)
+REGISTRY.register(
+    Gauge("gpu_kernel_usage_percent", "GPU kernel usage", ("gpu",), function=_gpu_metric("kernel_usage"))
+)
+REGISTRY.register(
+    Gauge(
+        "gpu_memory_used_bytes", "GPU memory used by the worker", ("gpu",), function=_gpu_metric("memory_used", 2**20)
+    )
+)
+REGISTRY.register(
+    Gauge("request_limiter_in_flight", "Requests running in the worker", function=_limiter_metric("in_flight"))
+)
+REGISTRY.register(
+    Gauge("request_limiter_queue_depth", "Requests waiting for a slot", function=_limiter_metric("waiting"))
+)
+REGISTRY.register(
+    Counter(
+        "request_limiter_rejected_total",
+        "Requests rejected as the server was busy",
+        function=_limiter_metric("rejected"),
+    )
+)
+REGISTRY.register(
+    Gauge("request_limiter_limit", "Requests allowed to run at the same time", function=_limiter_metric("limit"))
+)
+REGISTRY.register(
+    Counter(
+        "request_limiter_adjustments_total",
+        "Changes of the adaptive limit, by direction",
+        ("direction",),
+        function=lambda: (
+            {("increase",): concurrency_limiter.increases, ("decrease",): concurrency_limiter.decreases}
+            if isinstance(concurrency_limiter, AdaptiveRequestLimiter)
+            else {}
+        ),
+    )
+)
+
+
+@app.on_event("startup")
+def start_resource_sampler():
+    resource_sampler.start()
+
+
 @router.get("/health", response_model=HealthResponse, status_code=200)
 def get_health_status():
     """
     This endpoint allows external systems to monitor the health of the Maulli3 REST API.
+
+    The usage is sampled in the background every `HEALTH_SAMPLE_INTERVAL` seconds, this endpoint returns
+    the last sample.
+    """
+    snapshot = resource_sampler.snapshot()
+
+    cpu_usage = CPUUsage(used=snapshot["cpu"])
+    memory_usage = MemoryUsage(used=snapshot["memory"])
+
+    return HealthResponse(version=haystack.__version__, cpu=cpu_usage, memory=memory_usage, gpus=snapshot["gpus"])
+
+
+class ReadinessResponse(BaseModel):
+    status: str = Field(..., description="loading, warming, ready or failed")
+    error: Optional[str] = Field(None, description="Error that stopped the loading")
+    component: Optional[str] = Field(None, description="Pipeline component that failed to load")
+
+
+@router.get("/ready", response_model=ReadinessResponse, responses={503: {"model": ReadinessResponse}})
+def get_readiness():
     """
+    This endpoint tells whether the worker is ready to serve requests, or is still loading or warming up its
+    pipelines (or failed to load them), for readiness probes. It answers with a 503 until the worker is ready.
+    """
+    return JSONResponse(readiness.to_dict(), status_code=200 if readiness.ready else 503)
+
 
-    gpus: List[GPUInfo] = []
-
-    try:
-        pynvml.nvmlInit()
-        gpu_count = pynvml.nvmlDeviceGetCount()
-        for i in range(gpu_count):
-            handle = pynvml.nvmlDeviceGetHandleByIndex(i)
-            info = pynvml.nvmlDeviceGetMemoryInfo(handle)
-            gpu_mem_total = float(info.total) / 1024 / 1024
-            gpu_mem_used = None
-            for proc in pynvml.nvmlDeviceGetComputeRunningProcesses(handle):
-                if proc.pid == os.getpid():
-                    gpu_mem_used = float(proc.usedGpuMemory) / 1024 / 1024
-                    break
-            gpu_info = GPUInfo(
-                index=i,
-                usage=GPUUsage(
-                    memory_total=round(gpu_mem_total),
-                    kernel_usage=pynvml.nvmlDeviceGetUtilizationRates(handle).gpu,
-                    memory_used=round(gpu_mem_used) if gpu_mem_used is not None else None,
-                ),
-            )
-
-            gpus.append(gpu_info)
-    except pynvml.NVMLError:
-        logger.warning("No NVIDIA GPU found.")
-
-    p_cpu_usage = 0
-    p_memory_usage = 0
-    cpu_count = os.cpu_count() or 1
-    p = psutil.Process()
-    p_cpu_usage = p.cpu_percent() / cpu_count
-    p_memory_usage = p.memory_percent()
-
-    cpu_usage = CPUUsage(used=p_cpu_usage)
-    memory_usage = MemoryUsage(used=p_memory_usage)
-
-    return HealthResponse(version=haystack.__version__, cpu=cpu_usage, memory=memory_usage, gpus=gpus)
+@router.get("/request-limiter", dependencies=[Depends(require_ready)])
+def get_request_limiter():
+    """
+    This endpoint returns the state of the worker's request limiter: its current limit, the requests running and
+    waiting, and, when the limit is adaptive, its bounds and its last adjustments.
+    """
+    return concurrency_limiter.stats()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    This endpoint exposes the metrics of the worker in the Prometheus text format: requests and latency by route,
+    state of the request limiter, and resource usage. The metrics are kept by each worker.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,160 @@
+from typing import Callable, List, Optional, Tuple
+
+import os
+import time
+import logging
+import threading
+
+from haystack.document_stores import BaseDocumentStore
+from haystack.schema import Label
+
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingLabel:
+    def __init__(self, label: Label):
+        self.label = label
+        self.attempts = 0
+
+
+class LabelWriter:
+    """
+    Buffers the labels written by concurrent requests and writes them to the DocumentStore with a single
+    `write_labels` call once `max_batch_size` labels are waiting, or at the latest `max_wait` seconds after
+    the first one. `on_write` is called with the labels after they're written.
+
+    When a batch can't be written, its labels are written one by one, so that a bad label doesn't hold back
+    the others. Labels that still fail are retried with the next batches, and dropped after `max_attempts`.
+
+    Buffered labels are lost if the worker is killed, so `flush` must be called on shutdown.
+    A `max_batch_size` of 1 writes each label right away.
+    """
+
+    def __init__(
+        self,
+        document_store: Optional[BaseDocumentStore],
+        max_batch_size: int,
+        max_wait: float,
+        on_write: Optional[Callable[[List[Label]], None]] = None,
+        max_attempts: int = 3,
+    ):
+        self.document_store = document_store
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.on_write = on_write
+        self.max_attempts = max_attempts
+        self._buffer: List[_PendingLabel] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def write(self, labels: List[Label], flush: bool = False):
+        """
+        Adds labels to the buffer, and writes the buffer if it's full or if `flush` is set. When the labels
+        are written in the caller's thread, the error of a label that can't be written is raised to the
+        caller, and the label isn't retried. The errors of the other labels of the batch are not raised.
+        """
+        pending = [_PendingLabel(label) for label in labels]
+        with self._lock:
+            self._buffer.extend(pending)
+            full = len(self._buffer) >= self.max_batch_size
+        if flush or full:
+            self._flush(pending)
+        else:
+            self._ensure_started()
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Writes the buffered labels. Labels that can't be written are kept in the buffer to be retried,
+        up to `max_attempts` times, and their errors are logged rather than raised.
+        """
+        self._flush([])
+
+    def _flush(self, own_labels: List[_PendingLabel]):
+        # Writes are serialized, so that a label written again is never overwritten by an older version
+        with self._write_lock:
+            with self._lock:
+                pending, self._buffer = self._buffer, []
+            if not pending:
+                return
+            start_time = time.time()
+            written, failed = self._write_labels(pending)
+            if written:
+                logger.debug(f"Wrote {len(written)} labels in {(time.time() - start_time):.2f} seconds")
+
+            own_error: Optional[Exception] = None
+            retried = []
+            for pending_label, error in failed:
+                if any(pending_label is own_label for own_label in own_labels):
+                    # Reported to the caller, who can send it again
+                    own_error = own_error or error
+                    continue
+                pending_label.attempts += 1
+                if pending_label.attempts >= self.max_attempts:
+                    logger.error(
+                        f"Dropping the feedback label {pending_label.label.id} after {pending_label.attempts} "
+                        f"failed attempts to write it: {error!r}"
+                    )
+                else:
+                    retried.append(pending_label)
+            if retried:
+                # Put them back in front, to be retried with the next write
+                with self._lock:
+                    self._buffer = retried + self._buffer
+        if written and self.on_write:
+            self.on_write(written)
+        if own_error is not None:
+            raise own_error
+
+    def _write_labels(self, pending: List[_PendingLabel]) -> Tuple[List[Label], List[Tuple[_PendingLabel, Exception]]]:
+        """
+        Writes the labels in a single call, or one by one if that call fails. Returns the labels written, and
+        the ones that could not be written with their error.
+        """
+        labels = [pending_label.label for pending_label in pending]
+        try:
+            self.document_store.write_labels(labels)
+            return labels, []
+        except Exception as error:  # pylint: disable=broad-except
+            if len(pending) == 1:
+                return [], [(pending[0], error)]
+            logger.warning(f"Could not write a batch of {len(labels)} labels, writing them one by one: {error!r}")
+
+        written, failed = [], []
+        for pending_label in pending:
+            try:
+                self.document_store.write_labels([pending_label.label])
+                written.append(pending_label.label)
+            except Exception as error:  # pylint: disable=broad-except
+                failed.append((pending_label, error))
+        return written, failed
+
+    def _ensure_started(self):
+        # The flushing thread is started lazily, so that it's created in the process serving the requests
+        # and not in a parent process that forks the workers.
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="label-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # Give the other labels of the batch the time to arrive
+            time.sleep(self.max_wait)
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Could not write the feedback labels")
+            with self._lock:
+                if self._buffer:
+                    # Some labels are waiting to be retried
+                    self._wakeup.set()
@@ -0,0 +1,50 @@
+from typing import Any, Dict, Optional
+
+import json
+import unicodedata
+
+
+COMBINING_TILDE = "\u0303"
+
+# Words dropped from the cache keys with `strip_stopwords`. Unlike the stopwords used to score passages, they must
+# never change the answer: question words ("quién", "cuándo"...), negations and prepositions are kept.
+QUERY_KEY_STOPWORDS = {"el", "la", "los", "las", "lo", "un", "una", "unos", "unas", "es", "son"}
+
+
+def _fold_accents(text: str) -> str:
+    # "Cuál" and "cual" are the same word, but "año" and "ano" are not: the tilde of the ñ is kept
+    decomposed = unicodedata.normalize("NFD", text)
+    folded = []
+    for char in decomposed:
+        if unicodedata.combining(char) and not (char == COMBINING_TILDE and folded and folded[-1] == "n"):
+            continue
+        folded.append(char)
+    return unicodedata.normalize("NFC", "".join(folded))
+
+
+def normalize_query(query: str, strip_stopwords: bool = False) -> str:
+    """
+    Returns the canonical form of a query, identical for the queries that only differ in their casing, accents,
+    punctuation (like "¿...?") or whitespace. With `strip_stopwords`, the Spanish articles and the forms of "ser"
+    (`QUERY_KEY_STOPWORDS`) are dropped as well, unless the query has nothing else.
+
+    The canonical form is only meant for keys (caching, coalescing identical queries, logs): the pipeline always
+    receives the query as it was sent.
+    """
+    text = _fold_accents(unicodedata.normalize("NFKC", query).casefold())
+    # Punctuation separates words, like whitespace
+    words = "".join(" " if unicodedata.category(char)[0] in "PZC" else char for char in text).split()
+    if strip_stopwords:
+        words = [word for word in words if word not in QUERY_KEY_STOPWORDS] or words
+    return " ".join(words)
+
+
+def query_key(
+    query: str, pdf_name: Optional[str] = None, params: Optional[Dict[str, Any]] = None, strip_stopwords: bool = False
+) -> str:
+    """
+    Returns the key of a query request: requests with the same key get the same results.
+    """
+    return json.dumps(
+        [normalize_query(query, strip_stopwords=strip_stopwords), pdf_name, params or {}], sort_keys=True, default=str
+    )
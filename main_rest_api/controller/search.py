@@ -1,17 +1,24 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
 import logging
 import time
 import json
+import asyncio
+from functools import partial
 
 from pydantic import BaseConfig
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Depends, Header
 import haystack
 from haystack import Pipeline
 
-from main_rest_api.utils import get_app, get_pipelines
+from main_rest_api.utils import get_app, on_pipelines_ready
+from main_rest_api.readiness import readiness
+from main_rest_api.controller.utils import require_ready, get_deadline, check_deadline, expired, DeadlineExceeded
 from main_rest_api.config import LOG_LEVEL
 from main_rest_api.schema import QueryRequest, QueryResponse, AdvancedQueryRequest, AdvancedQueryResponse
+from main_rest_api.controller.batching import run_query_batch, add_timing
+from main_rest_api.pipeline.instrumentation import node_timings
+from main_rest_api.metrics import REGISTRY, Counter
 
 
 logging.getLogger("haystack").setLevel(LOG_LEVEL)
@@ -23,8 +30,41 @@ BaseConfig.arbitrary_types_allowed = True
 
 router = APIRouter()
 app: FastAPI = get_app()
-query_pipeline: Pipeline = get_pipelines().get("query_pipeline", None)
-concurrency_limiter = get_pipelines().get("concurrency_limiter", None)
+query_pipeline: Optional[Pipeline] = None
+concurrency_limiter = None
+query_batcher = None
+advanced_query_executor = None
+query_cache = None
+query_coalescer = None
+inference_executor = None
+
+QUERY_REQUESTS = REGISTRY.register(
+    Counter(
+        "query_requests_total",
+        "Queries of /query, by where their result came from: the cache, a running identical query, or the pipeline",
+        ("source",),
+    )
+)
+QUERIES_TIMED_OUT = REGISTRY.register(
+    Counter(
+        "queries_timed_out_total",
+        "Queries not run as their request timed out while they were waiting, by endpoint",
+        ("endpoint",),
+    )
+)
+
+
+@on_pipelines_ready
+def _bind_pipelines(pipelines: Dict[str, Any]):
+    global query_pipeline, concurrency_limiter, query_batcher  # pylint: disable=global-statement
+    global advanced_query_executor, query_cache, query_coalescer, inference_executor  # pylint: disable=global-statement
+    query_pipeline = pipelines.get("query_pipeline", None)
+    concurrency_limiter = pipelines.get("concurrency_limiter", None)
+    query_batcher = pipelines.get("query_batcher", None)
+    advanced_query_executor = pipelines.get("advanced_query_executor", None)
+    query_cache = pipelines.get("query_cache", None)
+    query_coalescer = pipelines.get("query_coalescer", None)
+    inference_executor = pipelines.get("inference_executor", None)
 
 
 @router.get("/initialized")
@@ -35,8 +75,10 @@ def check_status():
 
     The recommended approach is to call this endpoint with a short timeout,
     like 500ms, and in case of no reply, consider the server busy.
+
+    See `GET /ready` for the details of the loading.
     """
-    return True
+    return readiness.ready
 
 
 @router.get("/hs_version")
@@ -47,41 +89,129 @@ def haystack_version():
     return {"hs_version": haystack.__version__}
 
 
-@router.post("/query", response_model=QueryResponse, response_model_exclude_none=True)
-def query(request: QueryRequest):
+@router.get("/query-cache", dependencies=[Depends(require_ready)])
+def query_cache_stats():
+    """
+    Get the size and hit/miss counters of this worker's query result cache, and how many queries were run once
+    for several identical concurrent requests.
+    """
+    return {**query_cache.stats(), "coalescing": query_coalescer.stats()}
+
+
+@router.post(
+    "/query", response_model=QueryResponse, response_model_exclude_none=True, dependencies=[Depends(require_ready)]
+)
+async def query(
+    request: QueryRequest,
+    x_request_timeout: Optional[float] = Header(None, gt=0, description="Seconds the client waits for the results"),
+):
     """
     This endpoint receives the question as a string and allows the requester to set
     additional parameters that will be passed on to the Haystack pipeline.
+
+    Queries that only differ in their casing, accents, punctuation or whitespace are answered from the same
+    cache entry, and run once when they arrive at the same time.
+
+    With a `timeout` (or an `X-Request-Timeout` header), in seconds, the query is dropped with a 504 if it's still
+    waiting to run when the client stops waiting for it.
     """
-    with concurrency_limiter.run():
-        result = _process_request(query_pipeline, request)
+    deadline = get_deadline(request.timeout, x_request_timeout)
+    cache_key = _cache_key(request)
+    if cache_key:
+        cached_result = query_cache.get(cache_key)
+        if cached_result is not None:
+            QUERY_REQUESTS.inc(source="cache")
+            return {**cached_result, "query": request.query}
+
+    executed = False
 
+    async def run_query() -> Dict[str, Any]:
+        nonlocal executed
+        executed = True
+        # Expired requests don't take a slot; they can also expire while waiting for one
+        check_deadline(deadline)
+        cache_generation = query_cache.generation() if cache_key else None
+        async with concurrency_limiter.run_async():
+            check_deadline(deadline)
+            return await _run_in_executor(
+                _process_request,
+                query_pipeline,
+                request,
+                cache_key=cache_key,
+                cache_generation=cache_generation,
+                deadline=deadline,
+            )
 
-        return result
-    
+    query_key = _query_key(request)
+    try:
+        if query_key is None or query_coalescer is None:
+            result = await run_query()
+        else:
+            try:
+                result = await query_coalescer.run(query_key, run_query)
+            except DeadlineExceeded:
+                # The identical query this request waited for timed out sooner: it runs its own
+                if executed or expired(deadline):
+                    raise
+                result = await run_query()
+    except DeadlineExceeded:
+        QUERIES_TIMED_OUT.inc(endpoint="query")
+        raise
+    QUERY_REQUESTS.inc(source="pipeline" if executed else "coalesced")
+    # The result of an identical query keeps the query as this request sent it
+    return {**result, "query": request.query}
 
-@router.post("/advanced_query", response_model=List[QueryResponse], response_model_exclude_none=True)
-def advanced_query(request: AdvancedQueryRequest):
+
+@router.post(
+    "/advanced_query",
+    response_model=List[QueryResponse],
+    response_model_exclude_none=True,
+    dependencies=[Depends(require_ready)],
+)
+async def advanced_query(
+    request: AdvancedQueryRequest,
+    x_request_timeout: Optional[float] = Header(None, gt=0, description="Seconds the client waits for the results"),
+):
     """
-    This endpoint receive no queries, instead make a preloaded queries for each file.
+    This endpoint receives several queries and runs them as batches: queries sharing the same `pdf_name`
+    and params go through the pipeline together, and the batches are spread over a bounded pool of workers.
+    The results are returned in the same order as the queries. With `debug`, the time spent on each of them is in
+    `_debug`.
+
+    With a `timeout` (or an `X-Request-Timeout` header), in seconds, the batches that didn't start when the client
+    stops waiting are skipped: their queries are returned without answers and with `timed_out: true`. Queries can
+    also have their own `timeout`, counted from the arrival of the request.
     """
-    listOfQueries = request.queries
-    
-    all_queries = []
+    deadlines = [get_deadline(request.timeout, x_request_timeout, query.timeout) for query in request.queries]
 
-    with concurrency_limiter.run():
-        for request in listOfQueries:
-            result = _process_request(query_pipeline, request)
-            all_queries.append(result)
+    def all_expired() -> bool:
+        return bool(deadlines) and all(expired(deadline) for deadline in deadlines)
 
-        return all_queries
+    if all_expired():
+        QUERIES_TIMED_OUT.inc(len(deadlines), endpoint="advanced_query")
+        raise DeadlineExceeded()
+    async with concurrency_limiter.run_async():
+        if all_expired():
+            QUERIES_TIMED_OUT.inc(len(deadlines), endpoint="advanced_query")
+            raise DeadlineExceeded()
+        results = await _run_in_executor(
+            _process_requests, query_pipeline, request.queries, debug=request.debug, deadlines=deadlines
+        )
+    timed_out = sum(1 for result in results if result.get("timed_out"))
+    if timed_out:
+        QUERIES_TIMED_OUT.inc(timed_out, endpoint="advanced_query")
+    return results
 
 
-def _process_request(pipeline, request: QueryRequest) -> Dict[str, Any]:
-    start_time = time.time()
+async def _run_in_executor(func, *args, **kwargs):
+    # Pipelines block while running, so they run on a dedicated pool instead of the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, partial(func, *args, **kwargs))
+
 
+def _prepare_params(request: QueryRequest) -> Dict[str, Any]:
     # Prepare params for the pipeline. Merge with request.params if it exists.
-    params = request.params or {}
+    params = dict(request.params or {})
     if request.pdf_name:
         # Assuming the Retriever node needs the PDF name to filter documents
         if 'Retriever' not in params:
@@ -89,15 +219,130 @@ def _process_request(pipeline, request: QueryRequest) -> Dict[str, Any]:
         # Here you might need to define how the PDF name should be used as a filter
         # For example, using 'pdf_name' as a key in the metadata
         params['Retriever']['filters'] = {'pdf_name': request.pdf_name}
+    return params
 
-    # Execute the query through the pipeline
-    result = pipeline.run(query=request.query, params=params, debug=request.debug)
 
+def _clean_result(result: Dict[str, Any]) -> Dict[str, Any]:
     # Remove empty answers, if any
     result["answers"] = [answer for answer in result.get("answers", []) if answer.answer.strip()]
+    return result
+
+
+def _query_key(request: QueryRequest) -> Optional[str]:
+    # Debug output is specific to each run, so these requests are never cached nor coalesced
+    if not query_cache or request.debug:
+        return None
+    return query_cache.key(request.query, pdf_name=request.pdf_name, params=request.params)
+
+
+def _cache_key(request: QueryRequest) -> Optional[str]:
+    return _query_key(request) if query_cache and query_cache.enabled else None
+
+
+def _process_request(
+    pipeline,
+    request: QueryRequest,
+    cache_key: Optional[str] = None,
+    cache_generation: Optional[int] = None,
+    deadline: Optional[float] = None,
+) -> Dict[str, Any]:
+    # The request may have waited for a worker of the pool longer than the client waits for it
+    check_deadline(deadline)
+    start_time = time.time()
+
+    params = _prepare_params(request)
+
+    # Execute the query through the pipeline, batched together with concurrent queries if enabled
+    with node_timings() as timings:
+        if query_batcher and query_batcher.enabled:
+            result = query_batcher.submit(
+                pipeline, query=request.query, params=params, debug=request.debug, deadline=deadline
+            ).result()
+        else:
+            result = pipeline.run(query=request.query, params=params, debug=request.debug)
+
+    result = _clean_result(result)
+    if request.debug:
+        # Batched queries get the timings of their nodes from the batcher's thread
+        result["_debug"] = add_timing(
+            result.get("_debug") or {}, nodes=timings, time=round(time.time() - start_time, 4)
+        )
+    if cache_key:
+        query_cache.put(cache_key, result, generation=cache_generation)
 
     # Log the processing time
     logger.info(f"Processed query in {(time.time() - start_time):.2f} seconds")
 
     return result
 
+
+def _process_requests(
+    pipeline, requests: List[QueryRequest], debug: bool = False, deadlines: Optional[List[Optional[float]]] = None
+) -> List[Dict[str, Any]]:
+    start_time = time.time()
+
+    deadlines = deadlines or [None] * len(requests)
+    all_results: List[Dict[str, Any]] = [{} for _ in requests]
+    cache_keys = [_cache_key(request) for request in requests]
+    cache_generation = query_cache.generation() if any(cache_keys) else None
+
+    # Group the queries that can share a `Pipeline.run_batch` call: same params, and so same `pdf_name` filter
+    groups: Dict[str, List[int]] = {}
+    params_list: List[Dict[str, Any]] = []
+    for i, request in enumerate(requests):
+        params = _prepare_params(request)
+        params_list.append(params)
+        cached_result = query_cache.get(cache_keys[i]) if cache_keys[i] else None
+        if cached_result is not None:
+            all_results[i] = {**cached_result, "query": request.query}
+            if debug or request.debug:
+                all_results[i]["_debug"] = {"timing": {"cached": True}}
+            continue
+        key = json.dumps([params, debug or request.debug], sort_keys=True, default=str)
+        groups.setdefault(key, []).append(i)
+
+    def run_group(indices: List[int]) -> List[Dict[str, Any]]:
+        group_start_time = time.time()
+        # The queries that timed out while the group waited for a worker are skipped
+        results: Dict[int, Dict[str, Any]] = {
+            i: {"query": requests[i].query, "answers": [], "documents": [], "timed_out": True}
+            for i in indices
+            if expired(deadlines[i])  # type: ignore
+        }
+        run_indices = [i for i in indices if i not in results]
+        if run_indices:
+            # The queries of a group share their debug setting
+            group_debug = debug or requests[run_indices[0]].debug
+            batch_results = run_query_batch(
+                pipeline,
+                queries=[requests[i].query for i in run_indices],
+                params_list=[params_list[i] for i in run_indices],
+                debug=group_debug,
+            )
+            timing = {
+                "queued_time": round(group_start_time - start_time, 4),
+                "time": round(time.time() - group_start_time, 4),
+                "batch_size": len(run_indices),
+            }
+            for i, result in zip(run_indices, batch_results):
+                if group_debug:
+                    result["_debug"] = add_timing(dict(result.get("_debug") or {}), **timing)
+                results[i] = result
+        return [results[i] for i in indices]
+
+    group_indices = list(groups.values())
+    for indices, results in zip(group_indices, advanced_query_executor.map(run_group, group_indices)):
+        for i, result in zip(indices, results):
+            all_results[i] = _clean_result(result)
+            if cache_keys[i] and not result.get("timed_out"):
+                query_cache.put(
+                    cache_keys[i],
+                    {key: value for key, value in result.items() if key != "_debug"},
+                    generation=cache_generation,
+                )
+
+    logger.info(
+        f"Processed {len(requests)} queries in {len(group_indices)} batches in {(time.time() - start_time):.2f} seconds"
+    )
+
+    return all_results
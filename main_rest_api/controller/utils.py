@@ -1,26 +1,287 @@
-from typing import Type, NewType
+from typing import Any, Dict, List, Optional, Type, NewType
 
+import time
+import asyncio
 import inspect
-from contextlib import contextmanager
-from threading import Semaphore
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, asynccontextmanager
+from threading import Lock
 
 from fastapi import Form, HTTPException
 from pydantic import BaseModel
 
+from main_rest_api.readiness import readiness
+
 
 class RequestLimiter:
-    def __init__(self, limit):
-        self.semaphore = Semaphore(limit)
+    """
+    Limits the number of requests processed at the same time by a worker.
+
+    When all the slots are taken, up to `queue_size` requests wait for one to be released, for at most `max_wait`
+    seconds. Requests that don't find a place in the queue, or wait too long, are rejected with a 503.
+    Slots are handed over to the waiting requests in arrival order.
+    """
+
+    def __init__(self, limit: int, queue_size: int = 0, max_wait: float = 0.0):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters: deque = deque()
+        self._lock = Lock()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _try_acquire(self) -> Optional[Future]:
+        """
+        Takes a free slot and returns None, or returns a `Future` that will be resolved when a slot
+        is handed over to this request.
+        """
+        with self._lock:
+            if self.in_flight < self.limit and not self._waiters:
+                self.in_flight += 1
+                return None
+            if len(self._waiters) >= self.queue_size or self.max_wait <= 0:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="The server is busy processing requests.")
+            waiter: Future = Future()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _withdraw(self, waiter: Future) -> bool:
+        """
+        Removes a request from the queue. Returns False if a slot was handed over to it in the meantime.
+        """
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                return True
+            return False
+
+    def _reject_waiter(self, waiter: Future):
+        if self._withdraw(waiter):
+            with self._lock:
+                self.rejected += 1
+            raise HTTPException(status_code=503, detail="The server is busy processing requests.")
+
+    def release(self):
+        with self._lock:
+            # When the limit was lowered in the meantime, the slot is given back rather than handed over
+            if self.in_flight <= self.limit:
+                while self._waiters:
+                    waiter = self._waiters.popleft()
+                    if waiter.set_running_or_notify_cancel():
+                        waiter.set_result(True)
+                        return
+            self.in_flight -= 1
+
+    def observe(self, latency: float):
+        """
+        Called with the time a request held its slot, once it released it. The requests that raised (timed out
+        before running, invalid, ...) aren't observed: their latency says nothing of the pipeline's.
+        """
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "adaptive": False,
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "queue_size": self.queue_size,
+            "rejected": self.rejected,
+        }
 
     @contextmanager
     def run(self):
-        acquired = self.semaphore.acquire(blocking=False)
-        if not acquired:
-            raise HTTPException(status_code=503, detail="The server is busy processing requests.")
+        waiter = self._try_acquire()
+        if waiter:
+            try:
+                waiter.result(timeout=self.max_wait)
+            except FutureTimeoutError:
+                self._reject_waiter(waiter)
+        start_time = time.perf_counter()
+        succeeded = False
+        try:
+            yield True
+            succeeded = True
+        finally:
+            self.release()
+            if succeeded:
+                self.observe(time.perf_counter() - start_time)
+
+    @asynccontextmanager
+    async def run_async(self):
+        waiter = self._try_acquire()
+        if waiter:
+            try:
+                await asyncio.wait_for(asyncio.wrap_future(waiter), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                self._reject_waiter(waiter)
+            except asyncio.CancelledError:
+                # The client went away while waiting
+                if not self._withdraw(waiter):
+                    self.release()
+                raise
+        start_time = time.perf_counter()
+        succeeded = False
         try:
-            yield acquired
+            yield True
+            succeeded = True
         finally:
-            self.semaphore.release()
+            self.release()
+            if succeeded:
+                self.observe(time.perf_counter() - start_time)
+
+
+class AdaptiveRequestLimiter(RequestLimiter):
+    """
+    `RequestLimiter` adjusting its limit, between `min_limit` and `max_limit`, to the latency of the requests
+    (AIMD). The median latency of every `window` requests is compared with the lowest one seen, the latency of the
+    pipeline without contention:
+
+    - above `tolerance` times the lowest latency, the requests compete for the CPU or GPU: the limit is multiplied
+      by `backoff`;
+    - otherwise, if requests had to wait or were rejected as the limit was reached, the limit is raised by one.
+
+    The lowest latency is slowly forgotten (by `drift` each window), so that it follows a change of the pipeline
+    or of the node load. The last adjustments are kept in `history`.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        queue_size: int = 0,
+        max_wait: float = 0.0,
+        min_limit: int = 1,
+        max_limit: Optional[int] = None,
+        window: int = 20,
+        tolerance: float = 2.0,
+        backoff: float = 0.75,
+        drift: float = 0.01,
+        history_size: int = 100,
+    ):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit or limit, self.min_limit)
+        super().__init__(min(max(limit, self.min_limit), self.max_limit), queue_size=queue_size, max_wait=max_wait)
+        self.window = window
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.drift = drift
+        self.min_latency: Optional[float] = None
+        self.increases = 0
+        self.decreases = 0
+        self.history: deque = deque(maxlen=history_size)
+        self._latencies: List[float] = []
+        self._saturated = False
+
+    def _try_acquire(self) -> Optional[Future]:
+        # `observe` reads and resets `_saturated` from other threads, with the lock held
+        try:
+            waiter = super()._try_acquire()
+        except HTTPException:
+            with self._lock:
+                self._saturated = True
+            raise
+        with self._lock:
+            if waiter or self.in_flight >= self.limit:
+                self._saturated = True
+        return waiter
+
+    def observe(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+            if len(self._latencies) < self.window:
+                return
+            latencies, self._latencies = sorted(self._latencies), []
+            saturated, self._saturated = self._saturated, False
+            median = latencies[len(latencies) // 2]
+            if self.min_latency is None or median < self.min_latency:
+                self.min_latency = median
+            else:
+                self.min_latency *= 1 + self.drift
+
+            if median > self.min_latency * self.tolerance:
+                self._set_limit(max(self.min_limit, min(self.limit - 1, int(self.limit * self.backoff))), median)
+            elif saturated:
+                self._set_limit(min(self.max_limit, self.limit + 1), median)
+
+    def _set_limit(self, limit: int, latency: float):
+        # Called with the lock held
+        if limit == self.limit:
+            return
+        if limit > self.limit:
+            self.increases += 1
+        else:
+            self.decreases += 1
+        self.history.append(
+            {
+                "time": time.time(),
+                "previous_limit": self.limit,
+                "limit": limit,
+                "latency_ms": latency * 1000,
+                "min_latency_ms": self.min_latency * 1000 if self.min_latency is not None else None,
+            }
+        )
+        self.limit = limit
+        # The new slots go to the requests waiting for one
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if waiter.set_running_or_notify_cancel():
+                waiter.set_result(True)
+                self.in_flight += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **super().stats(),
+                "adaptive": True,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "min_latency_ms": self.min_latency * 1000 if self.min_latency is not None else None,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "history": list(self.history),
+            }
+
+
+def require_ready():
+    """
+    Dependency of the endpoints that need the pipelines, rejecting the requests with a 503 until they're loaded
+    and warmed up.
+    """
+    if not readiness.ready:
+        raise HTTPException(status_code=503, detail=f"The server is not ready yet ({readiness.status}).")
+
+
+class DeadlineExceeded(HTTPException):
+    """
+    The client stopped waiting for the results (its timeout passed) before its query could run.
+    """
+
+    def __init__(self):
+        super().__init__(status_code=504, detail="The request timed out before its query could run.")
+
+
+def get_deadline(*timeouts: Optional[float]) -> Optional[float]:
+    """
+    Returns the `time.monotonic()` time after which nobody waits for the results of a request, from the timeouts
+    in seconds it was given (the shortest one applies), or None without timeouts.
+    """
+    given_timeouts = [timeout for timeout in timeouts if timeout]
+    return time.monotonic() + min(given_timeouts) if given_timeouts else None
+
+
+def expired(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def check_deadline(deadline: Optional[float]):
+    if expired(deadline):
+        raise DeadlineExceeded()
 
 
 StringId = NewType("StringId", str)
@@ -0,0 +1,162 @@
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import logging
+
+from haystack.schema import Label
+
+from main_rest_api.storage import SQLiteStore
+
+
+logger = logging.getLogger(__name__)
+
+SCOPE_ALL = "all"
+# Filters of `/eval-feedback` that can be answered from the aggregates, and the scope holding them
+SCOPES_BY_FILTER = {"document_id": "document_id", "pdf_name": "pdf_name"}
+
+
+class FeedbackMetrics(SQLiteStore):
+    """
+    Running counts of the user feedback, overall and by document id and `pdf_name`, updated as labels are
+    written and deleted, so that the accuracy metrics don't need to scan all the labels.
+
+    The contribution of each label is kept too, so writing the same label again (or deleting it) updates
+    the counts correctly.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS feedback_labels (
+            id TEXT PRIMARY KEY,
+            document_id TEXT,
+            pdf_name TEXT,
+            is_correct_answer INTEGER NOT NULL,
+            is_correct_document INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS feedback_aggregates (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            n_feedback INTEGER NOT NULL DEFAULT 0,
+            correct_answers INTEGER NOT NULL DEFAULT 0,
+            correct_documents INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, key)
+        );
+        CREATE TABLE IF NOT EXISTS feedback_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    @property
+    def initialized(self) -> bool:
+        """
+        Whether the counts were built from the labels already in the DocumentStore, see `rebuild`.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM feedback_state WHERE key = 'initialized'").fetchone()
+        return row is not None
+
+    def rebuild(self, read_labels: Callable[[], List[Label]]):
+        """
+        Replaces the counts with the ones of the labels returned by `read_labels`, all the user feedback in the
+        DocumentStore.
+
+        The labels are read holding the write lock: the feedback recorded in the meantime waits for the new counts,
+        and is added to them, rather than being replaced by them.
+        """
+        with self._transaction() as conn:
+            labels = read_labels()
+            conn.execute("DELETE FROM feedback_labels")
+            conn.execute("DELETE FROM feedback_aggregates")
+            for label in labels:
+                self._add(conn, label)
+            conn.execute("INSERT OR REPLACE INTO feedback_state (key, value) VALUES ('initialized', '1')")
+        logger.info("Built the feedback metrics from %s labels", len(labels))
+
+    def record(self, labels: List[Label]):
+        with self._transaction() as conn:
+            for label in labels:
+                self._remove(conn, label.id)
+                self._add(conn, label)
+
+    def delete(self, label_ids: List[str]):
+        with self._transaction() as conn:
+            for label_id in label_ids:
+                self._remove(conn, label_id)
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM feedback_labels")
+            conn.execute("DELETE FROM feedback_aggregates")
+
+    def get(self, filters: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Optional[Union[float, int]]]]:
+        """
+        Returns the metrics of the feedback matching `filters`, or None if they can't be answered from the counts
+        (filters on other fields than `document_id` or `pdf_name`, or on both of them).
+        """
+        filters = {key: value for key, value in (filters or {}).items() if key != "origin"}
+        if len(filters) > 1 or any(key not in SCOPES_BY_FILTER for key in filters):
+            return None
+
+        if filters:
+            field, values = next(iter(filters.items()))
+            scope = SCOPES_BY_FILTER[field]
+            keys = [str(value) for value in (values if isinstance(values, list) else [values])]
+        else:
+            scope, keys = SCOPE_ALL, [""]
+
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COALESCE(SUM(n_feedback), 0) AS n_feedback, "
+                "COALESCE(SUM(correct_answers), 0) AS correct_answers, "
+                "COALESCE(SUM(correct_documents), 0) AS correct_documents FROM feedback_aggregates "
+                f"WHERE scope = ? AND key IN ({', '.join('?' for _ in keys)})",
+                (scope, *keys),
+            ).fetchone()
+
+        if not row["n_feedback"]:
+            return {"answer_accuracy": None, "document_accuracy": None, "n_feedback": 0}
+        return {
+            "answer_accuracy": row["correct_answers"] / row["n_feedback"],
+            "document_accuracy": row["correct_documents"] / row["n_feedback"],
+            "n_feedback": row["n_feedback"],
+        }
+
+    @staticmethod
+    def _label_keys(label: Label) -> Dict[str, Optional[str]]:
+        document = label.document
+        document_meta = (document.meta if document else None) or {}
+        pdf_name = document_meta.get("pdf_name") or (label.meta or {}).get("pdf_name")
+        return {
+            "document_id": document.id if document else None,
+            "pdf_name": str(pdf_name) if pdf_name is not None else None,
+        }
+
+    @staticmethod
+    def _update_aggregates(conn, keys: Dict[str, Optional[str]], sign: int, correct_answer: int, correct_document: int):
+        scopes = [(SCOPE_ALL, "")] + [(scope, key) for scope, key in keys.items() if key is not None]
+        for scope, key in scopes:
+            conn.execute(
+                "INSERT INTO feedback_aggregates (scope, key, n_feedback, correct_answers, correct_documents) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (scope, key) DO UPDATE SET "
+                "n_feedback = n_feedback + excluded.n_feedback, "
+                "correct_answers = correct_answers + excluded.correct_answers, "
+                "correct_documents = correct_documents + excluded.correct_documents",
+                (scope, key, sign, sign * correct_answer, sign * correct_document),
+            )
+
+    def _add(self, conn, label: Label):
+        keys = self._label_keys(label)
+        correct_answer, correct_document = int(bool(label.is_correct_answer)), int(bool(label.is_correct_document))
+        conn.execute(
+            "INSERT INTO feedback_labels (id, document_id, pdf_name, is_correct_answer, is_correct_document) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (label.id, keys["document_id"], keys["pdf_name"], correct_answer, correct_document),
+        )
+        self._update_aggregates(conn, keys, 1, correct_answer, correct_document)
+
+    def _remove(self, conn, label_id: str):
+        row = conn.execute("SELECT * FROM feedback_labels WHERE id = ?", (label_id,)).fetchone()
+        if row is None:
+            return
+        conn.execute("DELETE FROM feedback_labels WHERE id = ?", (label_id,))
+        keys = {"document_id": row["document_id"], "pdf_name": row["pdf_name"]}
+        self._update_aggregates(conn, keys, -1, row["is_correct_answer"], row["is_correct_document"])
@@ -0,0 +1,29 @@
+"""
+Gunicorn settings, to use with:
+
+`gunicorn -c python:main_rest_api.gunicorn_conf main_rest_api.application:app`
+
+With `GUNICORN_PRELOAD` (the default), the app and its pipelines are loaded once in the master process and the
+workers are forked from it, sharing the model weights copy-on-write instead of loading a copy each.
+"""
+import os
+
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# Preloading means loading the pipelines when the app is imported, in the master. Otherwise each worker loads
+# them in the background once started.
+os.environ.setdefault("LOAD_PIPELINES_IN_BACKGROUND", "false" if preload_app else "true")
+
+
+def when_ready(server):  # pylint: disable=unused-argument
+    # Called in the master once the app is loaded, before the workers are forked
+    if preload_app:
+        from main_rest_api.utils import get_pipelines  # pylint: disable=import-outside-toplevel
+        from main_rest_api.preload import prepare_for_fork  # pylint: disable=import-outside-toplevel
+
+        prepare_for_fork(get_pipelines())
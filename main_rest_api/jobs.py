@@ -0,0 +1,191 @@
+from typing import Any, Callable, Dict, List, Optional
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+
+import psutil
+
+from main_rest_api.storage import SQLiteStore
+
+
+logger = logging.getLogger(__name__)
+
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+def _worker_token(pid: Optional[int] = None) -> str:
+    # The PID alone is not enough to recognize a worker, as it can be reused after a restart
+    process = psutil.Process(pid)
+    return f"{process.pid}:{process.create_time()}"
+
+
+def _is_worker_alive(token: Optional[str]) -> bool:
+    if not token:
+        return False
+    pid = int(token.split(":")[0])
+    try:
+        return _worker_token(pid) == token
+    except psutil.Error:
+        return False
+
+
+class JobStore(SQLiteStore):
+    """
+    Keeps the indexing jobs, their progress and their errors.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            worker TEXT,
+            files_total INTEGER NOT NULL DEFAULT 0,
+            files_converted INTEGER NOT NULL DEFAULT 0,
+            documents_written INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+    """
+
+    def create(self, payload: Dict[str, Any], files_total: int) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, files_total, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, json.dumps(payload, default=str), files_total, now, now),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def claim_next(self, worker: str) -> Optional[Dict[str, Any]]:
+        """
+        Marks the oldest queued job as running for `worker` and returns it, or returns None if no job is queued.
+        """
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (JOB_QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, updated_at = ? WHERE id = ?",
+                (JOB_RUNNING, worker, time.time(), row["id"]),
+            )
+        return self.get(row["id"])
+
+    def update_progress(self, job_id: str, files_converted: int, documents_written: int):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET files_converted = ?, documents_written = ?, updated_at = ? WHERE id = ?",
+                (files_converted, documents_written, time.time(), job_id),
+            )
+
+    def finish(self, job_id: str, error: Optional[str] = None):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (JOB_FAILED if error else JOB_SUCCEEDED, error, time.time(), job_id),
+            )
+
+    def requeue_orphans(self) -> int:
+        """
+        Puts back in the queue the jobs that were running in a worker that doesn't exist anymore.
+        """
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT id, worker FROM jobs WHERE status = ?", (JOB_RUNNING,)).fetchall()
+            orphans = [row["id"] for row in rows if not _is_worker_alive(row["worker"])]
+            for job_id in orphans:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker = NULL, updated_at = ? WHERE id = ?",
+                    (JOB_QUEUED, time.time(), job_id),
+                )
+        if orphans:
+            logger.warning("Re-queued %s indexing jobs left over by stopped workers", len(orphans))
+        return len(orphans)
+
+
+class IndexingJobQueue:
+    """
+    Runs the indexing jobs kept in a `JobStore` on a pool of `workers` threads.
+
+    The handler receives the payload of the job and a callback to report its progress
+    (files converted, documents written). Jobs raising an exception are marked as failed.
+    """
+
+    def __init__(self, store: JobStore, workers: int, poll_interval: float = 1.0):
+        self.store = store
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.handler: Optional[Callable[[Dict[str, Any], Callable[[int, int], None]], None]] = None
+        self._threads: List[threading.Thread] = []
+        self._wakeup = threading.Event()
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def submit(self, payload: Dict[str, Any], files_total: int) -> str:
+        job_id = self.store.create(payload, files_total=files_total)
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def start(self):
+        # Threads are started lazily, in the process serving the requests, so they don't get lost on fork
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._threads = []
+                self._wakeup = threading.Event()
+                self.store.requeue_orphans()
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"indexing-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        worker = _worker_token()
+        while True:
+            job = self.store.claim_next(worker)
+            if job is None:
+                self._wakeup.wait(timeout=self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        start_time = time.time()
+
+        def progress(files_converted: int, documents_written: int):
+            self.store.update_progress(job_id, files_converted=files_converted, documents_written=documents_written)
+
+        try:
+            if self.handler is None:
+                raise RuntimeError("No handler configured for the indexing jobs.")
+            self.handler(job["payload"], progress)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception("Indexing job %s failed", job_id)
+            self.store.finish(job_id, error=f"{type(e).__name__}: {e}")
+            return
+        self.store.finish(job_id)
+        logger.info(f"Indexing job {job_id} done in {(time.time() - start_time):.2f} seconds")
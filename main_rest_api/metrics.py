@@ -0,0 +1,201 @@
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import math
+import time
+import threading
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Base class of the metrics, exposed in the Prometheus text format by `Registry.render`.
+    """
+
+    type: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, not {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, Sequence[str], Sequence[str], float]]:
+        """
+        Returns the samples of the metric, as (name, label names, label values, value).
+        """
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labelnames, labelvalues, value in self.samples():
+            lines.append(f"{name}{_format_labels(labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class _ValueMetric(Metric):
+    """
+    Metric with a single value for each set of labels. Instead of being updated, the values can be read at
+    collection time from a `function` returning them for each set of labels, for the counts that are already
+    kept by other objects.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+        self._values: Dict[LabelValues, float] = {}
+
+    def samples(self):
+        if self.function is not None:
+            values = list(self.function().items())
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return [(self.name, self.labelnames, key, value) for key, value in values]
+
+
+class Counter(_ValueMetric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_ValueMetric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # For each set of labels: the count of each bucket (not cumulative), the sum and the count
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._label_values(labels)
+        bucket = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0]))
+            counts[bucket] += 1
+            total[0] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        samples = []
+        bucket_labelnames = self.labelnames + ("le",)
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", bucket_labelnames, key + (_format_value(bound),), cumulative))
+            samples.append((f"{self.name}_sum", self.labelnames, key, total))
+            samples.append((f"{self.name}_count", self.labelnames, key, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Registers a metric and returns it. Registering a metric under the name of an existing one
+        replaces it.
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+# Metrics are kept by each worker process, Prometheus must scrape the workers (or the pods) individually
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(
+    Counter("http_requests_total", "Number of HTTP requests handled", ("method", "route", "status"))
+)
+HTTP_REQUEST_DURATION = REGISTRY.register(
+    Histogram("http_request_duration_seconds", "Time spent handling the HTTP requests", ("method", "route"))
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting the requests and measuring their latency for each route, until their response
+    is fully sent. Routes are reported by their path template (like `/jobs/{job_id}`), so that the number
+    of series doesn't grow with the requested URLs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(method=scope["method"], route=route_path, status=str(status))
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start_time, method=scope["method"], route=route_path)
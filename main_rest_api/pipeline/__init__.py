@@ -3,19 +3,29 @@ from typing import Any, Dict
 import os
 import logging
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 from haystack.pipelines.base import Pipeline
 from haystack.document_stores import FAISSDocumentStore, InMemoryDocumentStore
 from haystack.errors import PipelineConfigError
 
-from main_rest_api.controller.utils import RequestLimiter
+from main_rest_api.controller.utils import RequestLimiter, AdaptiveRequestLimiter
+from main_rest_api.controller.batching import QueryBatcher
+from main_rest_api.controller.cache import QueryCache, QueryCoalescer
+from main_rest_api.controller.label_writer import LabelWriter
+from main_rest_api.jobs import JobStore, IndexingJobQueue
+from main_rest_api.uploads import FileRegistry
+from main_rest_api.feedback_metrics import FeedbackMetrics
+from main_rest_api.pipeline.parallel import ParallelIndexer
+from main_rest_api.pipeline.instrumentation import instrument_pipeline
+from main_rest_api.pipeline.reader_backend import prepare_reader_backend
 
 
 logger = logging.getLogger(__name__)
 
 # Each instance of FAISSDocumentStore creates an in-memory FAISS index,
 # the Indexing & Query Pipelines will end up with different indices for each worker.
-# The same applies for InMemoryDocumentStore.
+# The same applies for InMemoryDocumentStore. Use the MmapDocumentStore instead for single-node installs.
 SINGLE_PROCESS_DOC_STORES = (FAISSDocumentStore, InMemoryDocumentStore)
 
 
@@ -43,7 +53,8 @@ def _get_pipeline_doc_store(pipeline, pipeline_name):
     if pipeline_name and pipeline_name.startswith("indexing") and isinstance(last_node, SINGLE_PROCESS_DOC_STORES):
         logger.warning(
             "Indexing pipelines with FAISSDocumentStore or InMemoryDocumentStore detected!"
-            "\n These DocumentStores will not work as expected in indexing pipelines with REST APIs."
+            "\n These DocumentStores will not work as expected in indexing pipelines with REST APIs, "
+            "use the MmapDocumentStore to run without an external DocumentStore."
         )
     return document_store
 
@@ -56,21 +67,117 @@ def setup_pipelines() -> Dict[str, Any]:
 
     # Load query pipeline & document store
     query_pipeline, document_store = _load_pipeline(config.PIPELINE_YAML_PATH, config.QUERY_PIPELINE_NAME)
+    if query_pipeline:
+        # The ONNX exports are only loaded in each worker, see `utils.py`
+        prepare_reader_backend(query_pipeline, config.READER_BACKEND, config.READER_CACHE_PATH)
+        instrument_pipeline(query_pipeline, config.QUERY_PIPELINE_NAME)
     pipelines["query_pipeline"] = query_pipeline
     pipelines["document_store"] = document_store
 
     # Setup concurrency limiter
-    concurrency_limiter = RequestLimiter(config.CONCURRENT_REQUEST_PER_WORKER)
-    logger.info("Concurrent requests per worker: %s", config.CONCURRENT_REQUEST_PER_WORKER)
+    if config.ADAPTIVE_CONCURRENCY:
+        concurrency_limiter: RequestLimiter = AdaptiveRequestLimiter(
+            config.CONCURRENT_REQUEST_PER_WORKER,
+            queue_size=config.REQUEST_QUEUE_SIZE,
+            max_wait=config.REQUEST_QUEUE_TIMEOUT_MS / 1000,
+            min_limit=config.CONCURRENCY_LIMIT_MIN,
+            max_limit=config.CONCURRENCY_LIMIT_MAX,
+            tolerance=config.CONCURRENCY_LATENCY_TOLERANCE,
+        )
+    else:
+        concurrency_limiter = RequestLimiter(
+            config.CONCURRENT_REQUEST_PER_WORKER,
+            queue_size=config.REQUEST_QUEUE_SIZE,
+            max_wait=config.REQUEST_QUEUE_TIMEOUT_MS / 1000,
+        )
+    logger.info(
+        "Concurrent requests per worker: %s%s (queue size %s, max wait %s ms)",
+        config.CONCURRENT_REQUEST_PER_WORKER,
+        (
+            f", adaptive between {config.CONCURRENCY_LIMIT_MIN} and {config.CONCURRENCY_LIMIT_MAX}"
+            if config.ADAPTIVE_CONCURRENCY
+            else ""
+        ),
+        config.REQUEST_QUEUE_SIZE,
+        config.REQUEST_QUEUE_TIMEOUT_MS,
+    )
     pipelines["concurrency_limiter"] = concurrency_limiter
 
+    # Setup the worker pool running the query pipeline for the async endpoints
+    pipelines["inference_executor"] = ThreadPoolExecutor(
+        max_workers=config.INFERENCE_WORKERS, thread_name_prefix="inference"
+    )
+
+    # Setup micro-batching of concurrent queries
+    query_batcher = QueryBatcher(config.QUERY_BATCH_SIZE, config.QUERY_BATCH_WAIT_MS / 1000)
+    logger.info("Query batch size: %s (max wait %s ms)", config.QUERY_BATCH_SIZE, config.QUERY_BATCH_WAIT_MS)
+    pipelines["query_batcher"] = query_batcher
+
+    # Setup the worker pool running the batches of /advanced_query
+    pipelines["advanced_query_executor"] = ThreadPoolExecutor(
+        max_workers=config.ADVANCED_QUERY_WORKERS, thread_name_prefix="advanced-query"
+    )
+
     # Load indexing pipeline
     index_pipeline, _ = _load_pipeline(config.PIPELINE_YAML_PATH, config.INDEXING_PIPELINE_NAME)
-    if not index_pipeline:
+    if index_pipeline:
+        prepare_reader_backend(index_pipeline, config.READER_BACKEND, config.READER_CACHE_PATH)
+        instrument_pipeline(index_pipeline, config.INDEXING_PIPELINE_NAME)
+    else:
         logger.warning("Indexing Pipeline is not setup. File Upload API will not be available.")
     pipelines["indexing_pipeline"] = index_pipeline
 
+    # Setup the process pool converting & preprocessing the uploaded files
+    parallel_indexer = None
+    if index_pipeline and config.INDEXING_PROCESSES > 0:
+        parallel_indexer = ParallelIndexer(
+            index_pipeline,
+            pipeline_yaml_path=config.PIPELINE_YAML_PATH,
+            pipeline_name=config.INDEXING_PIPELINE_NAME,
+            processes=config.INDEXING_PROCESSES,
+            pages_per_task=config.INDEXING_PAGES_PER_TASK,
+        )
+        logger.info(
+            "Indexing processes: %s (%s pages per task)", config.INDEXING_PROCESSES, config.INDEXING_PAGES_PER_TASK
+        )
+    pipelines["parallel_indexer"] = parallel_indexer
+
     # Create directory for uploaded files
     os.makedirs(config.FILE_UPLOAD_PATH, exist_ok=True)
 
+    # Setup the query result cache. Workers share invalidations through a file next to the uploaded files.
+    query_cache = QueryCache(
+        config.QUERY_CACHE_SIZE,
+        config.QUERY_CACHE_TTL,
+        generation_path=str(Path(config.FILE_UPLOAD_PATH) / ".query-cache-generation"),
+        strip_stopwords=config.QUERY_KEY_STRIP_STOPWORDS,
+        check_interval=config.QUERY_CACHE_CHECK_INTERVAL_MS / 1000,
+    )
+    logger.info("Query cache size: %s (TTL %s s)", config.QUERY_CACHE_SIZE, config.QUERY_CACHE_TTL)
+    pipelines["query_cache"] = query_cache
+
+    # Run identical concurrent queries once
+    pipelines["query_coalescer"] = QueryCoalescer(enabled=config.QUERY_COALESCING)
+
+    # Setup the background indexing jobs, kept in a SQLite file so they survive worker restarts
+    pipelines["indexing_jobs"] = IndexingJobQueue(JobStore(config.STATE_DB_PATH), workers=config.INDEXING_WORKERS)
+    logger.info("Indexing workers: %s (jobs kept in %s)", config.INDEXING_WORKERS, config.STATE_DB_PATH)
+
+    # Remember the indexed files, so they're not indexed again when uploaded twice
+    pipelines["file_registry"] = FileRegistry(config.STATE_DB_PATH)
+
+    # Keep the feedback metrics up to date as labels are written, instead of computing them from all the labels
+    pipelines["feedback_metrics"] = FeedbackMetrics(config.STATE_DB_PATH)
+
+    # Setup the buffering of the feedback labels
+    pipelines["label_writer"] = LabelWriter(
+        document_store,
+        config.FEEDBACK_BATCH_SIZE,
+        config.FEEDBACK_BATCH_WAIT_MS / 1000,
+        max_attempts=config.FEEDBACK_WRITE_ATTEMPTS,
+    )
+    logger.info(
+        "Feedback batch size: %s (max wait %s ms)", config.FEEDBACK_BATCH_SIZE, config.FEEDBACK_BATCH_WAIT_MS
+    )
+
     return pipelines
@@ -0,0 +1,86 @@
+from typing import Any, Dict, List, Optional
+
+import json
+import time
+
+from haystack.nodes import BaseReader
+from haystack.schema import Answer, Document
+
+from main_rest_api.storage import SQLiteStore
+
+
+def answer_questions(
+    reader: BaseReader, questions: List[str], documents: List[Document], top_k: int = 1
+) -> List[Dict[str, Any]]:
+    """
+    Answers a set of questions about the given documents in a single batched pass of the Reader,
+    and returns the answers found for each question.
+    """
+    if not questions or not documents:
+        return [{"question": question, "answers": []} for question in questions]
+
+    # One list of documents per question, so that each question is paired with all the documents
+    result = reader.predict_batch(queries=questions, documents=[documents for _ in questions], top_k=top_k)
+    return [
+        {"question": question, "answers": [answer for answer in answers if answer.answer.strip()]}
+        for question, answers in zip(questions, result["answers"])
+    ]
+
+
+class AnalysisStore(SQLiteStore):
+    """
+    Keeps the answers to the analysis questions computed at indexing time for each file,
+    so they can be looked up without running the Reader again.
+
+    The answers are stored by file name, together with the ids of the documents they were computed on: another
+    file uploaded under the same name replaces them, so callers knowing the documents of a file pass their ids
+    to make sure the stored answers are about these documents.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS file_analysis (
+            file TEXT PRIMARY KEY,
+            questions TEXT NOT NULL,
+            results TEXT NOT NULL,
+            document_ids TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+    """
+
+    def get(
+        self, file: str, questions: Optional[List[str]] = None, document_ids: Optional[List[str]] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Returns the analysis of a file, or None if it wasn't analyzed (or, when `questions` is given,
+        if it was analyzed with other questions, and when `document_ids` is given, on other documents).
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT questions, results, document_ids FROM file_analysis WHERE file = ?", (file,)
+            ).fetchone()
+        if row is None or (questions is not None and json.loads(row["questions"]) != questions):
+            return None
+        if document_ids is not None and set(json.loads(row["document_ids"])) != set(document_ids):
+            return None
+        return [
+            {"question": result["question"], "answers": [Answer.from_dict(answer) for answer in result["answers"]]}
+            for result in json.loads(row["results"])
+        ]
+
+    def put(self, file: str, questions: List[str], results: List[Dict[str, Any]], document_ids: List[str]):
+        serialized_results = [
+            {"question": result["question"], "answers": [answer.to_dict() for answer in result["answers"]]}
+            for result in results
+        ]
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO file_analysis (file, questions, results, document_ids, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    file,
+                    json.dumps(questions),
+                    json.dumps(serialized_results, default=str),
+                    json.dumps(sorted(document_ids)),
+                    time.time(),
+                ),
+            )
@@ -7,8 +7,28 @@ can be used in a Pipeline YAML configuration.
 The classes for the Custom Components must be defined in this file.
 """
 
+from typing import Any, Dict, List, Optional, Union
 
+import copy
+import time
+import heapq
+import hashlib
+import logging
+from pathlib import Path
+
+from haystack.document_stores import KeywordDocumentStore
+from haystack.nodes import BaseReader, BaseRetriever
 from haystack.nodes.base import BaseComponent
+from haystack.schema import Answer, Document, FilterType, Span
+
+from main_rest_api.pipeline.analysis import AnalysisStore, answer_questions
+from main_rest_api.pipeline.passages import select_windows, original_offset, PASSAGE_SEPARATOR
+
+# Defined in its own module for its size, imported here to be available in the pipelines
+from main_rest_api.pipeline.mmap_store import MmapDocumentStore
+
+
+logger = logging.getLogger(__name__)
 
 
 class SampleComponent(BaseComponent):
@@ -16,3 +36,380 @@ class SampleComponent(BaseComponent):
 
     def run(self, **kwargs):
         raise NotImplementedError
+
+
+class DocumentAnalyzer(BaseComponent):
+    """
+    Indexing pipeline node answering the analysis questions about each file while it's indexed, and storing the
+    answers in an `AnalysisStore` under the file's `file_key` meta field (its name by default), with the ids of
+    the documents they were computed on.
+    The documents are passed through unchanged, so it can sit anywhere between the PreProcessor and the
+    DocumentStore:
+
+    ```yaml
+    - name: Analyzer
+      type: DocumentAnalyzer
+      params:
+        reader: Reader
+    ```
+
+    `questions` defaults to `ANALYSIS_QUESTIONS`, and `store_path` to `STATE_DB_PATH`.
+    """
+
+    outgoing_edges: int = 1
+
+    def __init__(
+        self,
+        reader: BaseReader,
+        questions: Optional[List[str]] = None,
+        top_k: Optional[int] = None,
+        file_key: str = "name",
+        store_path: Optional[str] = None,
+    ):
+        # Imported here so the settings are read when the pipeline is loaded, like in `setup_pipelines`
+        from main_rest_api import config  # pylint: disable=import-outside-toplevel
+
+        super().__init__()
+        self.reader = reader
+        self.questions = questions or config.ANALYSIS_QUESTIONS
+        self.top_k = top_k or config.ANALYSIS_TOP_K
+        self.file_key = file_key
+        self.store = AnalysisStore(store_path or config.STATE_DB_PATH)
+
+    def run(self, documents: List[Document]):  # type: ignore
+        self.analyze(documents)
+        return {"documents": documents}, "output_1"
+
+    def run_batch(self, documents: List[List[Document]]):  # type: ignore
+        for file_documents in documents:
+            self.analyze(file_documents)
+        return {"documents": documents}, "output_1"
+
+    def analyze(self, documents: List[Document]):
+        # Pipelines can receive the documents of several files at once, each file is analyzed on its own documents
+        documents_per_file: Dict[str, List[Document]] = {}
+        for document in documents:
+            file = (document.meta or {}).get(self.file_key)
+            if file is not None:
+                documents_per_file.setdefault(str(file), []).append(document)
+
+        for file, file_documents in documents_per_file.items():
+            start_time = time.time()
+            results = answer_questions(self.reader, self.questions, file_documents, top_k=self.top_k)
+            self.store.put(file, self.questions, results, [document.id for document in file_documents])
+            logger.info(
+                f"Analyzed {file} ({len(file_documents)} documents) in {(time.time() - start_time):.2f} seconds"
+            )
+
+
+class PdfShardedBM25Retriever(BaseRetriever):
+    """
+    BM25 Retriever keeping a small index for each PDF, so that the queries scoped to a PDF (with a `pdf_name`
+    filter, as set by `/query`) only read the postings of that PDF, in this process, whatever the size of the
+    corpus. It takes the place of the `BM25Retriever` in both pipelines, and must be named `Retriever` to receive
+    the `pdf_name` filter of `/query`:
+
+    ```yaml
+    - name: Retriever
+      type: PdfShardedBM25Retriever
+      params:
+        document_store: DocumentStore
+        top_k: 5
+    ```
+
+    In the indexing pipeline, it writes the documents of each PDF to its shard, an index of a `MmapDocumentStore`
+    under `index_path` (next to `STATE_DB_PATH` by default). The documents are still written to the DocumentStore.
+
+    In the query pipeline, the queries filtered on PDFs that have a shard are answered from their shards, with the
+    other filters applied to their documents. The other queries (no `pdf_name`, or PDFs indexed before the
+    Retriever was added) go to the BM25 of the `document_store`. The IDF of the terms is computed within each PDF,
+    which ranks the passages of a single PDF better than the statistics of the whole corpus.
+    """
+
+    outgoing_edges: int = 1
+
+    def __init__(
+        self,
+        document_store: Optional[KeywordDocumentStore] = None,
+        top_k: int = 10,
+        all_terms_must_match: bool = False,
+        scale_score: bool = True,
+        pdf_key: str = "pdf_name",
+        index_path: Optional[str] = None,
+        max_open_shards: int = 256,
+    ):
+        # Imported here so the settings are read when the pipeline is loaded, like in `setup_pipelines`
+        from main_rest_api import config  # pylint: disable=import-outside-toplevel
+
+        super().__init__()
+        self.document_store = document_store
+        self.top_k = top_k
+        self.all_terms_must_match = all_terms_must_match
+        self.scale_score = scale_score
+        self.pdf_key = pdf_key
+        self.shards = MmapDocumentStore(
+            index_path=index_path or str(Path(config.STATE_DB_PATH).parent / "pdf-index"),
+            max_open_indexes=max_open_shards,
+        )
+
+    @staticmethod
+    def shard_name(pdf_name: str) -> str:
+        return hashlib.sha256(str(pdf_name).encode()).hexdigest()[:32]
+
+    def run_indexing(self, documents: List[Document]):
+        self.index_documents(documents)
+        return super().run_indexing(documents)
+
+    def index_documents(self, documents: List[Document]):
+        documents_per_pdf: Dict[str, List[Document]] = {}
+        for document in documents:
+            pdf_name = (document.meta or {}).get(self.pdf_key)
+            if pdf_name is not None:
+                documents_per_pdf.setdefault(str(pdf_name), []).append(document)
+        for pdf_name, pdf_documents in documents_per_pdf.items():
+            self.shards.write_documents(pdf_documents, index=self.shard_name(pdf_name))
+
+    def delete_documents(self, filters: Optional[FilterType] = None):
+        """
+        Deletes the documents matching the filters from the shards, to be called when they're deleted from the
+        DocumentStore.
+        """
+        pdf_names, other_filters = self._split_filters(filters)
+        shards = [self.shard_name(pdf_name) for pdf_name in pdf_names] if pdf_names is not None else None
+        for shard in shards if shards is not None else self.shards.list_indexes():
+            if not other_filters:
+                self.shards.delete_index(shard)
+            else:
+                self.shards.delete_documents(index=shard, filters=other_filters)
+
+    def _split_filters(self, filters: Optional[FilterType]):
+        """
+        Returns the PDFs a filter is restricted to (or None if it's not) and the rest of the filter.
+        """
+        filters = dict(filters or {})
+        value = filters.pop(self.pdf_key, None)
+        if isinstance(value, dict) and set(value) in ({"$eq"}, {"$in"}):
+            value = next(iter(value.values()))
+        if isinstance(value, str):
+            return [value], filters
+        if isinstance(value, list) and all(isinstance(item, str) for item in value):
+            return value, filters
+        if value is not None:
+            filters[self.pdf_key] = value
+        return None, filters
+
+    def retrieve(  # type: ignore
+        self,
+        query: str,
+        filters: Optional[FilterType] = None,
+        top_k: Optional[int] = None,
+        index: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        scale_score: Optional[bool] = None,
+        document_store: Optional[KeywordDocumentStore] = None,
+    ) -> List[Document]:
+        top_k = top_k or self.top_k
+        scale_score = self.scale_score if scale_score is None else scale_score
+        pdf_names, other_filters = self._split_filters(filters)
+        shards = [self.shard_name(pdf_name) for pdf_name in pdf_names] if pdf_names is not None else []
+        if not shards or not all(self.shards.index_exists(shard) for shard in shards):
+            document_store = document_store or self.document_store
+            if document_store is None:
+                return []
+            return document_store.query(
+                query=query,
+                filters=filters,
+                top_k=top_k,
+                all_terms_must_match=self.all_terms_must_match,
+                index=index,
+                headers=headers,
+                scale_score=scale_score,
+            )
+
+        results = [
+            self.shards.query(
+                query,
+                filters=other_filters or None,
+                top_k=top_k,
+                index=shard,
+                all_terms_must_match=self.all_terms_must_match,
+                scale_score=scale_score,
+            )
+            for shard in shards
+        ]
+        return heapq.nlargest(top_k, (document for documents in results for document in documents), key=_score)
+
+    def retrieve_batch(  # type: ignore
+        self,
+        queries: List[str],
+        filters: Optional[Union[FilterType, List[Optional[FilterType]]]] = None,
+        top_k: Optional[int] = None,
+        index: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        batch_size: Optional[int] = None,
+        scale_score: Optional[bool] = None,
+        document_store: Optional[KeywordDocumentStore] = None,
+    ) -> List[List[Document]]:
+        filters_list = filters if isinstance(filters, list) else [filters] * len(queries)
+        return [
+            self.retrieve(
+                query,
+                filters=query_filters,
+                top_k=top_k,
+                index=index,
+                headers=headers,
+                scale_score=scale_score,
+                document_store=document_store,
+            )
+            for query, query_filters in zip(queries, filters_list)
+        ]
+
+
+def _score(document: Document) -> float:
+    return document.score or 0.0
+
+
+class PassageSelector(BaseComponent):
+    """
+    Query pipeline node trimming the retrieved documents to their passages most relevant to the query, so that the
+    Reader goes over a few sentences of each document instead of all of it:
+
+    ```yaml
+    - name: PassageSelector
+      type: PassageSelector
+      params:
+        window_size: 3
+        top_k: 2
+    ```
+
+    Each document is split into windows of `window_size` consecutive sentences, scored by their lexical overlap
+    with the query (see `select_windows`), and only its `top_k` best windows are kept. The trimmed documents keep
+    their ID and meta, with the offsets of the kept passages in the original content under `selected_spans`. The
+    offsets of the answers found by the Reader are relative to the trimmed content: a `PassageOffsetMapper` after
+    the Reader maps them back to the original content.
+    """
+
+    outgoing_edges: int = 1
+
+    def __init__(self, window_size: int = 3, top_k: int = 2):
+        super().__init__()
+        self.window_size = window_size
+        self.top_k = top_k
+
+    def run(self, query: str, documents: List[Document], top_k: Optional[int] = None):  # type: ignore
+        selected_documents = self.select(query, documents, top_k=top_k)
+        output: Dict = {"documents": selected_documents}
+        if self.debug:
+            # How much the Reader input was trimmed
+            output["_debug"] = {"words_in": _word_count(documents), "words_out": _word_count(selected_documents)}
+        return output, "output_1"
+
+    def run_batch(  # type: ignore
+        self,
+        queries: List[str],
+        documents: Union[List[Document], List[List[Document]]],
+        top_k: Optional[int] = None,
+    ):
+        # A single list of documents is shared by all the queries
+        if documents and isinstance(documents[0], Document):
+            documents_per_query = [documents for _ in queries]
+        else:
+            documents_per_query = documents  # type: ignore
+        return (
+            {
+                "documents": [
+                    self.select(query, query_documents, top_k=top_k)  # type: ignore
+                    for query, query_documents in zip(queries, documents_per_query)
+                ]
+            },
+            "output_1",
+        )
+
+    def select(self, query: str, documents: List[Document], top_k: Optional[int] = None) -> List[Document]:
+        text_documents = [document for document in documents if _is_text(document)]
+        selections = select_windows(
+            query, [document.content for document in text_documents], self.window_size, top_k or self.top_k
+        )
+        trimmed = {}
+        for document, (spans, _) in zip(text_documents, selections):
+            if not spans:
+                continue
+            trimmed_document = copy.copy(document)
+            trimmed_document.content = PASSAGE_SEPARATOR.join(document.content[start:end] for start, end in spans)
+            trimmed_document.meta = {**(document.meta or {}), "selected_spans": [list(span) for span in spans]}
+            trimmed[id(document)] = trimmed_document
+        # Tables and other documents go through as they are, in their original order
+        return [trimmed.get(id(document), document) for document in documents]
+
+
+class PassageOffsetMapper(BaseComponent):
+    """
+    Query pipeline node following a Reader that reads the documents trimmed by a `PassageSelector`, mapping the
+    `offsets_in_document` of the answers back to the original content of their document:
+
+    ```yaml
+    - name: Reader
+      inputs: [PassageSelector]
+    - name: PassageOffsetMapper
+      inputs: [Reader]
+    ```
+
+    The `selected_spans` are taken from the documents read for the same query, as a document shared by the queries
+    of a batch is trimmed differently for each of them.
+    """
+
+    outgoing_edges: int = 1
+
+    def run(self, answers: List[Answer], documents: List[Document]):  # type: ignore
+        return {"answers": self.map_answers(answers, documents)}, "output_1"
+
+    def run_batch(  # type: ignore
+        self, answers: List[List[Answer]], documents: Union[List[Document], List[List[Document]]]
+    ):
+        if documents and isinstance(documents[0], Document):
+            documents_per_query = [documents for _ in answers]
+        else:
+            documents_per_query = documents  # type: ignore
+        return (
+            {
+                "answers": [
+                    self.map_answers(query_answers, query_documents)  # type: ignore
+                    for query_answers, query_documents in zip(answers, documents_per_query)
+                ]
+            },
+            "output_1",
+        )
+
+    @staticmethod
+    def map_answers(answers: List[Answer], documents: List[Document]) -> List[Answer]:
+        spans_per_document = {
+            document.id: document.meta["selected_spans"]
+            for document in documents
+            if "selected_spans" in (document.meta or {})
+        }
+        mapped_answers = []
+        for answer in answers:
+            spans = next((spans_per_document[i] for i in answer.document_ids or [] if i in spans_per_document), None)
+            if spans is None or not answer.offsets_in_document:
+                mapped_answers.append(answer)
+                continue
+            mapped_answer = copy.copy(answer)
+            mapped_answer.offsets_in_document = [_original_span(spans, span) for span in answer.offsets_in_document]
+            mapped_answer.meta = {**(answer.meta or {}), "selected_spans": spans}
+            mapped_answers.append(mapped_answer)
+        return mapped_answers
+
+
+def _original_span(spans: List[List[int]], span: Any) -> Any:
+    # Table cells are not trimmed
+    if not isinstance(span, Span):
+        return span
+    return Span(start=original_offset(spans, span.start), end=original_offset(spans, span.end))  # type: ignore
+
+
+def _is_text(document: Document) -> bool:
+    return document.content_type == "text" and isinstance(document.content, str)
+
+
+def _word_count(documents: List[Document]) -> int:
+    return sum(len(document.content.split()) for document in documents if _is_text(document))
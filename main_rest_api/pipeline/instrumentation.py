@@ -0,0 +1,72 @@
+from typing import Dict, Iterator, Optional
+
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+from haystack.pipelines.base import Pipeline
+
+from main_rest_api.metrics import REGISTRY, Histogram
+
+
+NODE_DURATION = REGISTRY.register(
+    Histogram("pipeline_node_duration_seconds", "Time spent running each node of the pipelines", ("pipeline", "node"))
+)
+
+ROOT_NODES = ("File", "Query")
+
+_local = threading.local()
+
+
+@contextmanager
+def node_timings() -> Iterator[Dict[str, float]]:
+    """
+    Collects the time spent in each node by the pipelines run by this thread within the block, in seconds.
+    """
+    timings: Dict[str, float] = {}
+    previous_timings = getattr(_local, "timings", None)
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous_timings
+
+
+def record_node_timings(pipeline_name: str, timings: Dict[str, float]):
+    """
+    Records timings measured elsewhere, like in the processes converting the uploaded files.
+    """
+    current_timings: Optional[Dict[str, float]] = getattr(_local, "timings", None)
+    for node_name, elapsed in timings.items():
+        NODE_DURATION.observe(elapsed, pipeline=pipeline_name, node=node_name)
+        if current_timings is not None:
+            current_timings[node_name] = current_timings.get(node_name, 0.0) + elapsed
+
+
+def _timed(method, pipeline_name: str, node_name: str):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            record_node_timings(pipeline_name, {node_name: time.perf_counter() - start_time})
+
+    return wrapper
+
+
+def instrument_pipeline(pipeline: Pipeline, pipeline_name: str):
+    """
+    Times every node of the pipeline, in `run` and `run_batch`. Nodes shared by several pipelines are only
+    timed once, under the name of the first one.
+    """
+    for node_name in pipeline.graph.nodes:
+        if node_name in ROOT_NODES:
+            continue
+        component = pipeline.get_node(node_name)
+        if component is None or getattr(component, "_instrumented", False):
+            continue
+        component._dispatch_run = _timed(component._dispatch_run, pipeline_name, node_name)
+        component._dispatch_run_batch = _timed(component._dispatch_run_batch, pipeline_name, node_name)
+        component._instrumented = True
@@ -0,0 +1,1023 @@
+from typing import Any, Dict, Generator, Iterator, List, Optional, Tuple, Union
+
+import os
+import copy
+import json
+import mmap
+import time
+import uuid
+import fcntl
+import heapq
+import shutil
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import numpy as np
+from haystack.document_stores import KeywordDocumentStore
+from haystack.document_stores.filter_utils import LogicalFilterClause
+from haystack.errors import DuplicateDocumentError
+from haystack.nodes.retriever import DenseRetriever
+from haystack.schema import Document, FilterType, Label
+
+from main_rest_api.storage import SQLiteStore
+from main_rest_api.pipeline.passages import terms
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+# Terms are kept in fixed-width arrays, longer ones (like long numbers or URLs) are truncated
+MAX_TERM_LENGTH = 64
+
+
+def _index_terms(text: str) -> List[str]:
+    return [term[:MAX_TERM_LENGTH] for term in terms(text)]
+
+
+def _load_array(path: Path) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # Empty arrays can't be memory-mapped
+        return np.load(path)
+
+
+class _Segment:
+    """
+    An immutable set of documents, in memory-mapped files shared by all the processes reading them:
+
+    - `documents.jsonl` and `offsets.npy`: the documents (without their embeddings) and where each of them starts
+    - `ids.npy` and `id_rows.npy`: the sorted IDs of the documents and their rows, to look them up
+    - `terms.npy`, `term_offsets.npy`, `postings_rows.npy`, `postings_tf.npy` and `lengths.npy`: the BM25 index
+    - `embeddings-*.npy`: the embeddings of the documents, NaN for the ones without embedding
+    - `meta_fields.json`, `meta-*-values.npy` and `meta-*-codes.npy`: for each indexed meta field, its sorted values
+      and the position of the value of each row in them (-1 when the row doesn't have the field), to filter the
+      rows without decoding the documents
+
+    Documents are deleted by listing their rows in the manifest, and their embeddings are updated by writing
+    a new embeddings file: the files of a segment are never modified.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.offsets = _load_array(path / "offsets.npy")
+        self.rows = len(self.offsets) - 1
+        with (path / "documents.jsonl").open("rb") as file:
+            self.documents = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.ids = _load_array(path / "ids.npy")
+        self.id_rows = _load_array(path / "id_rows.npy")
+        self.terms = _load_array(path / "terms.npy")
+        self.term_offsets = _load_array(path / "term_offsets.npy")
+        self.postings_rows = _load_array(path / "postings_rows.npy")
+        self.postings_tf = _load_array(path / "postings_tf.npy")
+        self.lengths = _load_array(path / "lengths.npy")
+        self.meta_index: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+            field: (_load_array(path / f"meta-{i}-values.npy"), _load_array(path / f"meta-{i}-codes.npy"))
+            for i, field in enumerate(json.loads((path / "meta_fields.json").read_text()))
+        }
+        self.live = np.ones(self.rows, dtype=bool)
+        self.deleted: List[int] = []
+        self.embeddings_file: Optional[str] = None
+        self.embeddings: Optional[np.ndarray] = None
+
+    def update(self, info: Dict[str, Any]):
+        if info["deleted"] != self.deleted:
+            live = np.ones(self.rows, dtype=bool)
+            live[info["deleted"]] = False
+            # Replaced rather than modified, for the threads using the previous one
+            self.live = live
+            self.deleted = info["deleted"]
+        if info.get("embeddings") != self.embeddings_file:
+            self.embeddings = _load_array(self.path / info["embeddings"]) if info.get("embeddings") else None
+            self.embeddings_file = info.get("embeddings")
+
+    def document(self, row: int, return_embedding: bool = False) -> Document:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        document = Document.from_json(self.documents[start:end].decode("utf-8"))
+        if return_embedding and self.embeddings is not None:
+            embedding = np.array(self.embeddings[row])
+            if not np.isnan(embedding).any():
+                document.embedding = embedding
+        return document
+
+    def find(self, document_id: str) -> Optional[int]:
+        """
+        Returns the row of a live document, or None if it's not in this segment.
+        """
+        i = int(np.searchsorted(self.ids, document_id))
+        if i < len(self.ids) and self.ids[i] == document_id:
+            row = int(self.id_rows[i])
+            if self.live[row]:
+                return row
+        return None
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        i = int(np.searchsorted(self.terms, term))
+        if i < len(self.terms) and self.terms[i] == term:
+            start, end = int(self.term_offsets[i]), int(self.term_offsets[i + 1])
+            return np.asarray(self.postings_rows[start:end]), np.asarray(self.postings_tf[start:end])
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+    def meta_rows(self, field: str, values: List[str]) -> Optional[np.ndarray]:
+        """
+        Returns the mask of the rows whose `field` meta is one of `values`, or None if the field isn't indexed.
+        """
+        if field not in self.meta_index:
+            return None
+        sorted_values, codes = self.meta_index[field]
+        positions = np.searchsorted(sorted_values, values) if len(sorted_values) else np.empty(0, dtype=np.int64)
+        found = [int(i) for i, value in zip(positions, values) if i < len(sorted_values) and sorted_values[i] == value]
+        return np.isin(codes, found)
+
+    def has_embeddings(self) -> np.ndarray:
+        if self.embeddings is None:
+            return np.zeros(self.rows, dtype=bool)
+        return ~np.isnan(np.asarray(self.embeddings[:, 0]))
+
+
+def _write_segment(
+    path: Path, documents: List[Document], embedding_dim: int, normalize: bool, meta_fields: List[str]
+):
+    """
+    Writes the files of a segment holding `documents` in the directory `path`, and returns the name of its
+    embeddings file, if any of the documents has an embedding.
+    """
+    path.mkdir(parents=True)
+    offsets = [0]
+    with (path / "documents.jsonl").open("wb") as file:
+        for document in documents:
+            # Embeddings are kept in their own file, and scores are specific to each query
+            stored_document = copy.copy(document)
+            stored_document.embedding = None
+            stored_document.score = None
+            line = stored_document.to_json().encode("utf-8")
+            file.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.save(path / "offsets.npy", np.array(offsets, dtype=np.uint64))
+
+    ids = np.array([document.id for document in documents])
+    order = np.argsort(ids, kind="stable")
+    np.save(path / "ids.npy", ids[order])
+    np.save(path / "id_rows.npy", order.astype(np.int64))
+
+    # Inverted index: for each term, the rows containing it and how many times
+    postings: Dict[str, Dict[int, int]] = {}
+    lengths = []
+    for row, document in enumerate(documents):
+        document_terms = _index_terms(document.content) if isinstance(document.content, str) else []
+        lengths.append(len(document_terms))
+        for term in document_terms:
+            term_postings = postings.setdefault(term, {})
+            term_postings[row] = term_postings.get(row, 0) + 1
+    sorted_terms = sorted(postings)
+    term_offsets = np.cumsum([0] + [len(postings[term]) for term in sorted_terms])
+    np.save(path / "terms.npy", np.array(sorted_terms, dtype=f"<U{MAX_TERM_LENGTH}"))
+    np.save(path / "term_offsets.npy", term_offsets.astype(np.int64))
+    np.save(
+        path / "postings_rows.npy",
+        np.array([row for term in sorted_terms for row in postings[term]], dtype=np.int32),
+    )
+    np.save(
+        path / "postings_tf.npy",
+        np.array([tf for term in sorted_terms for tf in postings[term].values()], dtype=np.float32),
+    )
+    np.save(path / "lengths.npy", np.array(lengths, dtype=np.int32))
+
+    # Only the fields holding strings are indexed, the others are filtered on the documents
+    indexed_fields = []
+    for field in meta_fields:
+        values = [(document.meta or {}).get(field) for document in documents]
+        if not all(value is None or isinstance(value, str) for value in values):
+            continue
+        sorted_values = sorted({value for value in values if value is not None})
+        positions = {value: i for i, value in enumerate(sorted_values)}
+        i = len(indexed_fields)
+        np.save(path / f"meta-{i}-values.npy", np.array(sorted_values, dtype=str))
+        np.save(
+            path / f"meta-{i}-codes.npy",
+            np.array([positions[value] if value is not None else -1 for value in values], dtype=np.int32),
+        )
+        indexed_fields.append(field)
+    (path / "meta_fields.json").write_text(json.dumps(indexed_fields))
+
+    if all(document.embedding is None for document in documents):
+        return None
+    embeddings = np.full((len(documents), embedding_dim), np.nan, dtype=np.float32)
+    for row, document in enumerate(documents):
+        if document.embedding is not None:
+            embeddings[row] = document.embedding
+    if normalize:
+        embeddings = _normalize(embeddings)
+    embeddings_file = f"embeddings-{uuid.uuid4().hex}.npy"
+    np.save(path / embeddings_file, embeddings)
+    return embeddings_file
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+
+class _Index:
+    """
+    The segments of an index, listed in its manifest. Readers reopen the manifest whenever it's replaced, and only
+    map the segments they didn't know about. Writers take an exclusive lock on the index, write the new segments,
+    then replace the manifest.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.manifest: Dict[str, Any] = {"next_segment": 0, "segments": []}
+        self.segments: List[_Segment] = []
+        self._manifest_key: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            with (self.path / MANIFEST_FILE).open() as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {"next_segment": 0, "segments": []}
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        tmp_path = self.path / f".{MANIFEST_FILE}.{uuid.uuid4().hex}"
+        tmp_path.write_text(json.dumps(manifest))
+        os.replace(tmp_path, self.path / MANIFEST_FILE)
+
+    def refresh(self) -> Tuple[Dict[str, Any], List[_Segment]]:
+        """
+        Returns the manifest and the segments of the index, reloading them if another process changed them.
+        """
+        with self._lock:
+            for _ in range(5):
+                try:
+                    stat = (self.path / MANIFEST_FILE).stat()
+                    manifest_key: Optional[Tuple[int, int]] = (stat.st_ino, stat.st_mtime_ns)
+                except FileNotFoundError:
+                    manifest_key = None
+                if manifest_key == self._manifest_key:
+                    break
+                manifest = self._read_manifest()
+                known_segments = {segment.path.name: segment for segment in self.segments}
+                try:
+                    segments = []
+                    for info in manifest["segments"]:
+                        segment = known_segments.get(info["name"]) or _Segment(self.path / info["name"])
+                        segment.update(info)
+                        segments.append(segment)
+                except FileNotFoundError:
+                    # The segment was merged by the writer in the meantime, the manifest is replaced already
+                    continue
+                self.manifest, self.segments, self._manifest_key = manifest, segments, manifest_key
+            return self.manifest, self.segments
+
+    @contextmanager
+    def writing(self) -> Iterator[Tuple[Dict[str, Any], List[_Segment]]]:
+        """
+        Locks the index for writing, and yields a copy of its manifest with its segments. The manifest is written
+        back when leaving the context, and the files of the segments that aren't in it anymore are removed.
+        """
+        with (self.path / LOCK_FILE).open("a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            # Left over by a writer that stopped while writing a segment
+            for tmp_path in self.path.glob(".tmp-*"):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+            current_manifest, segments = self.refresh()
+            manifest = copy.deepcopy(current_manifest)
+            yield manifest, segments
+            manifest["segments"] = [info for info in manifest["segments"] if len(info["deleted"]) < info["rows"]]
+            if manifest != current_manifest:
+                self._write_manifest(manifest)
+
+            # Processes still using the removed files keep them until they unmap them
+            segment_names = {info["name"] for info in manifest["segments"]}
+            for info in current_manifest["segments"]:
+                if info["name"] not in segment_names:
+                    shutil.rmtree(self.path / info["name"], ignore_errors=True)
+            embeddings_files = {(info["name"], info.get("embeddings")) for info in manifest["segments"]}
+            for info in current_manifest["segments"]:
+                if info["name"] in segment_names and (info["name"], info.get("embeddings")) not in embeddings_files:
+                    if info.get("embeddings"):
+                        (self.path / info["name"] / info["embeddings"]).unlink(missing_ok=True)
+        self.refresh()
+
+    def new_segment(
+        self,
+        manifest: Dict[str, Any],
+        documents: List[Document],
+        embedding_dim: int,
+        normalize: bool,
+        meta_fields: List[str],
+    ):
+        name = f"{manifest['next_segment']:08d}-{uuid.uuid4().hex[:8]}"
+        tmp_path = self.path / f".tmp-{name}"
+        embeddings_file = _write_segment(tmp_path, documents, embedding_dim, normalize, meta_fields)
+        os.rename(tmp_path, self.path / name)
+        manifest["next_segment"] += 1
+        manifest["segments"].append(
+            {"name": name, "rows": len(documents), "deleted": [], "embeddings": embeddings_file}
+        )
+
+
+class LabelStore(SQLiteStore):
+    """
+    Keeps the labels of the `MmapDocumentStore`.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS labels (
+            label_index TEXT NOT NULL,
+            id TEXT NOT NULL,
+            label TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (label_index, id)
+        );
+    """
+
+    def write(self, index: str, labels: List[Label]):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO labels (label_index, id, label, created_at) VALUES (?, ?, ?, ?)",
+                [(index, label.id, label.to_json(), time.time()) for label in labels],
+            )
+
+    def get_all(self, index: str, filters: Optional[FilterType] = None) -> List[Label]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT label FROM labels WHERE label_index = ? ORDER BY created_at", (index,)
+            ).fetchall()
+        labels = [Label.from_json(row["label"]) for row in rows]
+        return [label for label in labels if _label_matches(label, filters)]
+
+    def count(self, index: str) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM labels WHERE label_index = ?", (index,)).fetchone()[0]
+
+    def delete(self, index: str, ids: Optional[List[str]] = None, filters: Optional[FilterType] = None):
+        if filters:
+            matching_ids = {label.id for label in self.get_all(index, filters)}
+            ids = [label_id for label_id in ids if label_id in matching_ids] if ids is not None else list(matching_ids)
+        with self._transaction() as conn:
+            if ids is None:
+                conn.execute("DELETE FROM labels WHERE label_index = ?", (index,))
+            else:
+                conn.executemany(
+                    "DELETE FROM labels WHERE label_index = ? AND id = ?", [(index, label_id) for label_id in ids]
+                )
+
+
+def _label_matches(label: Label, filters: Optional[FilterType]) -> bool:
+    # Same filters as the InMemoryDocumentStore: the values allowed for the fields of the labels, or of their meta
+    if not filters:
+        return True
+    label_dict = label.to_dict()
+    for key, values in filters.items():
+        if key == "document_id":
+            value = label.document.id if label.document else None
+        elif key in label_dict:
+            value = label_dict[key]
+        else:
+            value = (label.meta or {}).get(key)
+        if value not in (values if isinstance(values, list) else [values]):
+            return False
+    return True
+
+
+def _filter_values(condition: Any) -> Optional[List[str]]:
+    # The values allowed by the simple conditions on a field, if they're strings: "value", ["value", ...],
+    # {"$eq": "value"} or {"$in": ["value", ...]}
+    if isinstance(condition, dict) and len(condition) == 1:
+        operator, condition = next(iter(condition.items()))
+        if operator == "$eq" and isinstance(condition, str):
+            return [condition]
+        if operator != "$in" or not isinstance(condition, list):
+            return None
+    if isinstance(condition, str):
+        return [condition]
+    if isinstance(condition, list) and all(isinstance(value, str) for value in condition):
+        return condition
+    return None
+
+
+def _prefilter(
+    segment: _Segment, filters: Optional[FilterType]
+) -> Tuple[Optional[np.ndarray], Optional[LogicalFilterClause]]:
+    """
+    Returns the mask of the rows of a segment matching the conditions of `filters` on its indexed meta fields
+    (None if there's none), and the other conditions, to be evaluated on the documents.
+    """
+    mask = None
+    remaining_filters = {}
+    for field, condition in (filters or {}).items():
+        values = _filter_values(condition)
+        rows = segment.meta_rows(field, values) if values is not None else None
+        if rows is None:
+            remaining_filters[field] = condition
+        else:
+            mask = rows if mask is None else mask & rows
+    return mask, LogicalFilterClause.parse(remaining_filters) if remaining_filters else None
+
+
+class MmapDocumentStore(KeywordDocumentStore):
+    """
+    DocumentStore kept in memory-mapped files, shared by all the workers of a node: the pages of the documents,
+    of their embeddings and of the BM25 index are in the page cache once, whatever the number of workers, and no
+    external service is needed. It supports the `BM25Retriever` and the dense retrievers (like the
+    `EmbeddingRetriever`):
+
+    ```yaml
+    - name: DocumentStore
+      type: MmapDocumentStore
+      params:
+        index_path: /data/document-store
+    ```
+
+    Documents are written in immutable segments. Writers (the indexing jobs) take an exclusive lock on the index,
+    while readers (the queries of all the workers) pick up the new segments as soon as they're written, without
+    locking nor restarting. Deleting or overwriting documents marks their rows as deleted, and the segments are
+    merged once there are more than `max_segments` of them.
+
+    The string values of the `indexed_meta_fields` (the `pdf_name` by default) are indexed in each segment: the
+    filters on these fields select the rows without decoding the documents, the other filters are evaluated on the
+    documents.
+
+    Labels are kept in a SQLite file next to the index.
+    """
+
+    def __init__(
+        self,
+        index_path: Optional[str] = None,
+        index: str = "document",
+        label_index: str = "label",
+        embedding_dim: int = 768,
+        similarity: str = "dot_product",
+        duplicate_documents: str = "overwrite",
+        max_segments: int = 8,
+        bm25_parameters: Optional[Dict[str, float]] = None,
+        max_open_indexes: Optional[int] = None,
+        indexed_meta_fields: Optional[List[str]] = None,
+    ):
+        # Imported here so the settings are read when the pipeline is loaded, like in `setup_pipelines`
+        from main_rest_api import config  # pylint: disable=import-outside-toplevel
+
+        super().__init__()
+        if similarity not in ("dot_product", "cosine"):
+            raise ValueError("The MmapDocumentStore supports the 'dot_product' and 'cosine' similarities.")
+        if duplicate_documents not in self.duplicate_documents_options:
+            raise ValueError(f"duplicate_documents must be one of {', '.join(self.duplicate_documents_options)}.")
+        self.index_path = Path(index_path or Path(config.STATE_DB_PATH).parent / "document-store")
+        self.index = index
+        self.label_index = label_index
+        self.embedding_dim = embedding_dim
+        self.similarity = similarity
+        self.duplicate_documents = duplicate_documents
+        self.max_segments = max_segments
+        self.bm25_parameters = {"k1": 1.5, "b": 0.75, **(bm25_parameters or {})}
+        self.indexed_meta_fields = indexed_meta_fields if indexed_meta_fields is not None else ["pdf_name"]
+        self.labels = LabelStore(str(self.index_path / "labels.sqlite3"))
+        # Each mapped file holds a file descriptor: with many indexes, only the last used ones are kept open
+        self.max_open_indexes = max_open_indexes
+        self._indexes: "OrderedDict[str, _Index]" = OrderedDict()
+        self._indexes_lock = threading.Lock()
+
+    def _get_index(self, index: Optional[str] = None) -> _Index:
+        index = index or self.index
+        with self._indexes_lock:
+            if index not in self._indexes:
+                self._indexes[index] = _Index(self.index_path / index)
+            self._indexes.move_to_end(index)
+            while self.max_open_indexes and len(self._indexes) > self.max_open_indexes:
+                # Threads still using it keep its files mapped until they're done
+                self._indexes.popitem(last=False)
+            return self._indexes[index]
+
+    def index_exists(self, index: str) -> bool:
+        return (self.index_path / index / MANIFEST_FILE).exists()
+
+    def list_indexes(self) -> List[str]:
+        return sorted(path.parent.name for path in self.index_path.glob(f"*/{MANIFEST_FILE}"))
+
+    def _create_document_field_map(self) -> Dict:
+        return {}
+
+    # Writing
+
+    def write_documents(
+        self,
+        documents: Union[List[dict], List[Document]],
+        index: Optional[str] = None,
+        batch_size: int = 10_000,
+        duplicate_documents: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        if headers:
+            raise NotImplementedError("MmapDocumentStore does not support headers.")
+        duplicate_documents = duplicate_documents or self.duplicate_documents
+        field_map = self._create_document_field_map()
+        documents_objects = [
+            document if isinstance(document, Document) else Document.from_dict(document, field_map=field_map)
+            for document in documents
+        ]
+        documents_objects = self._drop_duplicate_documents(documents_objects, index)
+        if not documents_objects:
+            return
+
+        index_ = self._get_index(index)
+        with index_.writing() as (manifest, segments):
+            existing = []
+            for document in documents_objects:
+                for info, segment in zip(manifest["segments"], segments):
+                    row = segment.find(document.id)
+                    if row is not None:
+                        existing.append((document.id, info, row))
+            if existing and duplicate_documents == "fail":
+                raise DuplicateDocumentError(
+                    f"Documents with the IDs {', '.join(sorted({document_id for document_id, _, _ in existing}))} "
+                    f"already exist in the index '{index or self.index}'."
+                )
+            if duplicate_documents == "skip":
+                existing_ids = {document_id for document_id, _, _ in existing}
+                documents_objects = [document for document in documents_objects if document.id not in existing_ids]
+            else:
+                for _, info, row in existing:
+                    info["deleted"] = sorted(set(info["deleted"]) | {row})
+
+            for i in range(0, len(documents_objects), batch_size):
+                index_.new_segment(
+                    manifest,
+                    documents_objects[i : i + batch_size],
+                    self.embedding_dim,
+                    normalize=self.similarity == "cosine",
+                    meta_fields=self.indexed_meta_fields,
+                )
+        if len(index_.refresh()[1]) > self.max_segments:
+            self.merge_segments(index)
+
+    def merge_segments(self, index: Optional[str] = None):
+        """
+        Rewrites all the live documents of an index in a single segment, dropping the deleted ones.
+        """
+        index_ = self._get_index(index)
+        with index_.writing() as (manifest, segments):
+            if len(segments) < 2:
+                return
+            start_time = time.time()
+            documents = [
+                segment.document(row, return_embedding=True)
+                for segment in segments
+                for row in np.flatnonzero(segment.live)
+            ]
+            manifest["segments"] = []
+            if documents:
+                # Embeddings are normalized already
+                index_.new_segment(
+                    manifest, documents, self.embedding_dim, normalize=False, meta_fields=self.indexed_meta_fields
+                )
+        logger.info(
+            f"Merged {len(segments)} segments ({len(documents)} documents) in {(time.time() - start_time):.2f} seconds"
+        )
+
+    def update_embeddings(
+        self,
+        retriever: DenseRetriever,
+        index: Optional[str] = None,
+        update_existing_embeddings: bool = True,
+        filters: Optional[FilterType] = None,
+        batch_size: int = 10_000,
+    ):
+        """
+        Computes the embeddings of the documents with `retriever`, for all of them or only for the ones without
+        embedding.
+        """
+        index_ = self._get_index(index)
+        with index_.writing() as (manifest, segments):
+            for info, segment in zip(manifest["segments"], segments):
+                selected_rows = segment.live if update_existing_embeddings else segment.live & ~segment.has_embeddings()
+                mask, parsed_filter = _prefilter(segment, filters)
+                rows = np.flatnonzero(selected_rows if mask is None else selected_rows & mask)
+                documents = [segment.document(row) for row in rows]
+                if parsed_filter:
+                    selected = [parsed_filter.evaluate(document.meta) for document in documents]
+                    rows = rows[np.array(selected, dtype=bool)]
+                    documents = [document for document, keep in zip(documents, selected) if keep]
+                if not documents:
+                    continue
+
+                if segment.embeddings is not None:
+                    embeddings = np.array(segment.embeddings)
+                else:
+                    embeddings = np.full((segment.rows, self.embedding_dim), np.nan, dtype=np.float32)
+                for i in range(0, len(documents), batch_size):
+                    batch_embeddings = retriever.embed_documents(documents[i : i + batch_size])
+                    if batch_embeddings.shape[-1] != self.embedding_dim:
+                        raise ValueError(
+                            f"The embeddings have {batch_embeddings.shape[-1]} dimensions, "
+                            f"the MmapDocumentStore expects {self.embedding_dim} (embedding_dim)."
+                        )
+                    if self.similarity == "cosine":
+                        batch_embeddings = _normalize(batch_embeddings)
+                    embeddings[rows[i : i + batch_size]] = batch_embeddings
+                info["embeddings"] = f"embeddings-{uuid.uuid4().hex}.npy"
+                np.save(segment.path / info["embeddings"], embeddings.astype(np.float32))
+
+    def update_document_meta(self, id: str, meta: Dict[str, Any], index: Optional[str] = None):
+        """
+        Updates the meta of a document. Segments being immutable, the document is written again.
+        """
+        document = self.get_document_by_id(id, index=index)
+        if document is None:
+            raise ValueError(f"No document with the ID '{id}' in the index '{index or self.index}'.")
+        document.meta = {**(document.meta or {}), **meta}
+        # Normalized already, if needed: writing it again is a no-op
+        self.write_documents([document], index=index, duplicate_documents="overwrite")
+
+    def delete_documents(
+        self,
+        index: Optional[str] = None,
+        ids: Optional[List[str]] = None,
+        filters: Optional[FilterType] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        if headers:
+            raise NotImplementedError("MmapDocumentStore does not support headers.")
+        ids_to_delete = set(ids) if ids is not None else None
+        with self._get_index(index).writing() as (manifest, segments):
+            for info, segment in zip(manifest["segments"], segments):
+                if ids_to_delete is not None and not filters:
+                    rows = [segment.find(document_id) for document_id in ids_to_delete]
+                    rows = [row for row in rows if row is not None]
+                else:
+                    mask, parsed_filter = _prefilter(segment, filters)
+                    rows = np.flatnonzero(segment.live if mask is None else segment.live & mask).tolist()
+                    if ids_to_delete is not None or parsed_filter is not None:
+                        rows = [
+                            row
+                            for row in rows
+                            if self._matches(segment.document(row), ids_to_delete, parsed_filter)
+                        ]
+                if rows:
+                    info["deleted"] = sorted(set(info["deleted"]) | {int(row) for row in rows})
+
+    def delete_index(self, index: str):
+        with self._get_index(index).writing() as (manifest, _):
+            manifest["segments"] = []
+        self.labels.delete(index)
+
+    def write_labels(
+        self,
+        labels: Union[List[Label], List[dict]],
+        index: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        if headers:
+            raise NotImplementedError("MmapDocumentStore does not support headers.")
+        label_objects = [label if isinstance(label, Label) else Label.from_dict(label) for label in labels]
+        self.labels.write(index or self.label_index, label_objects)
+
+    def delete_labels(
+        self,
+        index: Optional[str] = None,
+        ids: Optional[List[str]] = None,
+        filters: Optional[FilterType] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        if headers:
+            raise NotImplementedError("MmapDocumentStore does not support headers.")
+        self.labels.delete(index or self.label_index, ids=ids, filters=filters)
+
+    # Reading
+
+    @staticmethod
+    def _matches(document: Document, ids: Optional[set], parsed_filter: Optional[LogicalFilterClause]) -> bool:
+        if ids is not None and document.id not in ids:
+            return False
+        return parsed_filter is None or parsed_filter.evaluate(document.meta)
+
+    def get_all_documents_generator(
+        self,
+        index: Optional[str] = None,
+        filters: Optional[FilterType] = None,
+        return_embedding: Optional[bool] = None,
+        batch_size: int = 10_000,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Generator[Document, None, None]:
+        if headers:
+            raise NotImplementedError("MmapDocumentStore does not support headers.")
+        _, segments = self._get_index(index).refresh()
+        for segment in segments:
+            mask, parsed_filter = _prefilter(segment, filters)
+            for row in np.flatnonzero(segment.live if mask is None else segment.live & mask):
+                document = segment.document(row, return_embedding=bool(return_embedding))
+                if parsed_filter is None or parsed_filter.evaluate(document.meta):
+                    yield document
+
+    def get_documents_after(
+        self,
+        after_id: Optional[str],
+        limit: int,
+        filters: Optional[FilterType] = None,
+        index: Optional[str] = None,
+        return_embedding: bool = False,
+    ) -> List[Document]:
+        """
+        Returns the first `limit` documents matching the filters, in the order of their IDs, after `after_id`.
+        The pages read this way don't skip nor repeat documents when others are written or deleted in between.
+        """
+        _, segments = self._get_index(index).refresh()
+
+        def segment_rows(segment: _Segment) -> Iterator[Tuple[str, _Segment, int, Optional[Document]]]:
+            mask, parsed_filter = _prefilter(segment, filters)
+            start = int(np.searchsorted(segment.ids, after_id, side="right")) if after_id is not None else 0
+            for i in range(start, len(segment.ids)):
+                row = int(segment.id_rows[i])
+                if not segment.live[row] or (mask is not None and not mask[row]):
+                    continue
+                document = None
+                if parsed_filter is not None:
+                    document = segment.document(row)
+                    if not parsed_filter.evaluate(document.meta):
+                        continue
+                yield str(segment.ids[i]), segment, row, document
+
+        documents: List[Document] = []
+        # A live document is in a single segment, so the IDs merged from all of them are unique
+        merged = heapq.merge(*[segment_rows(segment) for segment in segments], key=lambda item: item[0])
+        for _, segment, row, document in merged:
+            if document is None or return_embedding:
+                document = segment.document(row, return_embedding=return_embedding)
+            documents.append(document)
+            if len(documents) == limit:
+                break
+        return documents
+
+    def get_all_documents(
+        self,
+        index: Optional[str] = None,
+        filters: Optional[FilterType] = None,
+        return_embedding: Optional[bool] = None,
+        batch_size: int = 10_000,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> List[Document]:
+        return list(
+            self.get_all_documents_generator(
+                index=index, filters=filters, return_embedding=return_embedding, batch_size=batch_size, headers=headers
+            )
+        )
+
+    def get_documents_by_id(
+        self,
+        ids: List[str],
+        index: Optional[str] = None,
+        batch_size: int = 10_000,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> List[Document]:
+        if headers:
+            raise NotImplementedError("MmapDocumentStore does not support headers.")
+        _, segments = self._get_index(index).refresh()
+        documents = []
+        for document_id in ids:
+            # Newest segments first, though a live document is only in one of them
+            for segment in reversed(segments):
+                row = segment.find(document_id)
+                if row is not None:
+                    documents.append(segment.document(row))
+                    break
+        return documents
+
+    def get_document_by_id(
+        self, id: str, index: Optional[str] = None, headers: Optional[Dict[str, str]] = None
+    ) -> Optional[Document]:
+        _, segments = self._get_index(index).refresh()
+        for segment in reversed(segments):
+            row = segment.find(id)
+            if row is not None:
+                return segment.document(row, return_embedding=True)
+        return None
+
+    def get_document_count(
+        self,
+        filters: Optional[FilterType] = None,
+        index: Optional[str] = None,
+        only_documents_without_embedding: bool = False,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> int:
+        if headers:
+            raise NotImplementedError("MmapDocumentStore does not support headers.")
+        _, segments = self._get_index(index).refresh()
+        count = 0
+        for segment in segments:
+            rows = segment.live & ~segment.has_embeddings() if only_documents_without_embedding else segment.live
+            mask, parsed_filter = _prefilter(segment, filters)
+            if mask is not None:
+                rows = rows & mask
+            if parsed_filter is None:
+                count += int(rows.sum())
+            else:
+                count += sum(parsed_filter.evaluate(segment.document(row).meta) for row in np.flatnonzero(rows))
+        return count
+
+    def get_embedding_count(self, index: Optional[str] = None, filters: Optional[FilterType] = None) -> int:
+        return self.get_document_count(filters=filters, index=index) - self.get_document_count(
+            filters=filters, index=index, only_documents_without_embedding=True
+        )
+
+    def get_all_labels(
+        self,
+        index: Optional[str] = None,
+        filters: Optional[FilterType] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> List[Label]:
+        if headers:
+            raise NotImplementedError("MmapDocumentStore does not support headers.")
+        return self.labels.get_all(index or self.label_index, filters)
+
+    def get_label_count(self, index: Optional[str] = None, headers: Optional[Dict[str, str]] = None) -> int:
+        return self.labels.count(index or self.label_index)
+
+    # Search
+
+    def _top_documents(
+        self,
+        candidates: List[Tuple[_Segment, np.ndarray, np.ndarray, Optional[LogicalFilterClause]]],
+        top_k: int,
+        return_embedding: bool,
+    ) -> List[Document]:
+        """
+        Returns the `top_k` best documents matching the filters, out of the scored rows of each segment and the
+        filter left to evaluate on its documents.
+        """
+        ranked_candidates = []
+        for i, (_, rows, scores, parsed_filter) in enumerate(candidates):
+            if parsed_filter is None and len(rows) > top_k:
+                # Without filters left, no more than `top_k` rows of each segment can make it
+                best = np.argpartition(-scores, top_k)[:top_k]
+                rows, scores = rows[best], scores[best]
+            order = np.argsort(-scores, kind="stable")
+            ranked_candidates.append(zip((-scores[order]).tolist(), [i] * len(order), rows[order].tolist()))
+
+        documents: List[Document] = []
+        for negative_score, i, row in heapq.merge(*ranked_candidates):
+            document = candidates[i][0].document(row, return_embedding=return_embedding)
+            parsed_filter = candidates[i][3]
+            if parsed_filter is not None and not parsed_filter.evaluate(document.meta):
+                continue
+            document.score = -negative_score
+            documents.append(document)
+            if len(documents) == top_k:
+                break
+        return documents
+
+    def query(
+        self,
+        query: Optional[str],
+        filters: Optional[FilterType] = None,
+        top_k: int = 10,
+        custom_query: Optional[str] = None,
+        index: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        all_terms_must_match: bool = False,
+        scale_score: bool = True,
+    ) -> List[Document]:
+        """
+        Finds the documents best matching the query with BM25.
+        """
+        if headers:
+            raise NotImplementedError("MmapDocumentStore does not support headers.")
+        if custom_query:
+            raise NotImplementedError("MmapDocumentStore does not support custom queries.")
+        _, segments = self._get_index(index).refresh()
+        query_terms = sorted(set(_index_terms(query or "")))
+        if not segments or not query_terms:
+            return []
+
+        # Statistics of the live documents of all the segments
+        document_count = sum(int(segment.live.sum()) for segment in segments)
+        total_length = sum(int(segment.lengths[segment.live].sum()) for segment in segments)
+        average_length = max(total_length / max(document_count, 1), 1)
+        postings = [{term: segment.postings(term) for term in query_terms} for segment in segments]
+        idf = {}
+        for term in query_terms:
+            frequency = sum(
+                int(segment.live[segment_postings[term][0]].sum())
+                for segment, segment_postings in zip(segments, postings)
+            )
+            idf[term] = np.log(1 + (document_count - frequency + 0.5) / (frequency + 0.5))
+
+        k1, b = self.bm25_parameters["k1"], self.bm25_parameters["b"]
+        candidates = []
+        for segment, segment_postings in zip(segments, postings):
+            scores = np.zeros(segment.rows, dtype=np.float32)
+            matched_terms = np.zeros(segment.rows, dtype=np.int32)
+            for term in query_terms:
+                rows, tf = segment_postings[term]
+                lengths = segment.lengths[rows]
+                scores[rows] += idf[term] * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths / average_length))
+                matched_terms[rows] += 1
+            matched = matched_terms == len(query_terms) if all_terms_must_match else matched_terms > 0
+            mask, parsed_filter = _prefilter(segment, filters)
+            if mask is not None:
+                matched &= mask
+            rows = np.flatnonzero(matched & segment.live)
+            candidates.append((segment, rows, scores[rows], parsed_filter))
+
+        documents = self._top_documents(candidates, top_k, return_embedding=False)
+        if scale_score:
+            for document in documents:
+                # Same scaling as the Elasticsearch BM25 scores
+                document.score = float(1 / (1 + np.exp(-document.score / 8)))
+        return documents
+
+    def query_batch(
+        self,
+        queries: List[str],
+        filters: Optional[Union[FilterType, List[Optional[FilterType]]]] = None,
+        top_k: int = 10,
+        custom_query: Optional[str] = None,
+        index: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        all_terms_must_match: bool = False,
+        scale_score: bool = True,
+    ) -> List[List[Document]]:
+        filters_list = filters if isinstance(filters, list) else [filters] * len(queries)
+        return [
+            self.query(
+                query,
+                filters=query_filters,
+                top_k=top_k,
+                custom_query=custom_query,
+                index=index,
+                headers=headers,
+                all_terms_must_match=all_terms_must_match,
+                scale_score=scale_score,
+            )
+            for query, query_filters in zip(queries, filters_list)
+        ]
+
+    def query_by_embedding(
+        self,
+        query_emb: np.ndarray,
+        filters: Optional[FilterType] = None,
+        top_k: int = 10,
+        index: Optional[str] = None,
+        return_embedding: Optional[bool] = None,
+        headers: Optional[Dict[str, str]] = None,
+        scale_score: bool = True,
+    ) -> List[Document]:
+        if headers:
+            raise NotImplementedError("MmapDocumentStore does not support headers.")
+        _, segments = self._get_index(index).refresh()
+        query_embedding = np.asarray(query_emb, dtype=np.float32).reshape(-1)
+        if self.similarity == "cosine":
+            query_embedding = _normalize(query_embedding)
+
+        candidates = []
+        for segment in segments:
+            if segment.embeddings is None:
+                continue
+            mask, parsed_filter = _prefilter(segment, filters)
+            if mask is None:
+                scores = np.asarray(segment.embeddings @ query_embedding)
+                rows = np.flatnonzero(segment.live & ~np.isnan(scores))
+                scores = scores[rows]
+            else:
+                # Only the rows selected by the meta index are read and scored
+                rows = np.flatnonzero(segment.live & mask)
+                scores = np.asarray(segment.embeddings[rows] @ query_embedding)
+                rows, scores = rows[~np.isnan(scores)], scores[~np.isnan(scores)]
+            candidates.append((segment, rows, scores, parsed_filter))
+
+        documents = self._top_documents(candidates, top_k, return_embedding=bool(return_embedding))
+        if scale_score:
+            for document in documents:
+                document.score = self.scale_to_unit_interval(document.score, self.similarity)
+        return documents
+
+    def query_by_embedding_batch(
+        self,
+        query_embs: Union[List[np.ndarray], np.ndarray],
+        filters: Optional[Union[FilterType, List[Optional[FilterType]]]] = None,
+        top_k: int = 10,
+        index: Optional[str] = None,
+        return_embedding: Optional[bool] = None,
+        headers: Optional[Dict[str, str]] = None,
+        scale_score: bool = True,
+    ) -> List[List[Document]]:
+        filters_list = filters if isinstance(filters, list) else [filters] * len(query_embs)
+        return [
+            self.query_by_embedding(
+                query_emb,
+                filters=query_filters,
+                top_k=top_k,
+                index=index,
+                return_embedding=return_embedding,
+                headers=headers,
+                scale_score=scale_score,
+            )
+            for query_emb, query_filters in zip(query_embs, filters_list)
+        ]
@@ -0,0 +1,233 @@
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import os
+import time
+import logging
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+from haystack.pipelines.base import Pipeline
+from haystack.pipelines.config import read_pipeline_config_from_yaml
+from haystack.nodes import BaseConverter, PDFToTextConverter, PreProcessor
+from haystack.schema import Document
+
+from main_rest_api.pipeline.instrumentation import instrument_pipeline, node_timings, record_node_timings
+
+
+logger = logging.getLogger(__name__)
+
+ROOT_NODES = ("File", "Query")
+
+# Pipeline with the conversion & preprocessing nodes of the indexing pipeline, loaded once in each worker process
+_conversion_pipeline: Optional[Pipeline] = None
+
+
+def _init_worker(pipeline_yaml_path: str, pipeline_name: str, node_names: List[str]):
+    global _conversion_pipeline  # pylint: disable=global-statement
+
+    # Only the conversion & preprocessing components are loaded: the others (DocumentStore, Retrievers...)
+    # stay in the parent process
+    config = read_pipeline_config_from_yaml(Path(pipeline_yaml_path))
+    pipeline_definition = next(p for p in config["pipelines"] if p["name"] == pipeline_name)
+    config = {
+        **config,
+        "components": [c for c in config["components"] if c["name"] in node_names],
+        "pipelines": [
+            {**pipeline_definition, "nodes": [n for n in pipeline_definition["nodes"] if n["name"] in node_names]}
+        ],
+    }
+    _conversion_pipeline = Pipeline.load_from_config(config, pipeline_name=pipeline_name)
+    instrument_pipeline(_conversion_pipeline, pipeline_name)
+
+    # Each worker already uses one core, nested process pools would oversubscribe them
+    for converter in _conversion_pipeline.get_nodes_by_class(PDFToTextConverter):
+        if hasattr(converter, "multiprocessing"):
+            converter.multiprocessing = False
+
+
+def _convert(
+    file_path: str, meta: Dict[str, Any], params: Dict[str, Any], page_range: Optional[Tuple[int, int]]
+) -> Tuple[List[Document], Dict[str, float]]:
+    """
+    Converts a file (or a range of its pages) and returns its documents, with the time spent in each node,
+    to be recorded by the parent process.
+    """
+    if page_range is None:
+        with node_timings() as timings:
+            result = _conversion_pipeline.run(  # type: ignore
+                file_paths=[Path(file_path)], meta=[meta], params=params
+            )
+        return result.get("documents", None) or [], timings
+
+    # Converters don't take a page range through `Pipeline.run`, so the PDF is converted directly and the
+    # resulting documents go through the preprocessors
+    timings = {}
+    start_page, end_page = page_range
+    converter = _conversion_pipeline.get_nodes_by_class(PDFToTextConverter)[0]  # type: ignore
+    start_time = time.perf_counter()
+    documents = converter.convert(
+        file_path=Path(file_path),
+        meta=meta,
+        start_page=start_page,
+        end_page=end_page,
+        **{k: v for k, v in params.get(converter.name, {}).items() if v is not None},
+    )
+    timings[converter.name] = time.perf_counter() - start_time
+    for preprocessor in _conversion_pipeline.get_nodes_by_class(PreProcessor):  # type: ignore
+        start_time = time.perf_counter()
+        documents = preprocessor.process(
+            documents, **{k: v for k, v in params.get(preprocessor.name, {}).items() if v is not None}
+        )
+        timings[preprocessor.name] = time.perf_counter() - start_time
+    return documents, timings
+
+
+def _count_pages(file_path: Path) -> Optional[int]:
+    try:
+        import fitz  # pylint: disable=import-outside-toplevel
+
+        with fitz.open(str(file_path)) as pdf:
+            return pdf.page_count
+    except Exception:  # pylint: disable=broad-except
+        logger.warning("Could not count the pages of %s, it will be converted as a whole.", file_path)
+        return None
+
+
+class ParallelIndexer:
+    """
+    Runs the conversion & preprocessing nodes of an indexing pipeline on a pool of processes, one task per file
+    (or per range of `pages_per_task` pages for large PDFs), then runs the remaining nodes (Retrievers computing
+    embeddings, the DocumentStore...) in the calling process, on all the documents at once, so that they're
+    written with a single batched `write_documents`.
+
+    A number of `processes` of 0 disables it.
+    """
+
+    def __init__(
+        self, pipeline: Pipeline, pipeline_yaml_path: str, pipeline_name: str, processes: int, pages_per_task: int
+    ):
+        self.pipeline = pipeline
+        self.pipeline_yaml_path = str(pipeline_yaml_path)
+        self.pipeline_name = pipeline_name
+        self.processes = processes
+        self.pages_per_task = pages_per_task
+        self.conversion_nodes = self._find_conversion_nodes(pipeline)
+        self.tail_pipeline = self._build_tail_pipeline(pipeline, self.conversion_nodes)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.processes > 0 and bool(self.conversion_nodes)
+
+    @staticmethod
+    def _find_conversion_nodes(pipeline: Pipeline) -> Set[str]:
+        """
+        Finds the converters and preprocessors, and the nodes they depend on (like a FileTypeClassifier).
+        """
+        nodes: Set[str] = set()
+        for component in pipeline.get_nodes_by_class(BaseConverter) + pipeline.get_nodes_by_class(PreProcessor):
+            nodes.add(component.name)
+            nodes.update(nx.ancestors(pipeline.graph, component.name))
+        return nodes - set(ROOT_NODES)
+
+    @staticmethod
+    def _build_tail_pipeline(pipeline: Pipeline, conversion_nodes: Set[str]) -> Optional[Pipeline]:
+        tail_nodes = [
+            name
+            for name in nx.topological_sort(pipeline.graph)
+            if name not in conversion_nodes and name not in ROOT_NODES
+        ]
+        if not tail_nodes:
+            return None
+        tail_pipeline = Pipeline()
+        for name in tail_nodes:
+            inputs = [input_name for input_name in pipeline.graph.predecessors(name) if input_name in tail_nodes]
+            tail_pipeline.add_node(component=pipeline.get_node(name), name=name, inputs=inputs or ["File"])
+        return tail_pipeline
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Created lazily in the process serving the requests. Worker processes are spawned rather than forked,
+        # as forking a process running threads (and models) is unsafe.
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.pipeline_yaml_path, self.pipeline_name, sorted(self.conversion_nodes)),
+            )
+        return self._executor
+
+    def _page_ranges(self, file_path: Path) -> List[Optional[Tuple[int, int]]]:
+        if file_path.suffix.lower() != ".pdf" or not self.pipeline.get_nodes_by_class(PDFToTextConverter):
+            return [None]
+        page_count = _count_pages(file_path)
+        if not page_count or page_count <= self.pages_per_task:
+            return [None]
+        return [
+            (start_page, min(start_page + self.pages_per_task - 1, page_count))
+            for start_page in range(1, page_count + 1, self.pages_per_task)
+        ]
+
+    def run(
+        self,
+        file_paths: List[Path],
+        file_metas: List[Dict[str, Any]],
+        params: Dict[str, Any],
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> List[List[Document]]:
+        """
+        Indexes the files and returns the documents written to the DocumentStore for each of them.
+        """
+        start_time = time.time()
+        executor = self._get_executor()
+        # Node params go to the pipeline holding that node, global params to both
+        tail_nodes = set(self.tail_pipeline.graph.nodes) if self.tail_pipeline else set()
+        conversion_params = {name: value for name, value in params.items() if name not in tail_nodes}
+        tail_params = {name: value for name, value in params.items() if name not in self.conversion_nodes}
+
+        tasks_per_file = []
+        for file_path, file_meta in zip(file_paths, file_metas):
+            tasks_per_file.append(
+                [
+                    executor.submit(_convert, str(file_path), file_meta, conversion_params, page_range)
+                    for page_range in self._page_ranges(Path(file_path))
+                ]
+            )
+
+        # Files are collected in order, so the documents are written in the same order as without parallelism
+        documents: List[Document] = []
+        documents_per_file: List[int] = []
+        for files_converted, tasks in enumerate(tasks_per_file, start=1):
+            file_documents = []
+            for task in tasks:
+                task_documents, timings = task.result()
+                file_documents += task_documents
+                record_node_timings(self.pipeline_name, timings)
+            documents += file_documents
+            documents_per_file.append(len(file_documents))
+            if progress:
+                progress(files_converted, 0)
+        logger.info(
+            f"Converted {len(file_paths)} files into {len(documents)} documents "
+            f"in {(time.time() - start_time):.2f} seconds"
+        )
+
+        if self.tail_pipeline and documents:
+            result = self.tail_pipeline.run(documents=documents, params=tail_params)
+            written_documents = result.get("documents", None) or []
+            # Nodes like Retrievers can return new Document objects, but keep their order
+            if len(written_documents) == len(documents):
+                documents = written_documents
+        if progress:
+            progress(len(file_paths), len(documents))
+
+        split_documents = []
+        offset = 0
+        for count in documents_per_file:
+            split_documents.append(documents[offset : offset + count])
+            offset += count
+        return split_documents
@@ -0,0 +1,125 @@
+from typing import Dict, List, Sequence, Set, Tuple
+
+import re
+import math
+import unicodedata
+
+
+Span = Tuple[int, int]
+
+# Sentences end with a punctuation mark followed by a space, or with a line break. Periods followed by a lowercase
+# letter are abbreviations (like "Banco Pichincha C.A. certifica").
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?![a-záéíóúüñ])|\s*\n\s*")
+WORD = re.compile(r"\w+")
+# Joins the passages kept of a document, see `PassageSelector`
+PASSAGE_SEPARATOR = "\n"
+
+# Words too frequent to tell passages apart, in the languages of the indexed files
+# fmt: off
+STOPWORDS: Set[str] = {
+    # Spanish
+    "a", "al", "como", "con", "cual", "cuales", "cuando", "de", "del", "donde", "el", "ella", "en", "es", "esta",
+    "este", "la", "las", "lo", "los", "mas", "no", "o", "para", "pero", "por", "que", "quien", "se", "si", "sin",
+    "son", "su", "sus", "un", "una", "uno", "y", "ya",
+    # English
+    "an", "and", "are", "at", "be", "by", "did", "do", "does", "for", "from", "how", "in", "is", "it", "of", "on",
+    "or", "the", "to", "was", "were", "what", "when", "where", "which", "who", "why", "with",
+}
+# fmt: on
+
+
+def normalize_word(word: str) -> str:
+    """
+    Lowercases a word and strips its accents, so that "Cuál" and "cual" match.
+    """
+    decomposed = unicodedata.normalize("NFKD", word.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def terms(text: str) -> List[str]:
+    return [word for word in (normalize_word(match) for match in WORD.findall(text)) if word not in STOPWORDS]
+
+
+def split_sentences(text: str) -> List[Span]:
+    """
+    Returns the (start, end) offsets of the sentences of a text.
+    """
+    spans = []
+    start = 0
+    for boundary in SENTENCE_BOUNDARY.finditer(text):
+        if boundary.start() > start:
+            spans.append((start, boundary.start()))
+        start = boundary.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def select_windows(
+    query: str, texts: Sequence[str], window_size: int, top_k: int
+) -> List[Tuple[List[Span], List[float]]]:
+    """
+    Scores the windows of `window_size` consecutive sentences of each text by their overlap with the query, and
+    returns, for each text, the spans of its `top_k` best windows (overlapping windows merged, in the order of the
+    text) and their scores.
+
+    The overlap of a window is the sum of the IDF of the query terms it contains, the IDF being computed on the
+    sentences of all the texts, so that terms found everywhere (like the name of the bank in its own statements)
+    weigh less than the ones telling the windows apart.
+    """
+    query_terms = set(terms(query))
+    sentences_per_text = [split_sentences(text) for text in texts]
+    sentence_terms = [
+        [set(terms(text[start:end])) & query_terms for start, end in sentences]
+        for text, sentences in zip(texts, sentences_per_text)
+    ]
+
+    sentence_count = sum(len(sentences) for sentences in sentences_per_text)
+    document_frequency: Dict[str, int] = {}
+    for text_terms in sentence_terms:
+        for found_terms in text_terms:
+            for term in found_terms:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+    idf = {
+        term: math.log(1 + (sentence_count - frequency + 0.5) / (frequency + 0.5))
+        for term, frequency in document_frequency.items()
+    }
+
+    selections = []
+    for sentences, text_terms in zip(sentences_per_text, sentence_terms):
+        if not sentences:
+            selections.append(([], []))
+            continue
+        windows = []
+        for first in range(max(len(sentences) - window_size + 1, 1)):
+            last = min(first + window_size, len(sentences)) - 1
+            window_terms = set().union(*text_terms[first : last + 1])
+            windows.append((sum(idf[term] for term in window_terms), first, last))
+        # Best scores first, earlier windows first on ties
+        best = sorted(windows, key=lambda window: (-window[0], window[1]))[:top_k]
+
+        spans: List[Span] = []
+        scores: List[float] = []
+        for score, first, last in sorted(best, key=lambda window: window[1]):
+            start, end = sentences[first][0], sentences[last][1]
+            if spans and start <= spans[-1][1]:
+                spans[-1] = (spans[-1][0], max(end, spans[-1][1]))
+                scores[-1] = max(score, scores[-1])
+            else:
+                spans.append((start, end))
+                scores.append(score)
+        selections.append((spans, scores))
+    return selections
+
+
+def original_offset(spans: Sequence[Span], offset: int) -> int:
+    """
+    Maps an offset in the passages of a text joined with `PASSAGE_SEPARATOR` back to the offset in the text,
+    `spans` being the (start, end) offsets of the passages in the text.
+    """
+    passage_start = 0
+    for start, end in spans:
+        if offset <= passage_start + end - start:
+            return start + max(offset - passage_start, 0)
+        passage_start += end - start + len(PASSAGE_SEPARATOR)
+    return spans[-1][1] if spans else offset
@@ -0,0 +1,212 @@
+from typing import Any, Dict, List, Optional
+
+import os
+import re
+import uuid
+import shutil
+import hashlib
+import logging
+from pathlib import Path
+
+from haystack.pipelines.base import Pipeline
+from haystack.nodes import FARMReader
+from haystack.modeling.infer import QAInferencer
+
+
+logger = logging.getLogger(__name__)
+
+PYTORCH = "pytorch"
+# PyTorch with the weights of the linear layers converted to int8, done each time the model is loaded
+QUANTIZED = "quantized"
+# ONNX Runtime, on a model exported once and kept in the cache directory
+ONNX = "onnx"
+# ONNX Runtime, on a model exported with its weights converted to int8
+ONNX_QUANTIZED = "onnx-quantized"
+
+READER_BACKENDS = (PYTORCH, QUANTIZED, ONNX, ONNX_QUANTIZED)
+
+ONNX_MODEL_FILE = "onnx_model.onnx"
+
+# Settings of the prediction head that FARMReader sets from its params after loading the model
+PREDICTION_HEAD_SETTINGS = (
+    "context_window_size",
+    "no_ans_boost",
+    "n_best",
+    "n_best_per_sample",
+    "duplicate_filtering",
+    "use_confidence_scores_for_ranking",
+)
+
+
+def onnx_model_path(model_name_or_path: str, cache_dir: str, quantize: bool = False) -> Path:
+    """
+    Returns the directory the ONNX export of a model is kept in.
+    """
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", Path(model_name_or_path).name or model_name_or_path)
+    # The name alone could be the same for a model of the hub and a local one
+    fingerprint = hashlib.sha256(str(model_name_or_path).encode()).hexdigest()[:8]
+    return Path(cache_dir) / f"{name}-{fingerprint}-onnx{'-int8' if quantize else ''}"
+
+
+def export_onnx(model_name_or_path: str, cache_dir: str, quantize: bool = False) -> Path:
+    """
+    Exports a question answering model to ONNX, unless it's exported already, and returns the directory of the
+    export. The export is written to a temporary directory first and then moved in place, so that workers
+    exporting the same model at the same time never load a partial export.
+    """
+    output_path = onnx_model_path(model_name_or_path, cache_dir, quantize=quantize)
+    if (output_path / ONNX_MODEL_FILE).is_file():
+        return output_path
+
+    try:
+        import onnxruntime  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError as e:
+        raise ImportError(
+            "The ONNX reader backends need ONNX Runtime, install it with `pip install farm-haystack[onnx]`."
+        ) from e
+
+    logger.info("Exporting %s to ONNX in %s", model_name_or_path, output_path)
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex}")
+    try:
+        FARMReader.convert_to_onnx(
+            model_name=model_name_or_path, output_path=tmp_path, quantize=quantize, task_type="question_answering"
+        )
+        try:
+            os.replace(tmp_path, output_path)
+        except OSError:
+            # Another worker exported it in the meantime
+            if not (output_path / ONNX_MODEL_FILE).is_file():
+                raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return output_path
+
+
+def quantize_reader(reader: FARMReader):
+    """
+    Converts the weights of the linear layers of a reader to int8 (dynamic quantization). Only runs on CPU.
+    """
+    import torch  # pylint: disable=import-outside-toplevel
+
+    model = reader.inferencer.model
+    if any(parameter.device.type != "cpu" for parameter in model.parameters()):
+        logger.warning("The reader %s runs on GPU, it is not quantized.", reader.name)
+        return
+    reader.inferencer.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_onnx_reader(reader: FARMReader, cache_dir: str, quantize: bool = False):
+    """
+    Replaces the inferencer of a reader by one running its ONNX export, with the same settings. The reader
+    object itself is kept, as other components (like the `DocumentAnalyzer`) can hold it.
+    """
+    params: Dict[str, Any] = reader._component_config["params"]  # pylint: disable=protected-access
+    onnx_path = export_onnx(params["model_name_or_path"], cache_dir, quantize=quantize)
+
+    inferencer = reader.inferencer
+    processor = inferencer.processor
+    head_settings = _head_settings(reader)
+    onnx_inferencer = QAInferencer.load(
+        str(onnx_path),
+        batch_size=inferencer.batch_size,
+        gpu=any(device.type == "cuda" for device in reader.devices),
+        devices=reader.devices,
+        task_type="question_answering",
+        max_seq_len=processor.max_seq_len,
+        doc_stride=processor.doc_stride,
+        max_query_length=processor.max_query_length,
+        num_processes=params.get("num_processes"),
+        disable_tqdm=inferencer.disable_tqdm,
+        strict=False,
+    )
+    onnx_head = onnx_inferencer.model.prediction_heads[0]
+    for setting, value in head_settings.items():
+        setattr(onnx_head, setting, value)
+    reader.inferencer = onnx_inferencer
+
+
+def _head_settings(reader: FARMReader) -> Dict[str, Any]:
+    if reader.inferencer.model is None:
+        # The PyTorch model was released already, see `release_torch_model`
+        return reader.prediction_head_settings
+    head = reader.inferencer.model.prediction_heads[0]
+    return {setting: getattr(head, setting) for setting in PREDICTION_HEAD_SETTINGS if hasattr(head, setting)}
+
+
+def release_torch_model(reader: FARMReader):
+    """
+    Drops the PyTorch model of a reader that will run its ONNX export, keeping the settings of its prediction head
+    for `load_onnx_reader`. The reader can't run until then.
+    """
+    if reader.inferencer.model is None:
+        return
+    reader.prediction_head_settings = _head_settings(reader)
+    reader.inferencer.model = None
+
+
+def _check_backend(backend: str):
+    if backend not in READER_BACKENDS:
+        raise ValueError(f"Unknown reader backend '{backend}', use one of {', '.join(READER_BACKENDS)}.")
+
+
+def _get_readers(pipeline: Pipeline) -> List[FARMReader]:
+    # Including the readers used by the other components, like the `DocumentAnalyzer`, once each
+    readers: Dict[int, FARMReader] = {}
+    for node_name in pipeline.graph.nodes:
+        component = pipeline.get_node(node_name)
+        for reader in (component, getattr(component, "reader", None)):
+            if isinstance(reader, FARMReader):
+                readers[id(reader)] = reader
+    return list(readers.values())
+
+
+def prepare_reader_backend(pipeline: Optional[Pipeline], backend: str, cache_dir: str):
+    """
+    Runs the part of the switch of the `FARMReader`s of a pipeline to another backend that the workers can share,
+    right after loading it (in the gunicorn master when the pipelines are preloaded, before `prepare_for_fork`):
+
+    - `quantized`: the readers are quantized, so the workers share their int8 weights copy-on-write
+    - `onnx` and `onnx-quantized`: the models are exported, if they're not exported already, and the PyTorch weights
+      are released. ONNX Runtime sessions don't survive a fork, so each worker loads its own copy of the export with
+      `set_reader_backend`: unlike the PyTorch weights, it's not shared.
+    """
+    _check_backend(backend)
+    if pipeline is None or backend == PYTORCH:
+        return
+    for reader in _get_readers(pipeline):
+        if backend == QUANTIZED:
+            quantize_reader(reader)
+        else:
+            params = reader._component_config["params"]  # pylint: disable=protected-access
+            export_onnx(params["model_name_or_path"], cache_dir, quantize=backend == ONNX_QUANTIZED)
+            release_torch_model(reader)
+        logger.info("Reader %s uses the %s backend", reader.name, backend)
+
+
+def apply_reader_backend(reader: FARMReader, backend: str, cache_dir: str):
+    """
+    Switches a single reader to another backend, in the process it runs in.
+    """
+    _check_backend(backend)
+    if backend == QUANTIZED:
+        quantize_reader(reader)
+    elif backend in (ONNX, ONNX_QUANTIZED):
+        load_onnx_reader(reader, cache_dir, quantize=backend == ONNX_QUANTIZED)
+
+
+def set_reader_backend(pipeline: Optional[Pipeline], backend: str, cache_dir: str) -> List[str]:
+    """
+    Loads the ONNX exports of the `FARMReader`s of a pipeline prepared by `prepare_reader_backend`, including the
+    ones used by its other components (like the `DocumentAnalyzer`), and returns their names. The other backends
+    are set by `prepare_reader_backend` already.
+
+    Must run in the process serving the requests, after the fork when the pipelines are preloaded.
+    """
+    _check_backend(backend)
+    if pipeline is None or backend not in (ONNX, ONNX_QUANTIZED):
+        return []
+    readers = _get_readers(pipeline)
+    for reader in readers:
+        load_onnx_reader(reader, cache_dir, quantize=backend == ONNX_QUANTIZED)
+    return [reader.name for reader in readers]
@@ -0,0 +1,87 @@
+from typing import Any, Dict, List
+
+import gc
+import logging
+
+from haystack.pipelines.base import Pipeline
+
+
+logger = logging.getLogger(__name__)
+
+# How deep to look for models in the attributes of the components (like `FARMReader.inferencer.model`)
+MODEL_SEARCH_DEPTH = 3
+
+
+def prepare_for_fork(pipelines: Dict[str, Any]):
+    """
+    Prepares the pipelines loaded in the gunicorn master to be shared by the forked workers: the models are
+    made read-only so that their weights stay in the pages shared copy-on-write, the connections opened while
+    loading are closed so that the workers don't share sockets, and the loaded objects are frozen out of
+    the garbage collector, which would otherwise copy their pages into each worker by touching them.
+
+    Nothing must run inference in the master before forking: the thread pools of torch don't survive a fork.
+    """
+    loaded_pipelines: List[Pipeline] = [
+        pipeline for pipeline in (pipelines.get("query_pipeline"), pipelines.get("indexing_pipeline")) if pipeline
+    ]
+
+    models = 0
+    for pipeline in loaded_pipelines:
+        for node_name in pipeline.graph.nodes:
+            component = pipeline.get_node(node_name)
+            for module in _find_torch_modules(component):
+                # Inference only, so no gradient is ever written next to the weights
+                module.eval()
+                module.requires_grad_(False)
+                models += 1
+
+    document_stores = {id(store): store for store in (p.get_document_store() for p in loaded_pipelines) if store}
+    for document_store in document_stores.values():
+        _close_connections(document_store)
+
+    gc.collect()
+    gc.freeze()
+    logger.info(
+        "Prepared %s models for the workers, %s objects frozen out of the garbage collector",
+        models,
+        gc.get_freeze_count(),
+    )
+
+
+def _find_torch_modules(component: Any) -> List[Any]:
+    try:
+        import torch  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return []
+
+    modules: List[Any] = []
+    seen = set()
+
+    def visit(obj: Any, depth: int):
+        if id(obj) in seen or depth > MODEL_SEARCH_DEPTH:
+            return
+        seen.add(id(obj))
+        if isinstance(obj, torch.nn.Module):
+            modules.append(obj)
+            return
+        for value in getattr(obj, "__dict__", {}).values():
+            for item in value if isinstance(value, (list, tuple)) else [value]:
+                if hasattr(item, "__dict__"):
+                    visit(item, depth + 1)
+
+    visit(component, 0)
+    return modules
+
+
+def _close_connections(document_store: Any):
+    # Connections to Elasticsearch / OpenSearch opened while loading (to create the indices), if any. Closing them
+    # keeps them in their pools, they're opened again by each worker on their next use.
+    try:
+        connection_pool = document_store.client.transport.connection_pool
+    except AttributeError:
+        return
+    for connection in getattr(connection_pool, "connections", []):
+        http_pool = getattr(getattr(connection, "pool", None), "pool", None)
+        for http_connection in list(getattr(http_pool, "queue", [])):
+            if http_connection is not None:
+                http_connection.close()
@@ -0,0 +1,81 @@
+from typing import Any, Dict, Optional
+
+import re
+import time
+import logging
+import threading
+
+from haystack.nodes import BaseReader
+from haystack.schema import Document
+
+
+logger = logging.getLogger(__name__)
+
+LOADING = "loading"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+WARM_UP_CONTEXT = "El Banco Pichincha es el banco más grande del país."
+
+
+class WarmUpError(Exception):
+    def __init__(self, component: str, error: Exception):
+        super().__init__(f"Failed warming up {component}: {error}")
+        self.component = component
+
+
+class Readiness:
+    """
+    Whether this worker is loading its pipelines, warming them up, ready to serve the requests, or failed to load
+    (with the error, and the component that raised it if known).
+    """
+
+    def __init__(self):
+        self.status = LOADING
+        self.error: Optional[str] = None
+        self.component: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == READY
+
+    def set(self, status: str, error: Optional[Exception] = None):
+        with self._lock:
+            self.status = status
+            self.error = f"{type(error).__name__}: {error}" if error else None
+            self.component = _failed_component(error) if error else None
+        logger.info("Pipelines %s", status if not error else f"{status}: {self.error}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"status": self.status, "error": self.error, "component": self.component}
+
+
+def _failed_component(error: Exception) -> Optional[str]:
+    if isinstance(error, WarmUpError):
+        return error.component
+    # Haystack reports the components that can't be loaded as "Failed loading pipeline component '<name>': ..."
+    match = re.search(r"component '([^']+)'", str(error))
+    return match.group(1) if match else None
+
+
+def warm_up(pipelines: Dict[str, Any], query: str):
+    """
+    Runs the Readers of the query pipeline once on a small document, so that the first requests don't pay for
+    the lazy initializations of the models (thread pools, CUDA context, tokenizer caches...).
+    """
+    query_pipeline = pipelines.get("query_pipeline")
+    if not query_pipeline:
+        return
+    for reader in query_pipeline.get_nodes_by_class(BaseReader):
+        start_time = time.time()
+        try:
+            reader.predict(query=query, documents=[Document(content=WARM_UP_CONTEXT)], top_k=1)
+        except Exception as e:
+            raise WarmUpError(reader.name, e) from e
+        logger.info(f"Warmed up {reader.name} in {(time.time() - start_time):.2f} seconds")
+
+
+readiness = Readiness()
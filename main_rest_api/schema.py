@@ -26,14 +26,24 @@ class QueryRequest(RequestBaseModel):
     pdf_name: Optional[str] = Field(None, description="PDF name to be used for the query")
     params: Optional[Dict[str, PrimitiveType]] = None
     debug: Optional[bool] = False
+    timeout: Optional[float] = Field(
+        None, gt=0, description="Seconds the client waits for the results: the query is dropped if it can't run within"
+    )
 
 class AdvancedQueryRequest(RequestBaseModel):
     queries: List[QueryRequest]
     debug: Optional[bool] = False
+    timeout: Optional[float] = Field(
+        None, gt=0, description="Seconds the client waits for the results: the queries not run by then are skipped"
+    )
 
 class FilterRequest(RequestBaseModel):
     filters: Optional[Dict[str, Union[PrimitiveType, List[PrimitiveType], Dict[str, PrimitiveType]]]] = None
 
+class PaginatedFilterRequest(FilterRequest):
+    page_size: int = Field(100, gt=0, le=10_000, description="Maximum number of documents to return")
+    cursor: Optional[str] = Field(None, description="`next_cursor` of the previous page, to get the next one")
+
 
 class CreateLabelSerialized(RequestBaseModel):
     id: Optional[str] = None
@@ -56,9 +66,26 @@ class QueryResponse(BaseModel):
     answers: List[Answer] = []
     documents: List[Document] = []
     results: Optional[List[str]] = None
+    timed_out: Optional[bool] = Field(None, description="The query was skipped as the request timed out")
     debug: Optional[Dict] = Field(None, alias="_debug")
 
 class AdvancedQueryResponse(BaseModel):
     queries: List[str]
     results: List[QueryResponse]
     debug: Optional[Dict] = Field(None, alias="_debug")
+
+class AnalysisResult(BaseModel):
+    question: str
+    answers: List[Answer] = []
+
+class AnalyzePdfResponse(BaseModel):
+    document_ids: List[str]
+    results: List[AnalysisResult]
+
+class FileAnalysisResponse(BaseModel):
+    file: str
+    results: List[AnalysisResult]
+
+class DocumentPage(BaseModel):
+    documents: List[Document]
+    next_cursor: Optional[str] = None
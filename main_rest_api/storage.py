@@ -0,0 +1,52 @@
+from typing import Iterator
+
+import sqlite3
+import logging
+from pathlib import Path
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStore:
+    """
+    Base class for the state that must be shared by all the workers of a node and survive their restarts,
+    kept in a local SQLite file.
+
+    Connections are opened for each operation, so the stores can be created before the workers are forked.
+    """
+
+    schema: str = ""
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(self.schema)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # `isolation_level=None` leaves transactions to the callers, see `_transaction`
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Opens a write transaction, taking the database lock right away so that concurrent read-modify-write
+        sequences from other workers are serialized.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
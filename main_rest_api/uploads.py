@@ -0,0 +1,105 @@
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+from pathlib import Path
+
+from main_rest_api.storage import SQLiteStore
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def save_upload(file: BinaryIO, filename: str, directory: str) -> Tuple[Path, str]:
+    """
+    Saves an uploaded file, computing its SHA-256 while it's streamed to disk, and returns its path and hash.
+
+    Files are stored by content, as `{sha256}{extension}`: uploading the same content again, under any name,
+    reuses the stored file instead of writing a new copy. The extension is kept for the converters to be picked
+    by file type, and the names are kept in the `FileRegistry`.
+    """
+    sha256 = hashlib.sha256()
+    tmp_path = Path(directory) / f".{uuid.uuid4().hex}.part"
+    try:
+        with tmp_path.open("wb") as buffer:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                sha256.update(chunk)
+                buffer.write(chunk)
+        file_hash = sha256.hexdigest()
+        file_path = Path(directory) / f"{file_hash}{Path(filename).suffix.lower()}"
+        if file_path.exists():
+            tmp_path.unlink()
+        else:
+            os.replace(tmp_path, file_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return file_path, file_hash
+
+
+def file_sha256(file_path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with Path(file_path).open("rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class FileRegistry(SQLiteStore):
+    """
+    Remembers the documents produced by each indexed file, so that uploading the same file again doesn't
+    convert and index it a second time.
+
+    Files are identified by the hash of their content together with the meta and params used to index them,
+    as the same content indexed with another `pdf_name` (or split differently) yields different documents.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS indexed_files (
+            key TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            file_name TEXT,
+            document_ids TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+    """
+
+    @staticmethod
+    def key(file_hash: str, meta: Dict[str, Any], params: Dict[str, Any]) -> str:
+        fingerprint = hashlib.sha256(json.dumps([meta, params], sort_keys=True, default=str).encode()).hexdigest()
+        return f"{file_hash}:{fingerprint}"
+
+    def get_document_ids(self, key: str) -> Optional[List[str]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT document_ids FROM indexed_files WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["document_ids"]) if row else None
+
+    def add(
+        self,
+        key: str,
+        file_hash: str,
+        file_path: Path,
+        document_ids: List[str],
+        file_name: Optional[str] = None,
+    ):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO indexed_files (key, sha256, file_path, file_name, document_ids, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, file_hash, str(file_path), file_name, json.dumps(document_ids), time.time()),
+            )
+
+    def clear(self):
+        """
+        Forgets all the indexed files. Called when documents are deleted from the DocumentStore, as there's
+        no telling which files they came from.
+        """
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM indexed_files")
@@ -3,12 +3,27 @@ from fastapi.routing import APIRoute
 from fastapi.openapi.utils import get_openapi
 from starlette.middleware.cors import CORSMiddleware
 
+from typing import Any, Callable, Dict, List
+
+import os
+import logging
+import threading
+
 from main_rest_api.pipeline import setup_pipelines
+from main_rest_api.pipeline.reader_backend import set_reader_backend, ONNX, ONNX_QUANTIZED
 from main_rest_api.controller.errors.http_error import http_error_handler
+from main_rest_api.metrics import MetricsMiddleware
+from main_rest_api.readiness import readiness, warm_up, LOADING, WARMING, READY, FAILED
+
 
+logger = logging.getLogger(__name__)
 
 app = None
 pipelines = None
+_pipelines_callbacks: List[Callable[[Dict[str, Any]], None]] = []
+_pipelines_lock = threading.RLock()
+# The process the readers were switched to `READER_BACKEND` in
+_reader_backend_pid = None
 
 
 def get_app() -> FastAPI:
@@ -38,6 +53,8 @@ def get_app() -> FastAPI:
     app.add_middleware(
         CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"]
     )
+    # Counts the requests and measures their latency for `/metrics`
+    app.add_middleware(MetricsMiddleware)
     app.add_exception_handler(HTTPException, http_error_handler)
     app.include_router(router)
 
@@ -53,12 +70,85 @@ def get_app() -> FastAPI:
 
 
 def get_pipelines():
+    """
+    Returns the global pipelines, loading them first if needed.
+    """
+    return _load_pipelines()
+
+
+def _load_pipelines(warm_up_next: bool = False):
     global pipelines  # pylint: disable=global-statement
-    if not pipelines:
-        pipelines = setup_pipelines()
+    with _pipelines_lock:
+        if not pipelines:
+            readiness.set(LOADING)
+            try:
+                pipelines = setup_pipelines()
+                for callback in _pipelines_callbacks:
+                    callback(pipelines)
+            except Exception as e:
+                pipelines = None
+                readiness.set(FAILED, error=e)
+                raise
+            readiness.set(WARMING if warm_up_next else READY)
     return pipelines
 
 
+def on_pipelines_ready(callback: Callable[[Dict[str, Any]], None]) -> Callable[[Dict[str, Any]], None]:
+    """
+    Registers a function binding the pipelines to a controller once they're loaded, as they're loaded after
+    the app is created. The function is called right away if they're loaded already.
+    """
+    with _pipelines_lock:
+        _pipelines_callbacks.append(callback)
+        if pipelines:
+            callback(pipelines)
+    return callback
+
+
+def load_pipelines_in_background(warm_up_query: str = "") -> threading.Thread:
+    """
+    Loads the pipelines if they're not loaded yet (like when they were preloaded before forking the workers),
+    loads the ONNX models of their readers with an ONNX `READER_BACKEND`, then warms them up with `warm_up_query`,
+    in a background thread. `readiness` tells when it's done.
+    """
+    from main_rest_api import config  # pylint: disable=import-outside-toplevel
+
+    switch_backend = config.READER_BACKEND in (ONNX, ONNX_QUANTIZED)
+    if pipelines and (warm_up_query or switch_backend):
+        readiness.set(WARMING)
+
+    def load():
+        try:
+            loaded_pipelines = _load_pipelines(warm_up_next=bool(warm_up_query) or switch_backend)
+            _set_reader_backends(loaded_pipelines)
+            if warm_up_query:
+                warm_up(loaded_pipelines, warm_up_query)
+            readiness.set(READY)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception("Could not load the pipelines")
+            readiness.set(FAILED, error=e)
+
+    thread = threading.Thread(target=load, name="pipelines-loading", daemon=True)
+    thread.start()
+    return thread
+
+
+def _set_reader_backends(loaded_pipelines: Dict[str, Any]):
+    """
+    Loads the ONNX models of the readers with an ONNX `READER_BACKEND`, once in each process. This can't be done
+    while loading the pipelines, as they may be loaded in the gunicorn master: the models are only exported there.
+    """
+    global _reader_backend_pid  # pylint: disable=global-statement
+    from main_rest_api import config  # pylint: disable=import-outside-toplevel
+
+    with _pipelines_lock:
+        if _reader_backend_pid == os.getpid():
+            return
+        for pipeline_name in ("query_pipeline", "indexing_pipeline"):
+            set_reader_backend(loaded_pipelines.get(pipeline_name), config.READER_BACKEND, config.READER_CACHE_PATH)
+        _reader_backend_pid = os.getpid()
+
+
 def get_openapi_specs() -> dict:
     """
     Used to autogenerate OpenAPI specs file to use in the documentation.
@@ -0,0 +1,137 @@
+"""
+Components standing in for the Retriever and the Reader in the serving benchmark: they return the same results
+for the same query and take a fixed time, so that the benchmark measures the API rather than the models.
+
+Their latency is set in `serving.haystack-pipeline.yml`, or with the `RETRIEVER_PARAMS_LATENCY_MS` and
+`READER_PARAMS_LATENCY_MS` environment variables.
+"""
+from typing import Dict, List, Optional, Union
+
+import time
+import zlib
+
+from haystack.nodes import BaseReader, BaseRetriever
+from haystack.schema import Answer, Document, FilterType, Span
+
+
+DOCUMENTS = [
+    Document(
+        content="Banco del Pichincha C.A. certifica que el cliente mantiene una cuenta de ahorros activa desde el año "
+        "2015, con un saldo promedio de tres cifras durante los últimos seis meses.",
+        id="benchmark-1",
+        meta={"pdf_name": "certificado.pdf"},
+    ),
+    Document(
+        content="El presente documento se emite a petición del interesado para los fines que estime convenientes.",
+        id="benchmark-2",
+        meta={"pdf_name": "certificado.pdf"},
+    ),
+    Document(
+        content="Atentamente, María Fernanda López, Jefa de Servicio al Cliente, Agencia Matriz, Quito.",
+        id="benchmark-3",
+        meta={"pdf_name": "certificado.pdf"},
+    ),
+]
+
+
+def _sleep(latency_ms: float):
+    if latency_ms > 0:
+        time.sleep(latency_ms / 1000)
+
+
+class LatencyRetriever(BaseRetriever):
+    """
+    Returns the `top_k` benchmark documents, in an order depending on the query only.
+    """
+
+    outgoing_edges = 1
+
+    def __init__(self, latency_ms: float = 5.0, top_k: int = 3):
+        super().__init__()
+        self.latency_ms = latency_ms
+        self.top_k = top_k
+
+    def retrieve(  # type: ignore
+        self,
+        query: str,
+        filters: Optional[FilterType] = None,
+        top_k: Optional[int] = None,
+        index: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        scale_score: Optional[bool] = None,
+        document_store=None,
+    ) -> List[Document]:
+        _sleep(self.latency_ms)
+        return self._documents(query, top_k or self.top_k)
+
+    def retrieve_batch(  # type: ignore
+        self,
+        queries: List[str],
+        filters: Optional[Union[FilterType, List[Optional[FilterType]]]] = None,
+        top_k: Optional[int] = None,
+        index: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        batch_size: Optional[int] = None,
+        scale_score: Optional[bool] = None,
+        document_store=None,
+    ) -> List[List[Document]]:
+        # Like a real DocumentStore, a batch is one round trip
+        _sleep(self.latency_ms)
+        return [self._documents(query, top_k or self.top_k) for query in queries]
+
+    @staticmethod
+    def _documents(query: str, top_k: int) -> List[Document]:
+        # zlib rather than hash(), which changes with each process
+        first = zlib.crc32(query.encode()) % len(DOCUMENTS)
+        return [DOCUMENTS[(first + offset) % len(DOCUMENTS)] for offset in range(min(top_k, len(DOCUMENTS)))]
+
+
+class LatencyReader(BaseReader):
+    """
+    Answers with the first words of the first document, taking `latency_ms` for each call (a batch counts as a
+    call, as it does on a GPU).
+    """
+
+    outgoing_edges = 1
+
+    def __init__(self, latency_ms: float = 50.0, answer_words: int = 4):
+        super().__init__()
+        self.latency_ms = latency_ms
+        self.answer_words = answer_words
+
+    def _answer(self, documents: List[Document]) -> List[Answer]:
+        if not documents:
+            return []
+        document = documents[0]
+        answer = " ".join(document.content.split()[: self.answer_words])
+        return [
+            Answer(
+                answer=answer,
+                type="extractive",
+                score=1.0,
+                context=document.content,
+                offsets_in_context=[Span(start=0, end=len(answer))],
+                offsets_in_document=[Span(start=0, end=len(answer))],
+                document_ids=[document.id],
+                meta=document.meta,
+            )
+        ]
+
+    def predict(self, query: str, documents: List[Document], top_k: Optional[int] = None):
+        _sleep(self.latency_ms)
+        return {"query": query, "no_ans_gap": None, "answers": self._answer(documents)}
+
+    def predict_batch(
+        self,
+        queries: List[str],
+        documents: Union[List[Document], List[List[Document]]],
+        top_k: Optional[int] = None,
+        batch_size: Optional[int] = None,
+    ):
+        _sleep(self.latency_ms)
+        documents_per_query = documents if documents and isinstance(documents[0], list) else [documents] * len(queries)
+        return {
+            "queries": queries,
+            "answers": [self._answer(query_documents) for query_documents in documents_per_query],  # type: ignore
+            "no_ans_gaps": [None] * len(queries),
+        }
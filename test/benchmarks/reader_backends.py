@@ -0,0 +1,136 @@
+"""
+Compares the inference backends of the reader with the PyTorch one: latency of `FARMReader.predict` and how often
+they return the same answer.
+
+    python -m test.benchmarks.reader_backends --model deepset/tinyroberta-squad2 --runs 20
+
+Run it with the model of the query pipeline (`--model mrm8488/bert-base-spanish-wwm-cased-finetuned-spa-squad2-es`)
+before changing `READER_BACKEND` in a deployment.
+"""
+from typing import Dict, List, Optional
+
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from collections import Counter
+
+from haystack.nodes import FARMReader
+from haystack.schema import Document
+
+from main_rest_api.pipeline.reader_backend import READER_BACKENDS, PYTORCH, apply_reader_backend
+
+
+SAMPLES = [
+    (
+        "¿Cuál es el nombre del banco?",
+        [
+            "Banco del Pichincha C.A. certifica que el cliente mantiene una cuenta de ahorros activa desde el año "
+            "2015, con un saldo promedio de tres cifras durante los últimos seis meses.",
+            "El presente documento se emite a petición del interesado para los fines que estime convenientes.",
+        ],
+    ),
+    (
+        "¿Desde qué año está activa la cuenta?",
+        [
+            "Banco del Pichincha C.A. certifica que el cliente mantiene una cuenta de ahorros activa desde el año "
+            "2015, con un saldo promedio de tres cifras durante los últimos seis meses."
+        ],
+    ),
+    (
+        "¿Quién firma el certificado?",
+        [
+            "Atentamente, María Fernanda López, Jefa de Servicio al Cliente, Agencia Matriz, Quito.",
+            "Este certificado no implica responsabilidad alguna para la institución ni para sus funcionarios.",
+        ],
+    ),
+    (
+        "What is the capital of Ecuador?",
+        ["Quito is the capital of Ecuador, and Guayaquil is its largest city.", "Ecuador uses the US dollar."],
+    ),
+]
+
+
+def _tokens(text: str) -> List[str]:
+    return text.lower().split()
+
+
+def answer_f1(prediction: str, reference: str) -> float:
+    """
+    Token overlap between two answers, as in the SQuAD evaluation.
+    """
+    prediction_tokens, reference_tokens = _tokens(prediction), _tokens(reference)
+    if not prediction_tokens or not reference_tokens:
+        return float(prediction_tokens == reference_tokens)
+    common = sum((Counter(prediction_tokens) & Counter(reference_tokens)).values())
+    if common == 0:
+        return 0.0
+    precision, recall = common / len(prediction_tokens), common / len(reference_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+
+def _top_answer(reader: FARMReader, query: str, documents: List[Document]) -> str:
+    answers = reader.predict(query=query, documents=documents, top_k=1)["answers"]
+    return answers[0].answer if answers else ""
+
+
+def benchmark(reader: FARMReader, runs: int) -> Dict[str, object]:
+    samples = [(query, [Document(content=text) for text in texts]) for query, texts in SAMPLES]
+    # The first predictions are slower (allocations, lazy initializations), they're not measured
+    answers = [_top_answer(reader, query, documents) for query, documents in samples]
+
+    latencies = []
+    for _ in range(runs):
+        for query, documents in samples:
+            start_time = time.perf_counter()
+            reader.predict(query=query, documents=documents, top_k=1)
+            latencies.append(time.perf_counter() - start_time)
+    latencies.sort()
+    return {
+        "answers": answers,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+    }
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="deepset/tinyroberta-squad2", help="Model name or local path")
+    parser.add_argument("--backends", nargs="+", default=list(READER_BACKENDS), choices=READER_BACKENDS)
+    parser.add_argument("--runs", type=int, default=10, help="Predictions of each sample measured")
+    parser.add_argument("--cache-dir", help="Where the ONNX exports are kept, a temporary directory by default")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    options = parser.parse_args(args)
+
+    results: Dict[str, Dict[str, object]] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_dir = options.cache_dir or tmp_dir
+        backends = [PYTORCH] + [backend for backend in options.backends if backend != PYTORCH]
+        for backend in backends:
+            reader = FARMReader(model_name_or_path=options.model, use_gpu=False, progress_bar=False)
+            apply_reader_backend(reader, backend, cache_dir)
+            results[backend] = benchmark(reader, options.runs)
+
+    reference_answers = results[PYTORCH]["answers"]
+    for result in results.values():
+        answers = result.pop("answers")
+        pairs = list(zip(answers, reference_answers))  # type: ignore
+        result["exact_agreement"] = sum(answer == reference for answer, reference in pairs) / len(pairs)
+        result["f1_agreement"] = sum(answer_f1(answer, reference) for answer, reference in pairs) / len(pairs)
+        result["speedup"] = results[PYTORCH]["mean_ms"] / result["mean_ms"]  # type: ignore
+
+    if options.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'backend':<16}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'speedup':>10}{'exact':>8}{'f1':>8}")
+    for backend, result in results.items():
+        print(
+            f"{backend:<16}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['mean_ms']:>10.1f}"
+            f"{result['speedup']:>9.2f}x{result['exact_agreement']:>8.2f}{result['f1_agreement']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
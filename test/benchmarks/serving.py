@@ -0,0 +1,316 @@
+"""
+Measures the throughput, the latency and the rejections (503) of `/query`, `/advanced_query` and `/file-upload`
+under concurrent requests, and compares them with a baseline.
+
+    python -m test.benchmarks.serving --concurrency 16 --requests 200
+    python -m test.benchmarks.serving --save-baseline  # on the reference machine, once
+    python -m test.benchmarks.serving --check  # exits with 1 if the results regressed
+
+The app runs in this process, with the pipelines of `serving.haystack-pipeline.yml`: the Retriever and the Reader
+are deterministic stand-ins taking `--retriever-latency-ms` and `--reader-latency-ms`, or `--reader tiny` uses a
+small real model. It's called through ASGI (`--modes in-process`, the cost of the app alone) and over HTTP through a
+local uvicorn server (`--modes server`). The server settings (`CONCURRENT_REQUEST_PER_WORKER`, `REQUEST_QUEUE_SIZE`,
+`QUERY_BATCH_SIZE`...) are read from the environment, as in a deployment.
+
+Each request has its own query, so that the results measure the pipelines rather than the query cache.
+"""
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import socket
+import asyncio
+import argparse
+import tempfile
+import itertools
+import threading
+import statistics
+from pathlib import Path
+from contextlib import contextmanager
+
+import httpx
+
+
+PIPELINE_YAML_PATH = Path(__file__).parent / "serving.haystack-pipeline.yml"
+BASELINE_PATH = Path(__file__).parent / "serving_baseline.json"
+
+IN_PROCESS = "in-process"
+SERVER = "server"
+MODES = (IN_PROCESS, SERVER)
+
+QUERIES = [
+    "¿Cuál es el nombre del banco?",
+    "¿Desde qué año está activa la cuenta?",
+    "¿Quién firma el certificado?",
+    "¿Cuál es el saldo promedio de la cuenta?",
+]
+ADVANCED_QUERY_SIZE = 4
+
+# Settings that change the results: a baseline is only compared with results measured with the same ones
+SETTINGS = ("reader", "reader_latency_ms", "retriever_latency_ms", "concurrency", "requests")
+
+Sample = Tuple[int, float]
+
+
+def _query(tag: str, position: int = 0) -> Dict[str, Any]:
+    query = QUERIES[zlib.crc32(f"{tag}-{position}".encode()) % len(QUERIES)]
+    return {"query": f"{query} {tag}-{position}", "pdf_name": "certificado.pdf"}
+
+
+async def _post_query(client: httpx.AsyncClient, tag: str) -> httpx.Response:
+    return await client.post("/query", json=_query(tag))
+
+
+async def _post_advanced_query(client: httpx.AsyncClient, tag: str) -> httpx.Response:
+    return await client.post(
+        "/advanced_query", json={"queries": [_query(tag, position) for position in range(ADVANCED_QUERY_SIZE)]}
+    )
+
+
+async def _post_file_upload(client: httpx.AsyncClient, tag: str) -> httpx.Response:
+    # Files already indexed are skipped by the API, each request sends a new one
+    content = f"Certificado {tag}. " + " ".join(_query(tag, position)["query"] for position in range(50))
+    return await client.post(
+        "/file-upload", files={"files": (f"benchmark-{tag}.txt", content.encode(), "text/plain")}
+    )
+
+
+ENDPOINTS: Dict[str, Callable[[httpx.AsyncClient, str], Awaitable[httpx.Response]]] = {
+    "query": _post_query,
+    "advanced_query": _post_advanced_query,
+    "file_upload": _post_file_upload,
+}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Returns the value below which `fraction` of the sorted `values` are.
+    """
+    return values[int(fraction * (len(values) - 1))]
+
+
+def summarize(samples: List[Sample], duration: float) -> Dict[str, Any]:
+    """
+    Sums up the (status code, latency in seconds) of the requests sent to an endpoint in `duration` seconds. The
+    latencies are the ones of the successful requests: rejected requests return right away.
+    """
+    latencies = sorted(latency * 1000 for status, latency in samples if 200 <= status < 300)
+    rejected = sum(1 for status, _ in samples if status == 503)
+    failed = len(samples) - len(latencies) - rejected
+    return {
+        "requests": len(samples),
+        "throughput_rps": len(latencies) / duration if duration > 0 else 0.0,
+        "p50_ms": percentile(latencies, 0.5) if latencies else None,
+        "p95_ms": percentile(latencies, 0.95) if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) if latencies else None,
+        "mean_ms": statistics.mean(latencies) if latencies else None,
+        "rejection_rate": rejected / len(samples) if samples else 0.0,
+        "error_rate": failed / len(samples) if samples else 0.0,
+    }
+
+
+async def run_endpoint(
+    client: httpx.AsyncClient, endpoint: str, requests: int, concurrency: int, warm_up: int = 2
+) -> Dict[str, Any]:
+    """
+    Sends `requests` requests to an endpoint, `concurrency` at a time: each client sends its next request as
+    soon as it gets the response to the previous one.
+    """
+    send = ENDPOINTS[endpoint]
+    run_id = uuid.uuid4().hex[:8]
+    # The first requests are slower (lazy initializations, connections), they're not measured
+    for number in range(warm_up):
+        await send(client, f"{run_id}-warm-up-{number}")
+
+    numbers = itertools.count()
+    samples: List[Sample] = []
+
+    async def send_requests():
+        for number in numbers:
+            if number >= requests:
+                return
+            start_time = time.perf_counter()
+            try:
+                status = (await send(client, f"{run_id}-{number}")).status_code
+            except httpx.HTTPError:
+                status = 0
+            samples.append((status, time.perf_counter() - start_time))
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(send_requests() for _ in range(concurrency)))
+    return summarize(samples, time.perf_counter() - start_time)
+
+
+async def run_endpoints(base_url: str, options: argparse.Namespace, app=None) -> Dict[str, Dict[str, Any]]:
+    # `app` sends the requests to the ASGI app directly, without going through the network
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False) if app is not None else None
+    limits = httpx.Limits(max_connections=options.concurrency, max_keepalive_connections=options.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, transport=transport, limits=limits, timeout=120) as client:
+        return {
+            endpoint: await run_endpoint(client, endpoint, options.requests, options.concurrency)
+            for endpoint in options.endpoints
+        }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def local_server(app) -> Iterator[str]:
+    """
+    Serves the app with uvicorn in a thread of this process, and returns its URL.
+    """
+    import uvicorn  # pylint: disable=import-outside-toplevel
+
+    port = _free_port()
+    # The pipelines are loaded already, before the first mode runs
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, name="benchmark-server", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The benchmark server did not start.")
+        time.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def configure(options: argparse.Namespace, file_upload_path: str):
+    """
+    Sets the environment read by the app, before it's imported.
+    """
+    os.environ["PIPELINE_YAML_PATH"] = str(PIPELINE_YAML_PATH)
+    os.environ["QUERY_PIPELINE_NAME"] = "query-tiny" if options.reader == "tiny" else "query"
+    os.environ["INDEXING_PIPELINE_NAME"] = "indexing"
+    os.environ["FILE_UPLOAD_PATH"] = file_upload_path
+    os.environ["STATE_DB_PATH"] = str(Path(file_upload_path) / "state.sqlite3")
+    os.environ["WARM_UP_PIPELINES"] = "false"
+    # Component params can be overwritten with `<COMPONENT NAME>_PARAMS_<PARAM NAME>` variables
+    os.environ["RETRIEVER_PARAMS_LATENCY_MS"] = str(options.retriever_latency_ms)
+    os.environ["READER_PARAMS_LATENCY_MS"] = str(options.reader_latency_ms)
+
+
+def run(options: argparse.Namespace) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    # Imported once the environment is set, as the settings are read on import. The components of the benchmark
+    # are registered when they're imported.
+    from test.benchmarks import components  # pylint: disable=import-outside-toplevel,unused-import
+    from main_rest_api.utils import get_app, get_pipelines  # pylint: disable=import-outside-toplevel
+
+    app = get_app()
+    get_pipelines()
+
+    results = {}
+    if IN_PROCESS in options.modes:
+        results[IN_PROCESS] = asyncio.run(run_endpoints("http://benchmark", options, app=app))
+    if SERVER in options.modes:
+        with local_server(app) as base_url:
+            results[SERVER] = asyncio.run(run_endpoints(base_url, options))
+    return results
+
+
+def compare_to_baseline(
+    results: Dict[str, Dict[str, Dict[str, Any]]],
+    baseline: Dict[str, Dict[str, Dict[str, Any]]],
+    tolerance: float = 0.2,
+    rate_tolerance: float = 0.02,
+) -> List[str]:
+    """
+    Returns the regressions of the results compared to the baseline: throughput lower or latencies higher by
+    more than `tolerance` (relative), rejection or error rates higher by more than `rate_tolerance` (absolute).
+    Endpoints missing from the baseline are not compared.
+    """
+    regressions = []
+    for mode, endpoints in results.items():
+        for endpoint, result in endpoints.items():
+            reference = baseline.get(mode, {}).get(endpoint)
+            if not reference:
+                continue
+            name = f"{mode} {endpoint}"
+            if result["throughput_rps"] < reference["throughput_rps"] * (1 - tolerance):
+                regressions.append(
+                    f"{name}: {result['throughput_rps']:.1f} requests/s, "
+                    f"{reference['throughput_rps']:.1f} in the baseline"
+                )
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                if reference[key] is None:
+                    continue
+                if result[key] is None or result[key] > reference[key] * (1 + tolerance):
+                    value = "no successful request" if result[key] is None else f"{result[key]:.1f} ms"
+                    regressions.append(f"{name}: {key[:-3]} {value}, {reference[key]:.1f} ms in the baseline")
+            for key in ("rejection_rate", "error_rate"):
+                if result[key] > reference[key] + rate_tolerance:
+                    regressions.append(f"{name}: {key} {result[key]:.1%}, {reference[key]:.1%} in the baseline")
+    return regressions
+
+
+def _print_results(results: Dict[str, Dict[str, Dict[str, Any]]]):
+    def milliseconds(value: Optional[float]) -> str:
+        return f"{value:>10.1f}" if value is not None else f"{'-':>10}"
+
+    print(f"{'mode':<12}{'endpoint':<16}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'503':>8}{'errors':>8}")
+    for mode, endpoints in results.items():
+        for endpoint, result in endpoints.items():
+            print(
+                f"{mode:<12}{endpoint:<16}{result['throughput_rps']:>10.1f}{milliseconds(result['p50_ms'])}"
+                f"{milliseconds(result['p95_ms'])}{milliseconds(result['p99_ms'])}"
+                f"{result['rejection_rate']:>8.1%}{result['error_rate']:>8.1%}"
+            )
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=list(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests sent at the same time")
+    parser.add_argument("--requests", type=int, default=100, help="Requests measured for each endpoint")
+    parser.add_argument("--reader", default="mock", choices=["mock", "tiny"], help="Stand-in or small real model")
+    parser.add_argument("--reader-latency-ms", type=float, default=50.0)
+    parser.add_argument("--retriever-latency-ms", type=float, default=5.0)
+    parser.add_argument("--baseline", default=str(BASELINE_PATH), help="Baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the baseline")
+    parser.add_argument("--check", action="store_true", help="Exit with 1 if the results regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative regression allowed")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    options = parser.parse_args(args)
+
+    settings = {setting: getattr(options, setting) for setting in SETTINGS}
+    baseline = None
+    if options.check:
+        if not Path(options.baseline).is_file():
+            parser.error(f"There is no baseline in {options.baseline}, save one with --save-baseline.")
+        baseline = json.loads(Path(options.baseline).read_text())
+        if baseline["settings"] != settings:
+            parser.error(f"The baseline was measured with other settings: {baseline['settings']}")
+
+    with tempfile.TemporaryDirectory() as file_upload_path:
+        configure(options, file_upload_path)
+        results = run(options)
+
+    if options.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_results(results)
+
+    if options.save_baseline:
+        Path(options.baseline).write_text(json.dumps({"settings": settings, "results": results}, indent=2) + "\n")
+        print(f"Baseline saved to {options.baseline}")
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline["results"], tolerance=options.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,26 +3,59 @@
 from typing import Dict, List, Optional, Union, Generator
 
 import os
+import gc
+import gzip
+import json
+import time
+import asyncio
+import threading
 from pathlib import Path
 from textwrap import dedent
+from contextlib import ExitStack
 from unittest import mock
 from unittest.mock import MagicMock, Mock
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 import posthog
 from haystack import Document, Answer, Pipeline, TableCell
 import haystack
-from haystack.nodes import BaseReader, BaseRetriever
+from haystack.nodes import BaseReader, BaseRetriever, FARMReader
+from haystack.nodes.base import BaseComponent
 from haystack.document_stores import BaseDocumentStore
 from haystack.errors import PipelineSchemaError
-from haystack.schema import Label, FilterType
+from haystack.schema import Label, FilterType, Span
 from haystack.nodes.file_converter import BaseConverter
 
+from main_rest_api import config
+from main_rest_api.controller import document as document_controller
+from main_rest_api.controller import feedback as feedback_controller
+from main_rest_api.controller import file_upload as file_upload_controller
 from main_rest_api.pipeline import _load_pipeline
-from main_rest_api.utils import get_app
+from main_rest_api.controller.batching import QueryBatcher, run_query_batch
+from main_rest_api.controller.utils import RequestLimiter, AdaptiveRequestLimiter, DeadlineExceeded
+from main_rest_api.controller.label_writer import LabelWriter
+from main_rest_api.controller.cache import QueryCache, QueryCoalescer
+from main_rest_api.controller.normalization import normalize_query
+from main_rest_api.pipeline.custom_component import (
+    DocumentAnalyzer,
+    PassageSelector,
+    PassageOffsetMapper,
+    PdfShardedBM25Retriever,
+)
+from main_rest_api.pipeline.reader_backend import set_reader_backend, prepare_reader_backend, load_onnx_reader
+from main_rest_api.pipeline.mmap_store import MmapDocumentStore, _Segment
+from main_rest_api.preload import prepare_for_fork
+from main_rest_api.pipeline.parallel import ParallelIndexer, _count_pages
+from main_rest_api.uploads import FileRegistry, file_sha256
+from main_rest_api.jobs import JobStore
+from main_rest_api.feedback_metrics import FeedbackMetrics
+from main_rest_api.readiness import readiness, WarmUpError, LOADING, READY
+from main_rest_api.utils import get_app, get_pipelines, load_pipelines_in_background
 
 # Disable telemetry reports when running tests
 posthog.disabled = True
@@ -64,6 +97,104 @@ def test_bad_yaml_pipeline_configuration_error():
     assert "MyOwnDocumentStore" in str(excinfo.value)
 
 
+def test_request_limiter_queues_then_rejects():
+    limiter = RequestLimiter(1, queue_size=1, max_wait=0.05)
+
+    async def hold(seconds):
+        async with limiter.run_async():
+            await asyncio.sleep(seconds)
+
+    async def run_all():
+        return await asyncio.gather(hold(0.02), hold(0.01), hold(0.01), return_exceptions=True)
+
+    results = asyncio.run(run_all())
+    # The second request waits for the first one to finish, the third one finds the queue full
+    assert results[:2] == [None, None]
+    assert isinstance(results[2], HTTPException) and results[2].status_code == 503
+    assert limiter.rejected == 1
+    assert limiter.in_flight == 0
+
+    with limiter.run():
+        # The slot is taken and nobody releases it before the end of the wait
+        with pytest.raises(HTTPException):
+            with limiter.run():
+                pass
+    assert limiter.rejected == 2
+    assert limiter.in_flight == 0
+
+
+def test_adaptive_request_limiter():
+    limiter = AdaptiveRequestLimiter(2, min_limit=1, max_limit=3, window=2)
+    with limiter.run(), limiter.run():
+        with pytest.raises(HTTPException):
+            with limiter.run():
+                pass
+    # Requests were rejected while the latency stayed the same: the limit is raised
+    assert limiter.limit == 3
+    # Then the latency goes up: the limit is lowered, down to its minimum
+    for _ in range(6):
+        limiter.observe(0.5)
+    assert limiter.limit == 1
+    stats = limiter.stats()
+    assert (stats["increases"], stats["decreases"]) == (1, 2)
+    assert [(change["previous_limit"], change["limit"]) for change in stats["history"]] == [(2, 3), (3, 2), (2, 1)]
+
+    limiter = AdaptiveRequestLimiter(1, queue_size=1, max_wait=1, max_limit=2, window=1)
+    with limiter.run():
+        waiter = limiter._try_acquire()  # pylint: disable=protected-access
+        # The new slot goes to the waiting request
+        limiter.observe(0.01)
+        assert waiter.done() and limiter.in_flight == 2
+        limiter.observe(1.0)
+    assert limiter.limit == 1
+    # The slot released above the new limit is not handed over
+    assert limiter.in_flight == 1
+    limiter.release()
+    assert limiter.in_flight == 0
+
+
+def test_adaptive_request_limiter_ignores_expired_requests():
+    limiter = AdaptiveRequestLimiter(2, window=2)
+    for i in range(12):
+        if i % 4:
+            with pytest.raises(DeadlineExceeded):
+                with limiter.run():
+                    raise DeadlineExceeded()
+        else:
+            with limiter.run():
+                time.sleep(0.02)
+    # Only the requests that ran are observed: the expired ones don't lower the latency of the pipeline
+    assert limiter.min_latency >= 0.02
+    assert (limiter.limit, limiter.decreases, limiter.in_flight) == (2, 0, 0)
+
+
+def test_serving_benchmark_detects_regressions():
+    from test.benchmarks.serving import summarize, compare_to_baseline
+
+    samples = [(200, latency / 1000) for latency in range(1, 101)] + [(503, 0.001)] * 10 + [(500, 0.001)] * 10
+    result = summarize(samples, duration=2.0)
+    assert result["requests"] == 120
+    assert result["throughput_rps"] == 50
+    assert (result["p50_ms"], result["p95_ms"], result["p99_ms"]) == pytest.approx((50, 95, 99))
+    assert result["rejection_rate"] == result["error_rate"] == pytest.approx(1 / 12)
+
+    baseline = {"server": {"query": result}}
+    assert compare_to_baseline({"server": {"query": result}}, baseline) == []
+    # Endpoints missing from the baseline are not compared
+    assert compare_to_baseline({"in-process": {"query": summarize([(503, 0.001)], 1.0)}}, baseline) == []
+
+    # Twice slower, and rejecting more requests
+    slower = summarize([(status, 2 * latency) for status, latency in samples] + [(503, 0.001)] * 20, duration=4.0)
+    regressions = compare_to_baseline({"server": {"query": slower}}, baseline)
+    assert regressions[0] == "server query: 25.0 requests/s, 50.0 in the baseline"
+    assert [regression.split(": ")[1].split()[0] for regression in regressions[1:]] == [
+        "p50",
+        "p95",
+        "p99",
+        "rejection_rate",
+    ]
+
+
 class MockReader(BaseReader):
     outgoing_edges = 1
 
@@ -166,7 +297,8 @@ class MockDocumentStore(BaseDocumentStore):
         ]
 
     def get_all_documents_generator(self, *args, **kwargs) -> Generator[Document, None, None]:
-        pass
+        self.mocker.get_all_documents_generator(*args, **kwargs)
+        yield from MockDocumentStore.get_all_documents(self)
 
     def get_all_labels(self, *args, **kwargs) -> List[Label]:
         return self.mocker.get_all_labels(*args, **kwargs)
@@ -205,6 +337,84 @@ class MockDocumentStore(BaseDocumentStore):
         pass
 
 
+def _parallel_indexer(pages_per_task: int = 50) -> ParallelIndexer:
+    pipeline = Pipeline()
+    pipeline.add_node(component=MockPDFToTextConverter(), name="Converter", inputs=["File"])
+    pipeline.add_node(component=MockDocumentStore(), name="DocumentStore", inputs=["Converter"])
+    return ParallelIndexer(pipeline, "unused.yml", "indexing", processes=2, pages_per_task=pages_per_task)
+
+
+def test_parallel_indexer_splits_large_pdfs(tmp_path):
+    indexer = _parallel_indexer(pages_per_task=50)
+    assert indexer.conversion_nodes == {"Converter"}
+    assert set(indexer.tail_pipeline.graph.nodes) - {"File"} == {"DocumentStore"}
+
+    with mock.patch("main_rest_api.pipeline.parallel.PDFToTextConverter", MockPDFToTextConverter):
+        with mock.patch("main_rest_api.pipeline.parallel._count_pages", return_value=120):
+            assert indexer._page_ranges(Path("large.pdf")) == [(1, 50), (51, 100), (101, 120)]
+            # Other files are converted as a whole
+            assert indexer._page_ranges(Path("large.txt")) == [None]
+        for page_count in (50, None):
+            with mock.patch("main_rest_api.pipeline.parallel._count_pages", return_value=page_count):
+                assert indexer._page_ranges(Path("small.pdf")) == [None]
+    # Without a PDFToTextConverter, the converter gets the whole file
+    with mock.patch("main_rest_api.pipeline.parallel._count_pages", return_value=120):
+        assert indexer._page_ranges(Path("large.pdf")) == [None]
+
+
+def test_count_pages(tmp_path):
+    fitz = pytest.importorskip("fitz")
+    pdf = fitz.open()
+    for _ in range(3):
+        pdf.new_page()
+    pdf.save(str(tmp_path / "three_pages.pdf"))
+    assert _count_pages(tmp_path / "three_pages.pdf") == 3
+
+    (tmp_path / "broken.pdf").write_bytes(b"not a pdf")
+    assert _count_pages(tmp_path / "broken.pdf") is None
+
+
+def test_parallel_indexer_keeps_files_in_order():
+    indexer = _parallel_indexer(pages_per_task=10)
+    calls = []
+
+    def convert(file_path, meta, params, page_range):
+        calls.append((file_path, params))
+        # The first tasks finish last
+        time.sleep(0.05 if page_range in (None, (1, 10)) else 0.0)
+        return [Document(content=f"{Path(file_path).name} {page_range}", meta=meta)], {"Converter": 0.01}
+
+    def run_tail(documents, params):
+        calls.append(("tail", params))
+        return {"documents": documents}
+
+    page_counts = {"a.pdf": 25, "b.pdf": 5}
+    patches = [
+        # A pool of threads stands in for the pool of processes
+        mock.patch("main_rest_api.pipeline.parallel._convert", convert),
+        mock.patch("main_rest_api.pipeline.parallel._count_pages", side_effect=lambda path: page_counts[path.name]),
+        mock.patch("main_rest_api.pipeline.parallel.PDFToTextConverter", MockPDFToTextConverter),
+        mock.patch.object(indexer.tail_pipeline, "run", side_effect=run_tail),
+    ]
+    params = {"Converter": {"remove_numeric_tables": True}, "DocumentStore": {"index": "test"}, "debug": True}
+    with ThreadPoolExecutor(4) as executor, ExitStack() as stack:
+        for patch in patches:
+            stack.enter_context(patch)
+        indexer._executor, indexer._pid = executor, os.getpid()
+        documents = indexer.run([Path("a.pdf"), Path("b.pdf")], [{"name": "a.pdf"}, {"name": "b.pdf"}], params=params)
+
+    assert [[document.content for document in file_documents] for file_documents in documents] == [
+        ["a.pdf (1, 10)", "a.pdf (11, 20)", "a.pdf (21, 25)"],
+        ["b.pdf None"],
+    ]
+    # Node params only go to the pipeline holding the node, global params to both
+    conversion_params = {"Converter": {"remove_numeric_tables": True}, "debug": True}
+    assert [call_params for name, call_params in calls if name != "tail"] == [conversion_params] * 4
+    assert [call_params for name, call_params in calls if name == "tail"] == [
+        {"DocumentStore": {"index": "test"}, "debug": True}
+    ]
+
+
 @pytest.fixture(scope="function")
 def feedback():
     """
@@ -240,7 +450,7 @@ def feedback():
 
 
 @pytest.fixture
-def client():
+def client(tmp_path, monkeypatch):
     yaml_pipeline_path = Path(__file__).parent.resolve() / "samples" / "test.haystack-pipeline.yml"
     os.environ["PIPELINE_YAML_PATH"] = str(yaml_pipeline_path)
     os.environ["INDEXING_PIPELINE_NAME"] = "test-indexing"
@@ -251,10 +461,56 @@ def client():
 
     MockDocumentStore.mocker.reset_mock()
     MockPDFToTextConverter.mocker.reset_mock()
+    get_pipelines()["query_cache"].clear()
+
+    # The pipelines are loaded once for all the tests, but each test gets its own uploaded files and state
+    file_upload_path = tmp_path / "file-upload"
+    file_upload_path.mkdir()
+    state_db_path = str(tmp_path / "state.sqlite3")
+    monkeypatch.setattr(config, "FILE_UPLOAD_PATH", str(file_upload_path))
+    monkeypatch.setattr(config, "STATE_DB_PATH", state_db_path)
+    monkeypatch.setattr(file_upload_controller, "FILE_UPLOAD_PATH", str(file_upload_path))
+    file_registry = FileRegistry(state_db_path)
+    monkeypatch.setattr(file_upload_controller, "file_registry", file_registry)
+    monkeypatch.setattr(document_controller, "file_registry", file_registry)
+    monkeypatch.setattr(feedback_controller, "feedback_metrics", FeedbackMetrics(state_db_path))
+    monkeypatch.setattr(get_pipelines()["indexing_jobs"], "store", JobStore(state_db_path))
 
     return client
 
 
+def test_endpoints_wait_for_readiness(client):
+    try:
+        readiness.set(LOADING)
+        assert 503 == client.post(url="/query", json={"query": TEST_QUERY}).status_code
+        assert 503 == client.post(url="/documents/get_by_filters", data='{"filters": {}}').status_code
+        response = client.get(url="/ready")
+        assert 503 == response.status_code
+        assert response.json()["status"] == "loading"
+        assert client.get(url="/initialized").json() is False
+    finally:
+        readiness.set(READY)
+    assert client.get(url="/ready").json() == {"status": "ready", "error": None, "component": None}
+    assert client.get(url="/initialized").json() is True
+
+
+def test_load_pipelines_in_background(client):
+    # The pipelines are already loaded, so they're only warmed up
+    load_pipelines_in_background(warm_up_query=TEST_QUERY).join()
+    assert readiness.ready
+
+    error = WarmUpError("TestReader", RuntimeError("CUDA error"))
+    try:
+        with mock.patch("main_rest_api.utils.warm_up", side_effect=error):
+            load_pipelines_in_background(warm_up_query=TEST_QUERY).join()
+        response = client.get(url="/ready")
+        assert 503 == response.status_code
+        assert response.json()["status"] == "failed"
+        assert response.json()["component"] == "TestReader"
+    finally:
+        readiness.set(READY)
+
+
 def test_get_all_documents(client):
     response = client.post(url="/documents/get_by_filters", data='{"filters": {}}')
     assert 200 == response.status_code
@@ -272,6 +528,45 @@ def test_get_documents_with_filters(client):
     MockDocumentStore.mocker.get_all_documents.assert_called_with(filters={"test_index": ["2"]})
 
 
+def test_get_documents_as_stream(client):
+    response = client.post(url="/documents/get_by_filters?stream=true", data='{"filters": {"test_index": ["2"]}}')
+    assert 200 == response.status_code
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    MockDocumentStore.mocker.get_all_documents_generator.assert_called_with(
+        filters={"test_index": ["2"]}, return_embedding=False
+    )
+    lines = response.text.strip().split("\n")
+    assert len(lines) == 2
+    assert json.loads(lines[0])["meta"]["test_index"] == "1"
+
+
+def test_get_documents_by_page(client):
+    response = client.post(url="/documents/get_by_filters/page", json={"filters": {}, "page_size": 1})
+    assert 200 == response.status_code
+    first_page = response.json()
+    assert len(first_page["documents"]) == 1
+    assert first_page["next_cursor"]
+
+    response = client.post(
+        url="/documents/get_by_filters/page",
+        json={"filters": {}, "page_size": 1, "cursor": first_page["next_cursor"]},
+    )
+    assert 200 == response.status_code
+    second_page = response.json()
+    assert "next_cursor" not in second_page
+    # The pages are ordered by document ID
+    documents = first_page["documents"] + second_page["documents"]
+    assert documents[0]["id"] < documents[1]["id"]
+    assert sorted(document["meta"]["test_index"] for document in documents) == ["1", "2"]
+
+    # Cursors can't be reused with other filters
+    response = client.post(
+        url="/documents/get_by_filters/page",
+        json={"filters": {"test_index": ["2"]}, "page_size": 1, "cursor": first_page["next_cursor"]},
+    )
+    assert 400 == response.status_code
+
+
 def test_delete_all_documents(client):
     response = client.post(url="/documents/delete_by_filters", data='{"filters": {}}')
     assert 200 == response.status_code
@@ -292,9 +587,9 @@ def test_file_upload(client):
     assert 200 == response.status_code
     # Ensure the `convert` method was called with the right keyword params
     _, kwargs = MockPDFToTextConverter.mocker.convert.call_args
-    # Files are renamed with random prefix like 83f4c1f5b2bd43f2af35923b9408076b_sample_pdf_1.pdf
-    # so we just ensure the original file name is contained in the converted file name
-    assert "sample_pdf_1.pdf" in str(kwargs["file_path"])
+    # Files are stored under the hash of their content
+    sample_hash = file_sha256(Path(__file__).parent / "samples" / "pdf" / "sample_pdf_1.pdf")
+    assert str(kwargs["file_path"]) == str(Path(config.FILE_UPLOAD_PATH) / f"{sample_hash}.pdf")
     assert kwargs["meta"]["test_key"] == "test_value"
 
 
@@ -324,6 +619,347 @@ def test_file_upload_with_wrong_meta(client):
     MockPDFToTextConverter.mocker.convert.assert_not_called()
 
 
+def test_file_upload_in_background(client):
+    file_to_upload = {"files": (Path(__file__).parent / "samples" / "pdf" / "sample_pdf_1.pdf").open("rb")}
+    response = client.post(url="/file-upload?background=true", files=file_to_upload, data={})
+    assert 200 == response.status_code
+    job_id = response.json()["job_id"]
+
+    for _ in range(100):
+        job = client.get(url=f"/jobs/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "succeeded"
+    assert job["files_total"] == 1
+    assert job["files_converted"] == 1
+    assert job["error"] is None
+    _, kwargs = MockPDFToTextConverter.mocker.convert.call_args
+    assert Path(kwargs["file_path"]).parent == Path(config.FILE_UPLOAD_PATH)
+
+
+def test_get_unknown_job(client):
+    response = client.get(url="/jobs/does-not-exist")
+    assert 404 == response.status_code
+
+
+def test_file_upload_skips_already_indexed_files(client):
+    meta = '{"test_key": "test_value"}'
+    with mock.patch("main_rest_api.controller.file_upload.indexing_pipeline") as mocked_pipeline:
+        mocked_pipeline.run.return_value = {"documents": [Document(content="test", id="doc-1")]}
+        for _ in range(2):
+            file_to_upload = {"files": (Path(__file__).parent / "samples" / "pdf" / "sample_pdf_1.pdf").open("rb")}
+            response = client.post(url="/file-upload", files=file_to_upload, data={"meta": meta})
+            assert 200 == response.status_code
+            assert response.json() == {"document_ids": ["doc-1"]}
+        # The second upload has the same content and meta, so it's not indexed again
+        assert mocked_pipeline.run.call_count == 1
+
+
+def test_file_upload_stores_the_same_content_once(client):
+    sample = Path(__file__).parent / "samples" / "pdf" / "sample_pdf_1.pdf"
+    with mock.patch("main_rest_api.controller.file_upload.indexing_pipeline") as mocked_pipeline:
+        mocked_pipeline.run.return_value = {"documents": [Document(content="test", id="doc-1")]}
+        for file_name in ("sample_pdf_1.pdf", "renamed.pdf"):
+            response = client.post(url="/file-upload", files={"files": (file_name, sample.open("rb"))}, data={})
+            assert 200 == response.status_code
+        # Both names are indexed, as the name is part of the meta of the documents
+        assert mocked_pipeline.run.call_count == 2
+
+    assert [path.name for path in Path(config.FILE_UPLOAD_PATH).glob("*.pdf")] == [f"{file_sha256(sample)}.pdf"]
+
+
+def test_analyze_pdf(client):
+    documents = [Document(content="El Banco Pichincha es el banco más grande del país.", id="doc-1")]
+    reader = MagicMock()
+    reader.predict_batch.return_value = {
+        "answers": [[Answer(answer="Banco Pichincha")], [Answer(answer="")]]
+    }
+    meta = '{"test_key": "test_value"}'
+    with mock.patch("main_rest_api.controller.file_upload.indexing_pipeline") as mocked_indexing_pipeline, mock.patch(
+        "main_rest_api.controller.file_upload.query_pipeline"
+    ) as mocked_query_pipeline:
+        mocked_indexing_pipeline.run.return_value = {"documents": documents}
+        mocked_query_pipeline.get_nodes_by_class.return_value = [reader]
+        file_to_upload = {"files": (Path(__file__).parent / "samples" / "pdf" / "sample_pdf_1.pdf").open("rb")}
+        response = client.post(
+            url="/analyze-pdf",
+            files=file_to_upload,
+            data={"meta": meta, "questions": '["¿Cuál es el nombre del banco?", "¿Cuál es la tasa?"]'},
+        )
+        assert 200 == response.status_code
+        assert response.json()["document_ids"] == ["doc-1"]
+        results = response.json()["results"]
+        assert results[0]["question"] == "¿Cuál es el nombre del banco?"
+        assert results[0]["answers"][0]["answer"] == "Banco Pichincha"
+        # Empty answers are dropped
+        assert results[1]["answers"] == []
+        # Both questions are answered in a single pass, on the documents of the uploaded file only
+        reader.predict_batch.assert_called_once_with(
+            queries=["¿Cuál es el nombre del banco?", "¿Cuál es la tasa?"],
+            documents=[documents, documents],
+            top_k=1,
+        )
+
+
+def test_analysis_is_precomputed_at_indexing_time(client, tmp_path):
+    reader = MagicMock()
+    reader.predict_batch.return_value = {"answers": [[Answer(answer="Banco Pichincha", score=0.9)]]}
+    analyzer = DocumentAnalyzer(
+        reader=reader, questions=["¿Cuál es el nombre del banco?"], top_k=1, store_path=str(tmp_path / "state.db")
+    )
+    documents = [
+        Document(content="El Banco Pichincha es el banco más grande del país.", meta={"name": "pichincha.pdf"}),
+        Document(content="Otro documento.", meta={"name": "otro.pdf"}),
+    ]
+    output, _ = analyzer.run(documents=documents)
+    assert output["documents"] == documents
+    # Each file is analyzed on its own documents
+    assert reader.predict_batch.call_count == 2
+    assert reader.predict_batch.call_args_list[0].kwargs["documents"] == [documents[:1]]
+
+    with mock.patch("main_rest_api.controller.file_upload.indexing_pipeline") as mocked_pipeline:
+        mocked_pipeline.get_nodes_by_class.return_value = [analyzer]
+        response = client.get(url="/analysis/pichincha.pdf")
+        assert 200 == response.status_code
+        assert response.json()["results"][0]["answers"][0]["answer"] == "Banco Pichincha"
+
+        response = client.get(url="/analysis/unknown.pdf")
+        assert 404 == response.status_code
+    # Looking up the analysis doesn't run the Reader
+    assert reader.predict_batch.call_count == 2
+
+
+def test_precomputed_analysis_belongs_to_the_uploaded_file(client, tmp_path):
+    def answer(queries, documents, top_k):
+        return {"answers": [[Answer(answer=file_documents[0].content, score=0.9)] for file_documents in documents]}
+
+    reader = MagicMock()
+    reader.predict_batch.side_effect = answer
+    questions = ["¿Cuál es el nombre del banco?"]
+    analyzer = DocumentAnalyzer(reader=reader, questions=questions, top_k=1, store_path=str(tmp_path / "state.db"))
+    indexed_documents: Dict[str, Document] = {}
+
+    def index(file_paths, meta, params):
+        # One document per file, its content telling which file it comes from
+        documents = [Document(content=f"Contenido {Path(file_paths[0]).stat().st_size}", meta=meta[0])]
+        indexed_documents.update({document.id: document for document in documents})
+        analyzer.run(documents=documents)
+        return {"documents": documents}
+
+    def analyze(sample: str) -> str:
+        file_to_upload = {"files": ("estado.pdf", (Path(__file__).parent / "samples" / "pdf" / sample).open("rb"))}
+        response = client.post(url="/analyze-pdf", files=file_to_upload, data={"questions": json.dumps(questions)})
+        assert 200 == response.status_code
+        return response.json()["results"][0]["answers"][0]["answer"]
+
+    with mock.patch("main_rest_api.controller.file_upload.indexing_pipeline") as mocked_indexing_pipeline, mock.patch(
+        "main_rest_api.controller.file_upload.query_pipeline"
+    ) as mocked_query_pipeline, mock.patch("main_rest_api.controller.file_upload.document_store") as mocked_store:
+        mocked_indexing_pipeline.run.side_effect = index
+        mocked_indexing_pipeline.get_nodes_by_class.side_effect = lambda cls: [analyzer] * (cls is DocumentAnalyzer)
+        mocked_query_pipeline.get_nodes_by_class.return_value = [reader]
+        mocked_store.get_documents_by_id.side_effect = lambda ids: [indexed_documents[i] for i in ids]
+
+        first_answer = analyze("sample_pdf_1.pdf")
+        second_answer = analyze("sample_pdf_2.pdf")
+        assert first_answer != second_answer
+        # Each file was analyzed once, while it was indexed
+        assert reader.predict_batch.call_count == 2
+
+        # The first file is uploaded again under the same name: it's not indexed again, and the stored answers
+        # are about the second file, so they're not returned
+        assert analyze("sample_pdf_1.pdf") == first_answer
+        assert mocked_indexing_pipeline.run.call_count == 2
+        assert reader.predict_batch.call_count == 3
+
+
+def test_passage_selector_trims_documents():
+    content = (
+        "Banco Pichincha C.A. certifica lo siguiente. El cliente tiene una cuenta de ahorros. "
+        "La cuenta está activa desde el año 2015. Atentamente, el gerente."
+    )
+    documents = [Document(content=content, id="1", meta={"name": "pichincha.pdf"}), Document(content="", id="2")]
+    selector = PassageSelector(window_size=1, top_k=1)
+    output, _ = selector.run(query="¿Desde qué año está activa la cuenta?", documents=documents)
+
+    trimmed = output["documents"][0]
+    assert trimmed.content == "La cuenta está activa desde el año 2015."
+    # The trimmed document can be traced back to the original one
+    assert trimmed.id == "1"
+    assert trimmed.meta["name"] == "pichincha.pdf"
+    start, end = trimmed.meta["selected_spans"][0]
+    assert content[start:end] == trimmed.content
+    assert documents[0].content == content
+    # Documents without any sentence go through as they are
+    assert output["documents"][1] is documents[1]
+
+    output, _ = selector.run_batch(queries=["¿Quién certifica?", "¿Cuál es el año?"], documents=documents[:1])
+    assert [documents[0].content for documents in output["documents"]] == [
+        "Banco Pichincha C.A. certifica lo siguiente.",
+        "La cuenta está activa desde el año 2015.",
+    ]
+
+
+def test_passage_offset_mapper_maps_answers_to_the_original_content():
+    content = (
+        "Banco Pichincha C.A. certifica lo siguiente. El cliente tiene una cuenta de ahorros. "
+        "La cuenta está activa desde el año 2015. Atentamente, el gerente."
+    )
+    documents = [Document(content=content, id="1")]
+    selector = PassageSelector(window_size=1, top_k=2)
+    queries = ["¿Quién certifica?", "¿Desde qué año está activa la cuenta?"]
+    output, _ = selector.run_batch(queries=queries, documents=documents)
+
+    def read(answer: str, trimmed: Document) -> Answer:
+        # Like the Reader, with offsets in the trimmed content
+        start = trimmed.content.index(answer)
+        return Answer(
+            answer=answer,
+            offsets_in_document=[Span(start=start, end=start + len(answer))],
+            document_ids=[trimmed.id],
+            # Haystack's Readers take the meta of the first document with the answer's id, whatever the query
+            meta=dict(output["documents"][0][0].meta),
+        )
+
+    trimmed_per_query = [query_documents[0] for query_documents in output["documents"]]
+    answers = [[read("Banco Pichincha C.A.", trimmed_per_query[0])], [read("2015", trimmed_per_query[1])]]
+    # The year is in the second passage of the trimmed document
+    assert trimmed_per_query[1].content.index("2015") != content.index("2015")
+
+    mapper = PassageOffsetMapper()
+    output, _ = mapper.run_batch(answers=answers, documents=output["documents"])
+    for query_answers in output["answers"]:
+        span = query_answers[0].offsets_in_document[0]
+        assert content[span.start : span.end] == query_answers[0].answer
+
+    # Answers about documents that were not trimmed are left as they are
+    answer = Answer(answer="Banco", offsets_in_document=[Span(start=0, end=5)], document_ids=["2"])
+    output, _ = mapper.run(answers=[answer], documents=[Document(content="Banco", id="2")])
+    assert output["answers"] == [answer]
+
+
+def test_mmap_document_store_is_shared(tmp_path):
+    writer = MmapDocumentStore(index_path=str(tmp_path), embedding_dim=3, max_segments=2)
+    # Another worker, reading the same files
+    reader = MmapDocumentStore(index_path=str(tmp_path), embedding_dim=3)
+    assert reader.query("banco") == []
+
+    writer.write_documents(
+        [
+            Document(content="El Banco Pichincha certifica la cuenta", id="1", meta={"pdf_name": "a.pdf"}),
+            Document(content="La cuenta de ahorros del cliente", id="2", meta={"pdf_name": "b.pdf"}),
+        ]
+    )
+    # New segments are picked up without reloading the store
+    assert [document.id for document in reader.query("¿Qué banco certifica la cuenta?")] == ["1", "2"]
+    assert [document.id for document in reader.query("cuenta", filters={"pdf_name": ["b.pdf"]})] == ["2"]
+
+    writer.write_documents([Document(content="El banco cambió de nombre", id="1", meta={"pdf_name": "a.pdf"})])
+    writer.write_documents([Document(content="Otro banco", id="3", embedding=np.array([1.0, 0.0, 0.0]))])
+    assert reader.get_document_by_id("1").content == "El banco cambió de nombre"
+    assert reader.get_document_count() == 3
+    assert [document.id for document in reader.query_by_embedding(np.array([1.0, 0.0, 0.0]))] == ["3"]
+    # More than `max_segments` segments are merged
+    assert len(list((tmp_path / "document").glob("0*"))) == 1
+
+    writer.delete_documents(filters={"pdf_name": ["a.pdf"]})
+    assert sorted(document.id for document in reader.get_all_documents()) == ["2", "3"]
+
+    label = Label(
+        query="q",
+        document=Document(content="d"),
+        is_correct_answer=True,
+        is_correct_document=True,
+        origin="user-feedback",
+    )
+    writer.write_labels([label])
+    assert len(reader.get_all_labels(filters={"origin": ["user-feedback"]})) == 1
+
+
+def test_mmap_document_store_pages(tmp_path):
+    store = MmapDocumentStore(index_path=str(tmp_path), embedding_dim=3)
+    store.write_documents(
+        [Document(content=f"Banco {i}", id=f"doc-{i}", meta={"pdf_name": f"{i % 2}.pdf"}) for i in range(5)]
+    )
+    store.write_documents([Document(content="Banco 5", id="doc-5", meta={"pdf_name": "1.pdf"})])
+
+    first_page = store.get_documents_after(None, 2)
+    assert [document.id for document in first_page] == ["doc-0", "doc-1"]
+    # The documents written or deleted before the cursor don't shift the next pages
+    store.delete_documents(ids=["doc-0"])
+    store.write_documents([Document(content="Banco", id="doc-00")])
+    assert [document.id for document in store.get_documents_after("doc-1", 2)] == ["doc-2", "doc-3"]
+    assert [document.id for document in store.get_documents_after("doc-3", 10)] == ["doc-4", "doc-5"]
+
+    documents = store.get_documents_after("doc-1", 10, filters={"pdf_name": "1.pdf"})
+    assert [document.id for document in documents] == ["doc-3", "doc-5"]
+
+
+def test_mmap_document_store_filters_on_the_meta_index(tmp_path):
+    store = MmapDocumentStore(index_path=str(tmp_path), embedding_dim=3)
+    store.write_documents(
+        [
+            Document(
+                content=f"Banco {i}",
+                id=str(i),
+                meta={"pdf_name": f"{i % 3}.pdf", "page": i},
+                embedding=np.array([1.0, float(i), 0.0]),
+            )
+            for i in range(9)
+        ]
+    )
+
+    # The filters on the pdf_name select the rows without decoding the other documents
+    with mock.patch.object(_Segment, "document", autospec=True, side_effect=_Segment.document) as decode:
+        documents = store.query("banco", filters={"pdf_name": "1.pdf"}, top_k=2)
+        assert sorted(document.id for document in documents) == ["1", "4"]
+        assert decode.call_count == 2
+        decode.reset_mock()
+
+        documents = store.query_by_embedding(np.array([1.0, 1.0, 0.0]), filters={"pdf_name": {"$in": ["2.pdf"]}})
+        assert sorted(document.id for document in documents) == ["2", "5", "8"]
+        assert store.get_document_count(filters={"pdf_name": ["0.pdf", "2.pdf"]}) == 6
+        store.delete_documents(filters={"pdf_name": ["0.pdf"]})
+        assert decode.call_count == 3
+
+        # The other filters are evaluated on the selected documents only
+        documents = store.query("banco", filters={"pdf_name": ["1.pdf"], "page": {"$gte": 4}})
+        assert sorted(document.id for document in documents) == ["4", "7"]
+        assert decode.call_count == 6
+    assert store.get_document_count() == 6
+
+
+def test_pdf_sharded_retriever(tmp_path):
+    fallback_store = mock.Mock()
+    fallback_store.query.return_value = []
+    retriever = PdfShardedBM25Retriever(document_store=fallback_store, top_k=2, index_path=str(tmp_path))
+    retriever.run_indexing(
+        [
+            Document(content="El Banco Pichincha certifica la cuenta", id="1", meta={"pdf_name": "a.pdf"}),
+            Document(content="Saldo de la cuenta de ahorros", id="2", meta={"pdf_name": "a.pdf"}),
+            Document(content="La cuenta del Banco Guayaquil", id="3", meta={"pdf_name": "b.pdf"}),
+        ]
+    )
+    assert len(retriever.shards.list_indexes()) == 2
+
+    # Scoped queries only read the shards of their PDFs
+    documents = retriever.retrieve("¿Qué banco certifica la cuenta?", filters={"pdf_name": ["a.pdf"]})
+    assert [document.id for document in documents] == ["1", "2"]
+    documents = retriever.retrieve("banco", filters={"pdf_name": {"$in": ["a.pdf", "b.pdf"]}}, top_k=3)
+    assert sorted(document.id for document in documents) == ["1", "3"]
+    fallback_store.query.assert_not_called()
+
+    # The other queries go to the DocumentStore
+    retriever.retrieve("banco")
+    retriever.retrieve("banco", filters={"pdf_name": ["c.pdf"]})
+    assert fallback_store.query.call_count == 2
+
+    retriever.delete_documents(filters={"pdf_name": ["a.pdf"]})
+    assert retriever.retrieve("cuenta", filters={"pdf_name": ["a.pdf"]}) == []
+    assert [document.id for document in retriever.retrieve("cuenta", filters={"pdf_name": "b.pdf"})] == ["3"]
+
+
 def test_query_with_no_filter(client):
     with mock.patch("main_rest_api.controller.search.query_pipeline") as mocked_pipeline:
         # `run` must return a dictionary containing a `query` key
@@ -488,6 +1124,227 @@ def test_query_with_prompt_node(client):
         mocked_pipeline.run.assert_called_with(query=TEST_QUERY, params={}, debug=False)
 
 
+def test_query_with_batching(client):
+    with mock.patch("main_rest_api.controller.search.query_pipeline") as mocked_pipeline:
+        mocked_pipeline.run_batch.return_value = {
+            "queries": [TEST_QUERY],
+            "answers": [[Answer(answer="Adobe Systems")]],
+            "documents": [[Document(content="test")]],
+        }
+        with mock.patch("main_rest_api.controller.search.query_batcher", QueryBatcher(4, 0.01)):
+            response = client.post(url="/query", json={"query": TEST_QUERY, "pdf_name": "sample_pdf_1.pdf"})
+        assert 200 == response.status_code
+        assert response.json()["answers"][0]["answer"] == "Adobe Systems"
+        assert response.json()["documents"][0]["content"] == "test"
+        # Ensure the filters are passed on as a list, with one entry per query
+        mocked_pipeline.run_batch.assert_called_with(
+            queries=[TEST_QUERY], params={"Retriever": {"filters": [{"pdf_name": "sample_pdf_1.pdf"}]}}, debug=False
+        )
+        mocked_pipeline.run.assert_not_called()
+
+
+def test_run_query_batch_merges_params():
+    pipeline = MagicMock()
+    pipeline.run_batch.return_value = {"answers": [["a"], ["b"]], "documents": [["doc_a"], ["doc_b"]]}
+    results = run_query_batch(
+        pipeline,
+        queries=["query a", "query b"],
+        params_list=[{"Retriever": {"top_k": 3, "filters": {"pdf_name": "a.pdf"}}}, {"Retriever": {"top_k": 3}}],
+    )
+    pipeline.run_batch.assert_called_with(
+        queries=["query a", "query b"],
+        params={"Retriever": {"top_k": 3, "filters": [{"pdf_name": "a.pdf"}, None]}},
+        debug=False,
+    )
+    assert results == [
+        {"query": "query a", "answers": ["a"], "documents": ["doc_a"]},
+        {"query": "query b", "answers": ["b"], "documents": ["doc_b"]},
+    ]
+
+
+def test_advanced_query_keeps_order_and_groups_by_pdf(client):
+    def run_batch(queries, params, debug):
+        return {"answers": [[Answer(answer=f"answer to {query}")] for query in queries]}
+
+    with mock.patch("main_rest_api.controller.search.query_pipeline") as mocked_pipeline:
+        mocked_pipeline.run_batch.side_effect = run_batch
+        queries = [
+            {"query": "first", "pdf_name": "a.pdf"},
+            {"query": "second", "pdf_name": "b.pdf"},
+            {"query": "third", "pdf_name": "a.pdf"},
+        ]
+        response = client.post(url="/advanced_query", json={"queries": queries})
+        assert 200 == response.status_code
+        response_json = response.json()
+        assert [result["answers"][0]["answer"] for result in response_json] == [
+            "answer to first",
+            "answer to second",
+            "answer to third",
+        ]
+        assert all("_debug" not in result for result in response_json)
+        # One batch per PDF
+        assert mocked_pipeline.run_batch.call_count == 2
+
+        # The timings are only returned with debug
+        response = client.post(url="/advanced_query", json={"queries": queries, "debug": True})
+        assert 200 == response.status_code
+        assert [result["_debug"]["timing"]["batch_size"] for result in response.json()] == [2, 1, 2]
+
+
+def test_query_timeout(client):
+    with mock.patch("main_rest_api.controller.search.query_pipeline") as mocked_pipeline:
+        mocked_pipeline.run.return_value = {"query": TEST_QUERY}
+        # The timeout passes before the query can run
+        response = client.post(url="/query", json={"query": TEST_QUERY, "timeout": 1e-6})
+        assert 504 == response.status_code
+        response = client.post(url="/query", json={"query": TEST_QUERY}, headers={"X-Request-Timeout": "0.000001"})
+        assert 504 == response.status_code
+        mocked_pipeline.run.assert_not_called()
+
+        response = client.post(url="/query", json={"query": TEST_QUERY, "timeout": 10})
+        assert 200 == response.status_code
+        assert "timed_out" not in response.json()
+
+    metrics = client.get(url="/metrics").text
+    assert 'queries_timed_out_total{endpoint="query"} 2.0' in metrics
+
+    pipeline = MagicMock()
+    future = QueryBatcher(4, 0.01).submit(pipeline, query=TEST_QUERY, params={}, deadline=time.monotonic() - 1)
+    with pytest.raises(HTTPException) as excinfo:
+        future.result(timeout=5)
+    assert excinfo.value.status_code == 504
+    pipeline.run_batch.assert_not_called()
+
+
+def test_advanced_query_timeout(client):
+    def run_batch(queries, params, debug):
+        return {"answers": [[Answer(answer=f"answer to {query}")] for query in queries]}
+
+    with mock.patch("main_rest_api.controller.search.query_pipeline") as mocked_pipeline:
+        mocked_pipeline.run_batch.side_effect = run_batch
+        queries = [{"query": "first", "pdf_name": "a.pdf", "timeout": 1e-6}, {"query": "second", "pdf_name": "a.pdf"}]
+        response = client.post(url="/advanced_query", json={"queries": queries})
+        assert 200 == response.status_code
+        first, second = response.json()
+        # Partial results: the query that timed out is skipped
+        assert first["timed_out"] is True and first["answers"] == []
+        assert "timed_out" not in second and second["answers"][0]["answer"] == "answer to second"
+        mocked_pipeline.run_batch.assert_called_once()
+        assert mocked_pipeline.run_batch.call_args.kwargs["queries"] == ["second"]
+
+        response = client.post(url="/advanced_query", json={"queries": queries, "timeout": 1e-6})
+        assert 504 == response.status_code
+        assert mocked_pipeline.run_batch.call_count == 1
+
+
+def test_query_node_timings(client):
+    response = client.post(url="/query", json={"query": TEST_QUERY, "debug": True})
+    assert 200 == response.status_code
+    timing = response.json()["_debug"]["timing"]
+    assert set(timing["nodes"]) == {"TestRetriever", "TestReader"}
+    assert "time" in timing
+
+    metrics = client.get(url="/metrics").text
+    assert 'pipeline_node_duration_seconds_count{pipeline="test-query",node="TestReader"}' in metrics
+
+
+def test_query_cache(client):
+    with mock.patch("main_rest_api.controller.search.query_pipeline") as mocked_pipeline:
+        mocked_pipeline.run.return_value = {"query": TEST_QUERY, "answers": [Answer(answer="Adobe Systems")]}
+        for query in [TEST_QUERY, "  who made the PDF   specification? "]:
+            response = client.post(url="/query", json={"query": query, "pdf_name": "sample_pdf_1.pdf"})
+            assert 200 == response.status_code
+            assert response.json()["answers"][0]["answer"] == "Adobe Systems"
+        # The second query only differs in casing and whitespace, so it's served from the cache
+        assert mocked_pipeline.run.call_count == 1
+
+        # Deleting documents invalidates the cache
+        response = client.post(url="/documents/delete_by_filters", data='{"filters": {}}')
+        assert 200 == response.status_code
+        response = client.post(url="/query", json={"query": TEST_QUERY, "pdf_name": "sample_pdf_1.pdf"})
+        assert 200 == response.status_code
+        assert mocked_pipeline.run.call_count == 2
+
+        stats = client.get(url="/query-cache").json()
+        assert stats["hits"] >= 1
+        assert stats["misses"] >= 2
+
+
+def test_query_cache_invalidation(tmp_path):
+    generation_path = str(tmp_path / "generation")
+    cache = QueryCache(10, 60, generation_path=generation_path, check_interval=60)
+    other_worker_cache = QueryCache(10, 60, generation_path=generation_path, check_interval=60)
+
+    # A query started before an invalidation doesn't store its result
+    generation = cache.generation()
+    cache.invalidate()
+    cache.put("key", {"answers": []}, generation=generation)
+    assert cache.get("key") is None
+    cache.put("key", {"answers": []}, generation=cache.generation())
+    assert cache.get("key") == {"answers": []}
+
+    # Nor when another worker invalidated the cache, even before this one checked the generation file again
+    generation = other_worker_cache.generation()
+    cache.invalidate()
+    other_worker_cache.put("key", {"answers": []}, generation=generation)
+    assert other_worker_cache.get("key") is None
+
+    other_worker_cache.put("key", {"answers": []}, generation=other_worker_cache.generation())
+    with mock.patch.object(Path, "stat", side_effect=AssertionError("checked")):
+        # The lookups don't read the generation file more than every check_interval
+        assert other_worker_cache.get("key") == {"answers": []}
+
+
+def test_normalize_query():
+    assert normalize_query("¿Cuál es el nombre del BANCO?") == normalize_query("cual es el  nombre del banco")
+    assert normalize_query("ＡＢＣ　Ｓ．Ａ．") == "abc s a"
+    # The ñ is not an accented n
+    assert normalize_query("¿Cuál es el año?") != normalize_query("cual es el ano")
+    assert normalize_query("¿Cuál es el nombre del banco?", strip_stopwords=True) == "cual nombre del banco"
+    # Queries made of stopwords only are kept as they are
+    assert normalize_query("¿Es la?", strip_stopwords=True) == "es la"
+    # The words changing the answer are never stripped
+    for query, other_query in (
+        ("¿Quién firma?", "¿Cuándo firma?"),
+        ("¿La cuenta está activa?", "¿La cuenta no está activa?"),
+        ("¿Cuánto cuesta con seguro?", "¿Cuánto cuesta sin seguro?"),
+    ):
+        assert normalize_query(query, strip_stopwords=True) != normalize_query(other_query, strip_stopwords=True)
+
+
+def test_query_cache_normalizes_queries(client):
+    with mock.patch("main_rest_api.controller.search.query_pipeline") as mocked_pipeline:
+        mocked_pipeline.run.return_value = {"query": "¿Cuál es el banco?", "answers": [Answer(answer="Pichincha")]}
+        for query in ["¿Cuál es el banco?", "cual es el banco"]:
+            response = client.post(url="/query", json={"query": query})
+            assert 200 == response.status_code
+            assert response.json()["query"] == query
+        # The pipeline receives the query as it was sent
+        mocked_pipeline.run.assert_called_once_with(query="¿Cuál es el banco?", params={}, debug=False)
+
+
+def test_query_coalescer():
+    coalescer = QueryCoalescer()
+    calls = []
+
+    async def run_query():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"answers": len(calls)}
+
+    async def run_queries():
+        return await asyncio.gather(*[coalescer.run("key", run_query) for _ in range(3)])
+
+    assert asyncio.run(run_queries()) == [{"answers": 1}] * 3
+    assert coalescer.stats()["executed"] == 1
+    assert coalescer.stats()["coalesced"] == 2
+    assert coalescer.stats()["in_flight"] == 0
+
+    # Queries that are not running at the same time run again
+    asyncio.run(run_queries())
+    assert len(calls) == 2
+
+
 def test_write_feedback(client, feedback):
     response = client.post(url="/feedback", json=feedback)
     assert 200 == response.status_code
@@ -524,24 +1381,120 @@ def test_get_feedback(client, feedback):
     MockDocumentStore.mocker.get_all_labels.assert_called_once()
 
 
-def test_delete_feedback(client, monkeypatch, feedback):
-    # This label contains `origin=user-feedback` and should be deleted
-    label_to_delete = Label.from_dict(feedback)
-    # This other label has a different origin and should NOT be deleted
-    label_to_keep = Label.from_dict(feedback)
-    label_to_keep.id = "42"
-    label_to_keep.origin = "not-from-api"
-
-    # Patch the Document Store so it returns the 2 labels above
-    def get_all_labels(*args, **kwargs):
-        return [label_to_delete, label_to_keep]
+def test_delete_feedback(client, feedback):
+    # Only the labels with `origin=user-feedback` are deleted, without reading them first
+    response = client.delete(url="/feedback")
+    assert 200 == response.status_code
+    MockDocumentStore.mocker.delete_labels.assert_called_with(filters={"origin": ["user-feedback"]})
+    MockDocumentStore.mocker.get_all_labels.assert_not_called()
 
-    monkeypatch.setattr(MockDocumentStore, "get_all_labels", get_all_labels)
 
-    # Call the API and ensure `delete_labels` was called only on the label with id=123
-    response = client.delete(url="/feedback")
+def test_write_feedback_batch(client, feedback):
+    other_feedback = {**feedback, "id": "456"}
+    response = client.post(url="/feedback/batch", json=[feedback, other_feedback])
     assert 200 == response.status_code
-    MockDocumentStore.mocker.delete_labels.assert_called_with(ids=["123"])
+    # Both labels are written with a single call
+    MockDocumentStore.mocker.write_labels.assert_called_once()
+    args, _ = MockDocumentStore.mocker.write_labels.call_args
+    assert [label.id for label in args[0]] == ["123", "456"]
+
+
+def test_label_writer_buffers_labels(feedback):
+    document_store = MagicMock()
+    writer = LabelWriter(document_store, max_batch_size=3, max_wait=0.05)
+    labels = [Label.from_dict({**feedback, "id": str(i)}) for i in range(4)]
+
+    writer.write(labels[:2])
+    document_store.write_labels.assert_not_called()
+    # The batch is full
+    writer.write(labels[2:3])
+    document_store.write_labels.assert_called_once_with(labels[:3])
+    # The last label is written after `max_wait`
+    writer.write(labels[3:])
+    time.sleep(0.5)
+    document_store.write_labels.assert_called_with(labels[3:])
+
+
+def test_label_writer_isolates_failing_labels(feedback):
+    def write_labels(labels):
+        if any(label.id == "bad" for label in labels):
+            raise ValueError("Invalid label")
+
+    document_store = MagicMock()
+    document_store.write_labels.side_effect = write_labels
+    on_write = MagicMock()
+    # Long enough for the background flush not to run during the test
+    writer = LabelWriter(document_store, max_batch_size=10, max_wait=60, on_write=on_write, max_attempts=2)
+    bad, good, other = (Label.from_dict({**feedback, "id": label_id}) for label_id in ("bad", "good", "other"))
+
+    writer.write([bad])
+    # The batch fails because of the buffered label, which doesn't fail this caller
+    writer.write([good], flush=True)
+    on_write.assert_called_once_with([good])
+    assert document_store.write_labels.call_args_list[-2:] == [mock.call([bad]), mock.call([good])]
+
+    # The bad label is retried once more, then dropped, without failing the flush
+    writer.flush()
+    assert document_store.write_labels.call_args == mock.call([bad])
+    writer.flush()
+    writer.write([other], flush=True)
+    assert document_store.write_labels.call_args == mock.call([other])
+
+    # A caller writing a bad label gets the error, and the label is not retried
+    with pytest.raises(ValueError):
+        writer.write([bad], flush=True)
+    call_count = document_store.write_labels.call_count
+    writer.flush()
+    assert document_store.write_labels.call_count == call_count
+
+
+def test_feedback_metrics(client, feedback):
+    MockDocumentStore.mocker.get_all_labels.return_value = []
+    # The first call builds the metrics from the labels already in the DocumentStore
+    client.post(url="/eval-feedback", json={"filters": {}})
+
+    document_id = "fc18c987a8312e72a47fb1524f230bb0"
+    for label_id, is_correct_answer in (("1", True), ("2", False), ("2", True), ("3", True)):
+        feedback["id"] = f"{document_id}-{label_id}"
+        feedback["is_correct_answer"] = is_correct_answer
+        feedback["document"]["id"] = document_id
+        feedback["document"]["meta"] = {"pdf_name": f"{document_id}.pdf"}
+        assert 200 == client.post(url="/feedback", json=feedback).status_code
+
+    MockDocumentStore.mocker.get_all_labels.reset_mock()
+    for filters in ({"document_id": [document_id]}, {"pdf_name": f"{document_id}.pdf"}):
+        response = client.post(url="/eval-feedback", json={"filters": filters})
+        assert 200 == response.status_code
+        # Writing label 2 again replaced its previous feedback
+        assert response.json() == {"answer_accuracy": 1.0, "document_accuracy": 1.0, "n_feedback": 3}
+    # The metrics didn't need the labels
+    MockDocumentStore.mocker.get_all_labels.assert_not_called()
+
+    # Other filters still go through the labels
+    client.post(url="/eval-feedback", json={"filters": {"query": ["Who made the PDF specification?"]}})
+    MockDocumentStore.mocker.get_all_labels.assert_called_once()
+
+
+def test_feedback_metrics_rebuild_keeps_concurrent_feedback(tmp_path):
+    metrics = FeedbackMetrics(str(tmp_path / "state.db"))
+    label = Label(
+        query="q",
+        document=Document(content="d", meta={"pdf_name": "a.pdf"}),
+        is_correct_answer=True,
+        is_correct_document=True,
+        origin="user-feedback",
+    )
+    writer = threading.Thread(target=metrics.record, args=([label],))
+
+    def read_labels():
+        # Feedback recorded by another worker while the labels are read
+        writer.start()
+        time.sleep(0.1)
+        return []
+
+    metrics.rebuild(read_labels)
+    writer.join()
+    assert metrics.get({"pdf_name": "a.pdf"})["n_feedback"] == 1
 
 
 def test_export_feedback(client, monkeypatch, feedback):
@@ -564,14 +1517,141 @@ def test_export_feedback(client, monkeypatch, feedback):
         assert context[answer_start : answer_start + len(answer)] == answer
 
 
+def test_export_feedback_groups_labels_by_document(client, monkeypatch, feedback):
+    other_label = Label.from_dict(feedback)
+    other_label.id = "456"
+    other_label.query = "When was the PDF specification made available?"
+
+    def get_all_labels(*args, **kwargs):
+        return [Label.from_dict(feedback), other_label]
+
+    monkeypatch.setattr(MockDocumentStore, "get_all_labels", get_all_labels)
+
+    response = client.get("/export-feedback?gzip=true")
+    assert 200 == response.status_code
+    export = json.loads(gzip.decompress(response.content))
+    # Both labels are about the same document, so its content is exported once
+    assert len(export["data"]) == 1
+    assert len(export["data"][0]["paragraphs"]) == 1
+    assert [qa["id"] for qa in export["data"][0]["paragraphs"][0]["qas"]] == ["123", "456"]
+
+
 def test_get_feedback_malformed_query(client, feedback):
     feedback["unexpected_field"] = "misplaced-value"
     response = client.post(url="/feedback", json=feedback)
     assert response.status_code == 422
 
 
+def test_prepare_for_fork_makes_models_read_only():
+    torch = pytest.importorskip("torch")
+
+    class ModelNode(BaseComponent):
+        outgoing_edges = 1
+
+        def __init__(self):
+            super().__init__()
+            self.model = torch.nn.Linear(2, 2)
+
+        def run(self, query: str):
+            return {}, "output_1"
+
+        def run_batch(self, queries: List[str]):
+            return {}, "output_1"
+
+    pipeline = Pipeline()
+    node = ModelNode()
+    pipeline.add_node(component=node, name="Model", inputs=["Query"])
+    try:
+        prepare_for_fork({"query_pipeline": pipeline})
+        assert gc.get_freeze_count() > 0
+    finally:
+        gc.unfreeze()
+    assert not node.model.training
+    assert not any(parameter.requires_grad for parameter in node.model.parameters())
+
+
+def test_set_reader_backend():
+    reader = Mock(spec=FARMReader)
+    reader.name = "Reader"
+    analyzer = Mock(spec=DocumentAnalyzer)
+    analyzer.reader = reader
+    pipeline = Mock()
+    pipeline.graph.nodes = ["Query", "Reader", "Analyzer"]
+    pipeline.get_node.side_effect = {"Query": Mock(), "Reader": reader, "Analyzer": analyzer}.get
+
+    reader._component_config = {"params": {"model_name_or_path": "model"}}
+    reader.inferencer = MagicMock()
+    with mock.patch("main_rest_api.pipeline.reader_backend.quantize_reader") as quantize_reader, mock.patch(
+        "main_rest_api.pipeline.reader_backend.export_onnx"
+    ) as export_onnx, mock.patch("main_rest_api.pipeline.reader_backend.load_onnx_reader") as load_onnx_reader_:
+        prepare_reader_backend(pipeline, "pytorch", cache_dir="cache")
+        assert set_reader_backend(pipeline, "pytorch", cache_dir="cache") == []
+        quantize_reader.assert_not_called()
+
+        # Quantized when the pipelines are loaded, maybe in the gunicorn master, so the workers share the weights.
+        # The reader used by both nodes is only quantized once.
+        prepare_reader_backend(pipeline, "quantized", cache_dir="cache")
+        quantize_reader.assert_called_once_with(reader)
+        assert set_reader_backend(pipeline, "quantized", cache_dir="cache") == []
+        export_onnx.assert_not_called()
+
+        # The ONNX models are exported when the pipelines are loaded, and loaded in each worker
+        reader.inferencer.model.prediction_heads = [Mock(no_ans_boost=-2.0)]
+        prepare_reader_backend(pipeline, "onnx-quantized", cache_dir="cache")
+        export_onnx.assert_called_once_with("model", "cache", quantize=True)
+        # The PyTorch weights are not kept, only the settings of the prediction head
+        assert reader.inferencer.model is None
+        assert reader.prediction_head_settings["no_ans_boost"] == -2.0
+        load_onnx_reader_.assert_not_called()
+        assert set_reader_backend(pipeline, "onnx-quantized", cache_dir="cache") == ["Reader"]
+        load_onnx_reader_.assert_called_once_with(reader, "cache", quantize=True)
+        quantize_reader.assert_called_once()
+
+    with pytest.raises(ValueError, match="Unknown reader backend"):
+        set_reader_backend(pipeline, "tensorrt", cache_dir="")
+
+
+def test_load_onnx_reader():
+    reader = Mock(spec=FARMReader)
+    reader._component_config = {"params": {"model_name_or_path": "model", "num_processes": 0}}
+    reader.devices = [Mock(type="cpu")]
+    reader.inferencer = MagicMock(batch_size=8, disable_tqdm=True)
+    reader.inferencer.model.prediction_heads = [Mock(no_ans_boost=-2.0, n_best=3)]
+
+    with mock.patch(
+        "main_rest_api.pipeline.reader_backend.export_onnx", return_value=Path("cache") / "model-onnx"
+    ) as export_onnx, mock.patch("main_rest_api.pipeline.reader_backend.QAInferencer") as inferencer_class:
+        load_onnx_reader(reader, cache_dir="cache")
+
+    export_onnx.assert_called_once_with("model", "cache", quantize=False)
+    # The inferencer is loaded alone, with the settings of the reader, rather than with a whole new reader
+    args, kwargs = inferencer_class.load.call_args
+    assert args == (str(Path("cache") / "model-onnx"),)
+    assert kwargs["batch_size"] == 8
+    assert kwargs["gpu"] is False
+    assert kwargs["num_processes"] == 0
+    onnx_inferencer = inferencer_class.load.return_value
+    assert reader.inferencer is onnx_inferencer
+    assert onnx_inferencer.model.prediction_heads[0].no_ans_boost == -2.0
+    assert onnx_inferencer.model.prediction_heads[0].n_best == 3
+
+    # After the PyTorch model was released, the settings kept with the reader are used
+    reader.inferencer = MagicMock(batch_size=8, disable_tqdm=True, model=None)
+    reader.prediction_head_settings = {"no_ans_boost": -1.0}
+    with mock.patch("main_rest_api.pipeline.reader_backend.export_onnx", return_value=Path("cache") / "model-onnx"):
+        with mock.patch("main_rest_api.pipeline.reader_backend.QAInferencer") as inferencer_class:
+            load_onnx_reader(reader, cache_dir="cache")
+    assert reader.inferencer.model.prediction_heads[0].no_ans_boost == -1.0
+
+
 def test_get_health_check(client):
-    with mock.patch("main_rest_api.controller.health.os") as os:
+    from main_rest_api.controller.health import ResourceSampler  # pylint: disable=import-outside-toplevel
+
+    # Without a sample yet, the health check takes one
+    sampler = ResourceSampler(interval=60)
+    with mock.patch("main_rest_api.controller.health.resource_sampler", sampler), mock.patch(
+        "main_rest_api.controller.health.os"
+    ) as os:
         os.cpu_count.return_value = 4
         os.getpid.return_value = int(2345)
         with mock.patch("main_rest_api.controller.health.pynvml") as pynvml:
@@ -587,7 +1667,9 @@ def test_get_health_check(client):
             with mock.patch("main_rest_api.controller.health.psutil") as psutil:
                 psutil.virtual_memory.return_value = Mock(total=34359738368)
                 psutil.Process.return_value = Mock(
-                    cpu_percent=Mock(return_value=200), memory_percent=Mock(return_value=75)
+                    cpu_percent=Mock(return_value=200),
+                    memory_percent=Mock(return_value=75),
+                    memory_info=Mock(return_value=Mock(rss=2**30)),
                 )
 
                 response = client.get(url="/health")
@@ -601,3 +1683,19 @@ def test_get_health_check(client):
                         {"index": 1, "usage": {"kernel_usage": 45.0, "memory_total": 32768.0, "memory_used": 2000}},
                     ],
                 }
+
+                # The next health checks use the sample
+                psutil.Process.return_value.cpu_percent.return_value = 100
+                assert client.get(url="/health").json()["cpu"] == {"used": 50.0}
+
+
+def test_get_metrics(client):
+    client.get(url="/jobs/unknown")
+    response = client.get(url="/metrics")
+    assert 200 == response.status_code
+    assert response.headers["content-type"].startswith("text/plain")
+    # Routes are reported by their path template
+    assert 'http_requests_total{method="GET",route="/jobs/{job_id}",status="404"}' in response.text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/jobs/{job_id}",le="+Inf"}' in response.text
+    assert "request_limiter_queue_depth 0.0" in response.text
+    assert "process_resident_memory_bytes" in response.text